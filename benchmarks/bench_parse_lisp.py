@@ -0,0 +1,55 @@
+"""
+Benchmark Lisp2Py.parse_lisp against the pyparsing reader it replaced.
+
+Reads every program of the data/python/*.json corpora with both readers, checks
+that they agree, and reports the time each one takes. pyparsing is optional;
+without it only the new reader is timed.
+
+Usage: python benchmarks/bench_parse_lisp.py [--repeats 3]
+"""
+import argparse
+import json
+import pathlib
+import time
+
+from pybrary_extraction.lisp2py import Lisp2Py
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+CORPORA = sorted(PROJECT_DIR.joinpath("data", "python").glob("*.json"))
+
+
+def pyparsing_reader():
+    try:
+        from pyparsing import OneOrMore, nestedExpr
+    except ImportError:
+        return None
+    return lambda lisp_str: OneOrMore(nestedExpr()).parseString(lisp_str).as_list()[0]
+
+
+def best_time(fn, programs, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for program in programs:
+            fn(program)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_read = pyparsing_reader()
+    print(f"{'corpus':<35} {'programs':>8} {'MB':>6} {'parse_lisp (s)':>15} {'pyparsing (s)':>14}")
+    for corpus in CORPORA:
+        with open(corpus) as f:
+            programs = json.load(f)
+        megabytes = sum(len(p) for p in programs) / 1e6
+        seconds = best_time(Lisp2Py.parse_lisp, programs, args.repeats)
+        legacy_seconds = float("nan")
+        if legacy_read is not None:
+            assert all(legacy_read(p) == Lisp2Py.parse_lisp(p) for p in programs), corpus
+            legacy_seconds = best_time(legacy_read, programs, args.repeats)
+        print(f"{corpus.name:<35} {len(programs):>8} {megabytes:>6.2f} {seconds:>15.3f} {legacy_seconds:>14.3f}")
@@ -0,0 +1,72 @@
+"""
+Benchmark Py2Lisp encoding.
+
+Encodes the python sources behind data/python/pythonalgos_ds.json
+(test/resources/data_structures), and synthetic modules with a growing number
+of top-level statements. The time per statement should stay flat as the modules
+grow. For comparison, the statement chains are also built the way Py2Lisp used
+to build them, by wrapping the previous string in a new f-string, which is
+quadratic in the number of statements.
+
+Usage: python benchmarks/bench_py2lisp.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import ast
+import pathlib
+import time
+
+from pybrary_extraction.python2lisp import Py2Lisp
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+DATA_STRUCTURES_DIR = PROJECT_DIR.joinpath("test", "resources", "data_structures")
+
+
+def legacy_constructed_list(program_elements):
+    lisp_str = Py2Lisp.empty_statement_keyword
+    for ele in program_elements[::-1]:
+        lisp_str = f"({Py2Lisp.statement_keyword} {ele} {lisp_str})"
+    return lisp_str
+
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_module(num_statements):
+    return "\n".join(f"x{i} = f(x{i - 1}, {i})" for i in range(num_statements))
+
+
+def bench_corpus(repeats):
+    py_files = Py2Lisp.find_py_files(str(DATA_STRUCTURES_DIR))
+    trees = []
+    for file in py_files:
+        with open(file) as f:
+            trees.append(ast.parse(f.read()))
+    seconds = best_time(lambda: [Py2Lisp().visit(tree) for tree in trees], repeats)
+    print(f"data_structures: {len(trees)} files, {seconds:.3f}s")
+
+
+def bench_synthetic(sizes, repeats):
+    print(f"{'statements':>10} {'encode (s)':>11} {'us/stmt':>8} {'legacy chain (s)':>17} {'chain (s)':>10}")
+    for size in sizes:
+        tree = ast.parse(synthetic_module(size))
+        encode_seconds = best_time(lambda: Py2Lisp().visit(tree), repeats)
+        statements = [Py2Lisp().visit(stmt) for stmt in tree.body]
+        legacy_seconds = best_time(lambda: legacy_constructed_list(statements), repeats)
+        chain_seconds = best_time(lambda: Py2Lisp.generated_constructed_list(statements), repeats)
+        print(f"{size:>10} {encode_seconds:>11.3f} {1e6 * encode_seconds / size:>8.2f} "
+              f"{legacy_seconds:>17.3f} {chain_seconds:>10.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 50000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    bench_corpus(args.repeats)
+    bench_synthetic(args.sizes, args.repeats)
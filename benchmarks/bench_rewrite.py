@@ -0,0 +1,71 @@
+"""
+Benchmark the rewrite phase of Leroy.
+
+Rewrites the encoded programs of test/resources/data_structures, copied until
+there are --files of them, serially and on process pools of growing size. No
+abstractions are applied, so every program goes through the whole of
+Rewrite2Py (programs it fails on are left out). The time should drop close to
+linearly with the number of workers, up to the number of cores.
+
+Usage: python benchmarks/bench_rewrite.py [--files 2000] [--workers 1 2 4 8]
+"""
+import argparse
+import contextlib
+import io
+import pathlib
+import tempfile
+import time
+
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+DATA_STRUCTURES_DIR = PROJECT_DIR.joinpath("test", "resources", "data_structures")
+
+
+def rewrite_seconds(out_dir, file_json_map, string_hashmap, workers):
+    leroy = Leroy(str(DATA_STRUCTURES_DIR), 0, 3, 10, True, False, workers=workers, use_cache=False)
+    leroy.temp_dir = out_dir
+    leroy.file_json_map = file_json_map
+    leroy.string_hashmap = string_hashmap
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        leroy.write_rewritten_programs(list(file_json_map.values()), [])
+    return time.perf_counter() - start
+
+
+def rewrites(lisp_str, string_hashmap):
+    try:
+        Leroy.rewrite_to_py(lisp_str, [], string_hashmap)
+        return True
+    except Exception:
+        return False  # a few programs are not decoded correctly yet.
+
+
+def bench(num_files, workers_list):
+    with contextlib.redirect_stdout(io.StringIO()):
+        encoded, string_hashmap = Py2Lisp.fromDirectoryToJson(str(DATA_STRUCTURES_DIR))
+    string_hashmap = {v: k for k, v in string_hashmap.items()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        programs = [(file, lisp_str) for file, lisp_str in encoded.items()
+                    if rewrites(lisp_str, string_hashmap)]
+    file_json_map = {}
+    for i in range(num_files):
+        file, lisp_str = programs[i % len(programs)]
+        file_json_map[file.replace(".py", f"_{i}.py")] = lisp_str
+
+    print(f"{'workers':>7} {'seconds':>8} {'speedup':>8}")
+    serial_seconds = None
+    for workers in workers_list:
+        with tempfile.TemporaryDirectory() as out_dir:
+            seconds = rewrite_seconds(out_dir, file_json_map, string_hashmap, workers)
+        serial_seconds = serial_seconds or seconds
+        print(f"{workers:>7} {seconds:>8.2f} {serial_seconds / seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    bench(args.files, args.workers)
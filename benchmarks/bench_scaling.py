@@ -0,0 +1,159 @@
+"""
+Measure how Leroy scales with the size of the repository it runs on.
+
+For each of --sizes, generates a synthetic repository of that many files with
+synthetic_corpus.py, and runs Leroy on it in a new process with --profile, so
+that the peak memory of every run starts from scratch. The stitch search is
+one of the stages Leroy profiles. Runs that fail are kept in the results, with
+the stages they finished.
+
+The results go to OUT_DIR/scaling.json. With --plot, the runtime and peak
+memory of every stage are plotted against the number of files, to
+OUT_DIR/plots/scaling_{time,memory}.{pdf,png}. Plotting needs matplotlib and
+seaborn, as experiments/plot.py does; --plot_only plots earlier results again.
+
+Usage: python benchmarks/bench_scaling.py OUT_DIR [--sizes 100 1000 10000] [--duplication 0.3] [--plot]
+"""
+import argparse
+import ast
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+
+from synthetic_corpus import generate_corpus
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+# the stages of a Leroy run, which the others are part of.
+STAGES = ["encoding", "stitch", "abstractions", "rewrite", "manifest"]
+
+
+def corpus_size(paths):
+    lines = 0
+    nodes = 0
+    for path in paths:
+        with open(path) as f:
+            code_str = f.read()
+        lines += code_str.count("\n")
+        nodes += sum(1 for _ in ast.walk(ast.parse(code_str)))
+    return lines, nodes
+
+
+def run_leroy(corpus_dir, profile_path, args):
+    command = [sys.executable, "-m", "pybrary_extraction.leroy",
+               f"--py_files_dir={corpus_dir}", f"--iterations={args.iterations}",
+               f"--max-arity={args.max_arity}", f"--workers={args.workers}",
+               f"--stitch_backend={args.stitch_backend}", "--use_cache=False",
+               f"--profile={profile_path}"]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(PROJECT_DIR), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    process = subprocess.run(command, env=env, stderr=subprocess.PIPE, text=True)
+    return process.returncode, time.perf_counter() - start, process.stderr
+
+
+def sweep(out_dir, args):
+    runs = []
+    for size in args.sizes:
+        corpus_dir = out_dir.joinpath(f"corpus_{size}")
+        profile_path = out_dir.joinpath(f"profile_{size}.json")
+        print(f"{size} files: generating...", file=sys.stderr)
+        paths = generate_corpus(corpus_dir, size, args.duplication, args.mutation, args.depth,
+                                args.files_per_dir, args.seed)
+        lines, nodes = corpus_size(paths)
+        print(f"{size} files: running leroy...", file=sys.stderr)
+        returncode, wall_seconds, stderr = run_leroy(corpus_dir, profile_path, args)
+        run = {"files": size, "lines": lines, "ast_nodes": nodes, "returncode": returncode,
+               "wall_seconds": wall_seconds, "profile": None}
+        if returncode != 0:
+            run["error"] = stderr.strip().splitlines()[-1] if stderr.strip() else None
+            print(f"{size} files: leroy failed: {run['error']}", file=sys.stderr)
+        if profile_path.exists():
+            with open(profile_path) as f:
+                run["profile"] = json.load(f)
+        runs.append(run)
+        if not args.keep_corpora:
+            shutil.rmtree(corpus_dir)
+    return {"settings": {key: value for key, value in vars(args).items() if key != "out_dir"}, "runs": runs}
+
+
+def print_results(results):
+    print(f"{'files':>7} {'lines':>9} {'wall s':>8} " + " ".join(f"{i:>12}" for i in STAGES) + f" {'peak MB':>8}")
+    for run in results["runs"]:
+        stages = run["profile"]["stages"] if run["profile"] else {}
+        peak_rss = run["profile"]["total"]["peak_rss_bytes"] if run["profile"] else None
+        print(f"{run['files']:>7} {run['lines']:>9} {run['wall_seconds']:>8.2f} "
+              + " ".join(f"{stages[i]['wall_seconds']:>12.2f}" if i in stages else f"{'-':>12}" for i in STAGES)
+              + (f" {peak_rss / 2 ** 20:>8.1f}" if peak_rss else f" {'-':>8}"))
+
+
+def plot(results, plots_dir):
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    matplotlib.rcParams['pdf.fonttype'] = 42
+    matplotlib.rcParams['ps.fonttype'] = 42
+    sns.set_theme(color_codes=True)
+    sns.set(font_scale=2)
+    os.makedirs(plots_dir, exist_ok=True)
+
+    runs = [i for i in results["runs"] if i["profile"]]
+    markers = ['o', 's', 'p', 'P', '*', 'D']
+    for measure, label, scale, name in [("wall_seconds", "Runtime (s)", 1, "time"),
+                                        ("peak_rss_bytes", "Peak memory usage (MB)", 2 ** -20, "memory")]:
+        fig = plt.figure(figsize=(10, 10))
+        for stage, marker in zip(STAGES + ["total"], markers):
+            points = [(run["files"], (run["profile"]["total"] if stage == "total" else
+                                      run["profile"]["stages"].get(stage, {})).get(measure))
+                      for run in runs]
+            points = [(files, value * scale) for files, value in points if value is not None]
+            if points:
+                plt.plot(*zip(*points), marker=marker, label=stage, ms=10)
+        plt.xscale('log')
+        plt.yscale('log')
+        plt.legend(loc='best')
+        plt.grid(True, which='minor', alpha=0.5)
+        plt.xlabel('Corpus size (files)')
+        plt.ylabel(label)
+        fig.tight_layout()
+        plt.savefig(plots_dir.joinpath(f"scaling_{name}.pdf"))
+        plt.savefig(plots_dir.joinpath(f"scaling_{name}.png"))
+        plt.close(fig)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 300, 1000, 3000, 10000])
+    parser.add_argument("--duplication", type=float, default=0.3)
+    parser.add_argument("--mutation", type=float, default=0.2)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--files_per_dir", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--max_arity", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stitch_backend", default="auto")
+    parser.add_argument("--keep_corpora", action="store_true", help="keep the generated repositories.")
+    parser.add_argument("--plot", action="store_true")
+    parser.add_argument("--plot_only", action="store_true", help="plot OUT_DIR/scaling.json, without running.")
+    args = parser.parse_args()
+
+    out_dir = pathlib.Path(args.out_dir)
+    results_path = out_dir.joinpath("scaling.json")
+    if args.plot_only:
+        with open(results_path) as f:
+            results = json.load(f)
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        results = sweep(out_dir, args)
+        with open(results_path, "w") as f:
+            json.dump(results, f, indent=2)
+    print_results(results)
+    if args.plot or args.plot_only:
+        try:
+            plot(results, out_dir.joinpath("plots"))
+        except ImportError as e:
+            sys.exit(f"Cannot plot without {e.name}. The results are in {results_path}.")
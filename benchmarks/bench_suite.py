@@ -0,0 +1,364 @@
+"""
+Benchmark suite for pybrary_extraction, with json output to compare runs against.
+
+Benchmarks:
+- py2lisp: Py2Lisp over the python files of test/resources/data_structures.
+- lisp2py: Lisp2Py.convert over the programs of data/python/pythonalgos_*.json.
+- rewrite2py: Rewrite2Py.convert over the same programs, without abstractions.
+- abstraction2py: Abstraction2Py.convert over benchmarks/data/abstractions.json,
+  abstraction bodies stitch found in those corpora.
+- leroy: Leroy.run on test/resources/simple_project, with the stitch output
+  fixed to benchmarks/data/simple_project_out.json. Regenerate it with
+  --regenerate_out (which needs stitch_core) when the encoding changes.
+
+Programs the decoders fail on are left out. Every benchmark runs once to warm
+up, then --repeats times. The decoders start every run with an empty
+construction cache, shared by the programs of the run as in a Leroy run, so
+no run reuses the nodes of another. Throughput is in ast nodes per second: python ast
+nodes of the sources for py2lisp and leroy, and lisp nodes (atoms) of the
+programs and abstraction bodies for the decoders.
+Peak memory is the peak of python allocations during one more run, traced with
+tracemalloc.
+
+With --baseline, each benchmark is compared with the same one in an earlier
+--out. It regressed if it is slower by more than --threshold and Welch's t-test
+on the times of the two runs gives p < --alpha, or if its peak memory grew by
+more than --threshold. The exit status is 1 if any benchmark regressed.
+
+Usage:
+  python benchmarks/bench_suite.py --out baseline.json
+  python benchmarks/bench_suite.py --baseline baseline.json [--out new.json] [--only py2lisp leroy]
+"""
+import abc
+import argparse
+import ast
+import contextlib
+import io
+import json
+import math
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.lisp2py import Abstraction2Py, Lisp2Py, Rewrite2Py
+from pybrary_extraction.lisp2py.Lisp2Py import ConstructionCache
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
+from pybrary_extraction.python2lisp import Py2Lisp
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+DATA_DIR = pathlib.Path(__file__).parent.joinpath("data")
+DATA_STRUCTURES_DIR = PROJECT_DIR.joinpath("test", "resources", "data_structures")
+SIMPLE_PROJECT_DIR = PROJECT_DIR.joinpath("test", "resources", "simple_project")
+CORPORA = sorted(PROJECT_DIR.joinpath("data", "python").glob("pythonalgos_*.json"))
+ABSTRACTIONS_FILE = DATA_DIR.joinpath("abstractions.json")
+LEROY_OUT_FILE = DATA_DIR.joinpath("simple_project_out.json")
+# the stitch flags of LEROY_OUT_FILE, and of the Leroy run on it.
+LEROY_ITERATIONS = 1
+LEROY_MAX_ARITY = 3
+VERSION = 2
+
+
+def ast_nodes(tree):
+    return sum(1 for _ in ast.walk(tree))
+
+
+def lisp_nodes(lisp_str):
+    return sum(1 for token in LispReader.tokenize(lisp_str) if token not in "()")
+
+
+def quietly(fn, *args):
+    """Call `fn`, without what it prints, which is not what we measure."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+def decodes(fn, *args):
+    try:
+        quietly(fn, *args)
+        return True
+    except Exception:
+        return False  # a few programs are not decoded correctly yet.
+
+
+class Benchmark(abc.ABC):
+    """The code to time, with what it works on: `setup` returns the number of items
+    and of ast nodes that one `run` handles."""
+
+    @abc.abstractmethod
+    def setup(self):
+        pass
+
+    @abc.abstractmethod
+    def run(self):
+        pass
+
+    def teardown(self):
+        pass
+
+
+class Py2LispBenchmark(Benchmark):
+    def setup(self):
+        self.sources = []
+        for file in Py2Lisp.find_py_files(str(DATA_STRUCTURES_DIR)):
+            with open(file) as f:
+                self.sources.append(f.read())
+        return len(self.sources), sum(ast_nodes(ast.parse(i)) for i in self.sources)
+
+    def run(self):
+        string_hash_map = {}
+        for source in self.sources:
+            Py2Lisp(string_hash_map=string_hash_map).visit(ast.parse(source))
+
+
+def corpus_programs():
+    programs = []
+    for corpus in CORPORA:
+        with open(corpus) as f:
+            programs += json.load(f)
+    return programs
+
+
+class Lisp2PyBenchmark(Benchmark):
+    def setup(self):
+        self.programs = [i for i in corpus_programs() if decodes(lambda: Lisp2Py(i).convert())]
+        return len(self.programs), sum(lisp_nodes(i) for i in self.programs)
+
+    def run(self):
+        construction_cache = ConstructionCache()
+        for program in self.programs:
+            Lisp2Py(program, construction_cache=construction_cache).convert(quiet=True)
+
+
+class Rewrite2PyBenchmark(Benchmark):
+    def setup(self):
+        self.programs = [i for i in corpus_programs() if decodes(lambda: self.rewrite(i).convert())]
+        return len(self.programs), sum(lisp_nodes(i) for i in self.programs)
+
+    @staticmethod
+    def rewrite(program, construction_cache=None):
+        return Rewrite2Py(program, available_abstractions=[], construction_cache=construction_cache)
+
+    def run(self):
+        construction_cache = ConstructionCache()
+        for program in self.programs:
+            self.rewrite(program, construction_cache).convert(quiet=True)
+
+
+class Abstraction2PyBenchmark(Benchmark):
+    def setup(self):
+        with open(ABSTRACTIONS_FILE) as f:
+            self.bodies = [i["body"] for i in json.load(f)]
+        return len(self.bodies), sum(lisp_nodes(i) for i in self.bodies)
+
+    @staticmethod
+    def convert(body):
+        return Abstraction2Py(StitchAbstraction(body, [], "fn_0", {}), {}).convert()
+
+    def run(self):
+        for body in self.bodies:
+            self.convert(body)
+
+
+class LeroyBenchmark(Benchmark):
+    def setup(self):
+        self.temp_dir = pathlib.Path(tempfile.mkdtemp(prefix="leroy_bench_"))
+        self.leroy = Leroy(str(SIMPLE_PROJECT_DIR), LEROY_ITERATIONS, LEROY_MAX_ARITY, 10, True, False,
+                           use_cache=False)
+        self.leroy.temp_dir = self.temp_dir
+        shutil.copy(LEROY_OUT_FILE, self.temp_dir.joinpath(self.leroy.stitch_outfile))
+        self.leroy.stitch_out = self.leroy.read_stitch_out()
+        py_files = Py2Lisp.find_py_files(str(SIMPLE_PROJECT_DIR))
+        nodes = 0
+        for file in py_files:
+            with open(file) as f:
+                nodes += ast_nodes(ast.parse(f.read()))
+        return len(py_files), nodes
+
+    def run(self):
+        quietly(self.leroy.run)
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+BENCHMARKS = {
+    "py2lisp": Py2LispBenchmark,
+    "lisp2py": Lisp2PyBenchmark,
+    "rewrite2py": Rewrite2PyBenchmark,
+    "abstraction2py": Abstraction2PyBenchmark,
+    "leroy": LeroyBenchmark,
+}
+
+
+def run_benchmark(benchmark: Benchmark, repeats):
+    items, nodes = benchmark.setup()
+    try:
+        benchmark.run()  # warm up.
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            benchmark.run()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            benchmark.run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        benchmark.teardown()
+    mean = statistics.fmean(times)
+    return {
+        "items": items,
+        "ast_nodes": nodes,
+        "times_seconds": times,
+        "mean_seconds": mean,
+        "stdev_seconds": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "min_seconds": min(times),
+        "nodes_per_second": nodes / mean if mean else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def run_suite(names, repeats):
+    results = {}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = run_benchmark(BENCHMARKS[name](), repeats)
+    return {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "benchmarks": results,
+    }
+
+
+def incomplete_beta(x, a, b):
+    """The regularized incomplete beta function I_x(a, b), by its continued fraction
+    (Numerical Recipes, 6.4)."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1 - incomplete_beta(1 - x, b, a)  # the fraction converges fast on this side.
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)) / a
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1) < 1e-12:
+            break
+    return front * fraction
+
+
+def welch_t_test(xs, ys):
+    """The two-sided p-value of Welch's t-test, that the means of `xs` and `ys` are equal."""
+    if len(xs) < 2 or len(ys) < 2:
+        return 1.0
+    x_error = statistics.variance(xs) / len(xs)
+    y_error = statistics.variance(ys) / len(ys)
+    difference = statistics.fmean(xs) - statistics.fmean(ys)
+    if x_error + y_error == 0:
+        return 1.0 if difference == 0 else 0.0
+    t = difference / math.sqrt(x_error + y_error)
+    # Welch-Satterthwaite degrees of freedom.
+    df = (x_error + y_error) ** 2 / (x_error ** 2 / (len(xs) - 1) + y_error ** 2 / (len(ys) - 1))
+    return incomplete_beta(df / (df + t * t), df / 2, 0.5)
+
+
+def compare(baseline, current, alpha, threshold):
+    """Print how each benchmark changed since `baseline`. Returns the names of those that regressed."""
+    regressed = []
+    print(f"{'benchmark':<15} {'base ms':>9} {'new ms':>9} {'time':>8} {'p':>7} "
+          f"{'base MB':>8} {'new MB':>8} {'memory':>8}  verdict")
+    for name, new in current["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"{name:<15} not in the baseline")
+            continue
+        time_change = new["mean_seconds"] / base["mean_seconds"] - 1
+        memory_change = new["peak_memory_bytes"] / base["peak_memory_bytes"] - 1 if base["peak_memory_bytes"] else 0
+        p = welch_t_test(base["times_seconds"], new["times_seconds"])
+        verdicts = []
+        if p < alpha and time_change > threshold:
+            verdicts.append("slower")
+        elif p < alpha and time_change < -threshold:
+            verdicts.append("faster")
+        if memory_change > threshold:
+            verdicts.append("more memory")
+        elif memory_change < -threshold:
+            verdicts.append("less memory")
+        if new["items"] != base["items"]:
+            verdicts.append(f"items {base['items']} -> {new['items']}")
+        if "slower" in verdicts or "more memory" in verdicts:
+            regressed.append(name)
+        print(f"{name:<15} {1e3 * base['mean_seconds']:>9.2f} {1e3 * new['mean_seconds']:>9.2f} "
+              f"{time_change:>+8.1%} {p:>7.4f} {base['peak_memory_bytes'] / 2 ** 20:>8.2f} "
+              f"{new['peak_memory_bytes'] / 2 ** 20:>8.2f} {memory_change:>+8.1%}  {', '.join(verdicts) or 'same'}")
+    return regressed
+
+
+def print_results(results):
+    print(f"{'benchmark':<15} {'items':>6} {'nodes':>8} {'mean ms':>9} {'stdev ms':>9} {'knodes/s':>9} {'peak MB':>8}")
+    for name, result in results["benchmarks"].items():
+        print(f"{name:<15} {result['items']:>6} {result['ast_nodes']:>8} {1e3 * result['mean_seconds']:>9.2f} "
+              f"{1e3 * result['stdev_seconds']:>9.2f} {result['nodes_per_second'] / 1e3:>9.1f} "
+              f"{result['peak_memory_bytes'] / 2 ** 20:>8.2f}")
+
+
+def regenerate_leroy_out():
+    import stitch_core
+    file_json_map, _ = quietly(Py2Lisp.fromDirectoryToJson, str(SIMPLE_PROJECT_DIR))
+    stitch_out = stitch_core.compress(list(file_json_map.values()), iterations=LEROY_ITERATIONS,
+                                      max_arity=LEROY_MAX_ARITY, silent=True, no_opt_arity_zero=True).json
+    stitch_out["cmd"] = None  # the command line of this process.
+    with open(LEROY_OUT_FILE, "w") as f:
+        json.dump(stitch_out, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--out", help="write the results to this json file.")
+    parser.add_argument("--baseline", help="compare the results with this json file of an earlier run.")
+    parser.add_argument("--alpha", type=float, default=0.01, help="significance level of the t-test.")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="smallest relative change in time or memory that counts.")
+    parser.add_argument("--regenerate_out", action="store_true",
+                        help=f"write {LEROY_OUT_FILE.name} again with stitch_core, and exit.")
+    args = parser.parse_args()
+
+    if args.regenerate_out:
+        regenerate_leroy_out()
+        sys.exit(0)
+    results = run_suite(args.only, args.repeats)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    print_results(results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("version") != VERSION:
+            sys.exit(f"{args.baseline} is from another version of this suite.")
+        if compare(baseline, results, args.alpha, args.threshold):
+            sys.exit(1)
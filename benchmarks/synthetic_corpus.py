@@ -0,0 +1,149 @@
+"""
+Generate a synthetic python repository from test/resources/data_structures.
+
+Every file is one of the data_structures sources, mutated: each identifier the
+file defines is renamed, and each number changed, with probability --mutation.
+A fraction --duplication of the files are instead clones of a file generated
+before them, mutated the same way, so that they are near-miss clones of it
+(exact clones with --mutation 0). The files are spread over a directory tree
+--depth levels deep, with at most --files_per_dir files in a directory.
+
+The same arguments and --seed always generate the same repository.
+
+Usage: python benchmarks/synthetic_corpus.py OUT_DIR [--files 1000] [--duplication 0.3] [--depth 3]
+"""
+import argparse
+import ast
+import builtins
+import os
+import pathlib
+import random
+import shutil
+
+from pybrary_extraction.python2lisp import Py2Lisp
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent
+DATA_STRUCTURES_DIR = PROJECT_DIR.joinpath("test", "resources", "data_structures")
+
+
+def defined_names(tree):
+    """The names `tree` binds: its functions, classes, arguments and assigned variables."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+    # dunder methods, and `self`, keep their meaning only under their own names.
+    return {i for i in names if not i.startswith("__") and i not in ("self", "cls") and not hasattr(builtins, i)}
+
+
+class Mutate(ast.NodeTransformer):
+    """Rename the names a module defines, consistently, and change its numbers."""
+
+    def __init__(self, renames, rng, mutation):
+        self.renames = renames
+        self.rng = rng
+        self.mutation = mutation
+
+    def rename(self, name):
+        return self.renames.get(name, name)
+
+    def visit_Name(self, node):
+        node.id = self.rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self.rename(node.arg)
+        self.generic_visit(node)
+        return node
+
+    def visit_FunctionDef(self, node):
+        node.name = self.rename(node.name)
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        node.name = self.rename(node.name)
+        self.generic_visit(node)
+        return node
+
+    def visit_Attribute(self, node):
+        # methods and fields of the classes the module defines.
+        if isinstance(node.value, ast.Name) and node.value.id in ("self", "cls"):
+            node.attr = self.rename(node.attr)
+        self.generic_visit(node)
+        return node
+
+    def visit_Constant(self, node):
+        if type(node.value) is int and self.rng.random() < self.mutation:
+            node.value += self.rng.randint(1, 9)
+        return node
+
+
+def mutate(code_str, rng, mutation, suffix):
+    tree = ast.parse(code_str)
+    renames = {name: f"{name}_{suffix}" for name in sorted(defined_names(tree)) if rng.random() < mutation}
+    return ast.unparse(Mutate(renames, rng, mutation).visit(tree))
+
+
+def file_path(out_dir, index, depth, files_per_dir):
+    """The path of the `index`th file: the directories fill up one after another,
+    `files_per_dir` files and subdirectories in each."""
+    directories = []
+    directory = index // files_per_dir
+    for _ in range(depth):
+        directories.append(f"pkg_{directory % files_per_dir}")
+        directory //= files_per_dir
+    return out_dir.joinpath(*reversed(directories), f"module_{index}.py")
+
+
+def generate_corpus(out_dir, files, duplication=0.3, mutation=0.2, depth=3, files_per_dir=20, seed=0):
+    """Write a repository of `files` python files to `out_dir`, replacing what is there.
+    Returns the paths of the files."""
+    out_dir = pathlib.Path(out_dir)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    rng = random.Random(seed)
+    sources = []
+    for source_file in Py2Lisp.find_py_files(str(DATA_STRUCTURES_DIR)):
+        with open(source_file) as f:
+            code_str = f.read()
+        if code_str.strip():
+            sources.append(code_str)
+
+    paths = []
+    for index in range(files):
+        if paths and rng.random() < duplication:
+            # read back from the file, to not hold the whole repository in memory.
+            with open(rng.choice(paths)) as f:
+                original = f.read()
+        else:
+            original = rng.choice(sources)
+        code_str = mutate(original, rng, mutation, index)
+        path = file_path(out_dir, index, depth, files_per_dir)
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(code_str + "\n")
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--duplication", type=float, default=0.3,
+                        help="fraction of the files that clone an earlier one.")
+    parser.add_argument("--mutation", type=float, default=0.2,
+                        help="probability that a name or number of a file is changed.")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the directory tree.")
+    parser.add_argument("--files_per_dir", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.out_dir, args.files, args.duplication, args.mutation, args.depth,
+                            args.files_per_dir, args.seed)
+    print(f"wrote {len(paths)} files to {args.out_dir}")
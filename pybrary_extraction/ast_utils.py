@@ -100,6 +100,10 @@ def get_all_ast_classes():
     return [i for i in dir(ast) if i not in invalid and not i.startswith("_")]
 
 
+# the names of get_all_ast_classes, to look up in.
+AST_CLASSES = frozenset(get_all_ast_classes())
+
+
 def line_col(string, index):
     """Returns a 2-tuple which translates string index 'index' into
        line and column counts. 'index' is a normal Python 0-based index;
@@ -122,22 +126,3 @@ class StringReplacer(ast.NodeTransformer):
         if node.id in self.string_hashmap:
             return ast.Constant(value=self.string_hashmap[node.id])
         return node
-
-
-class LispVisitor:
-    def generic_visit(self, lisp_root):
-        if isinstance(lisp_root, list):
-            new_list = []
-            for node in lisp_root:
-                new_list.append(self.visit(node))
-            return new_list
-        else:
-            return lisp_root
-
-    def visit(self, lisp_root):
-        if isinstance(lisp_root, list) and len(lisp_root):
-            if isinstance(lisp_root[0], str):
-                fn_name = "visit_"+lisp_root[0]
-                fn = getattr(self, fn_name, self.generic_visit)
-                return fn(lisp_root)
-        return lisp_root
\ No newline at end of file
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.stitch_output import StitchOutputFile, write_stitch_output
+
+
+class DiskCache:
+    """
+    A directory of json entries, addressed by a hex key.
+
+    Reading an entry marks it as recently used, so `evict` drops entries
+    that are older than `max_age_seconds` first and then the least recently
+    used ones until the directory fits in `max_size_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=None, max_age_seconds=None):
+        self.cache_dir = str(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            digest.update(part)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        os.utime(path)  # mark as recently used.
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so that concurrent readers never see half an entry.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    def entries(self):
+        """(path, size, last used) of every entry."""
+        entries = []
+        for folder, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                path = os.path.join(folder, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """Remove stale entries. Returns the number of entries removed."""
+        entries = sorted(self.entries(), key=lambda x: x[2])  # least recently used first.
+        removed = 0
+        if self.max_age_seconds is not None:
+            oldest_allowed = time.time() - self.max_age_seconds
+            while entries and entries[0][2] < oldest_allowed:
+                DiskCache.remove(entries.pop(0)[0])
+                removed += 1
+        if self.max_size_bytes is not None:
+            total_size = sum(size for _, size, _ in entries)
+            while entries and total_size > self.max_size_bytes:
+                path, size, _ = entries.pop(0)
+                DiskCache.remove(path)
+                total_size -= size
+                removed += 1
+        return removed
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class EncodingCache(DiskCache):
+    """
+    Per-file lisp encodings, keyed by the file contents, the encoder version
+    and `mangle_names`. Each entry holds the lisp string with file-local
+    string ids and the file's string literals (see `Py2Lisp.encode_source_with_local_strings`).
+    """
+    DEFAULT_MAX_SIZE_BYTES = 512 * 1024 * 1024
+    DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+    def __init__(self, cache_dir,
+                 max_size_bytes=DEFAULT_MAX_SIZE_BYTES,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        super().__init__(cache_dir, max_size_bytes, max_age_seconds)
+
+    @staticmethod
+    def encoding_key(code_str, mangle_names):
+        return DiskCache.hash_key(
+            code_str.encode("utf-8", "surrogatepass"),
+            str(Py2Lisp.encoder_version),
+            str(bool(mangle_names)))
+
+    def get_encoding(self, code_str, mangle_names):
+        entry = self.get(EncodingCache.encoding_key(code_str, mangle_names))
+        if entry is None:
+            return None
+        return entry["lisp"], entry["strings"]
+
+    def put_encoding(self, code_str, mangle_names, lisp_str, local_strings):
+        self.put(EncodingCache.encoding_key(code_str, mangle_names),
+                 {"lisp": lisp_str, "strings": local_strings})
+
+
+class ResultCache(DiskCache):
+    """
+    Stitch outputs, keyed by the programs, in order, and every flag stitch ran with.
+    Holds one entry per corpus and configuration, so switching between a few
+    configurations reuses each one's earlier output.
+    """
+    DEFAULT_MAX_SIZE_BYTES = 2 * 1024 * 1024 * 1024
+    DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+    def __init__(self, cache_dir,
+                 max_size_bytes=DEFAULT_MAX_SIZE_BYTES,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        super().__init__(cache_dir, max_size_bytes, max_age_seconds)
+
+    @staticmethod
+    def result_key(programs, flags):
+        return DiskCache.hash_key(
+            json.dumps(flags, sort_keys=True),
+            str(len(programs)),
+            *programs)
+
+    def get_result(self, programs, flags):
+        """The cached output, as a `StitchOutputFile` that reads the entry on demand. Copy it
+        before the next `evict`."""
+        path = self.path_for(ResultCache.result_key(programs, flags))
+        try:
+            os.utime(path)  # mark as recently used.
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return StitchOutputFile(path)
+
+    def put_result(self, programs, flags, stitch_out):
+        """`stitch_out` is a dict or a `StitchOutputFile`, which is copied without being loaded."""
+        path = self.path_for(ResultCache.result_key(programs, flags))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_stitch_output(path, stitch_out)
@@ -0,0 +1,98 @@
+import struct
+import zlib
+
+from pybrary_extraction.incremental import program_cost
+from pybrary_extraction.lisp2py.LispReader import LispReader
+
+
+def atom_hash(atom):
+    return zlib.crc32(atom.encode("utf-8", "surrogatepass"))
+
+
+# the hash of a leaf that is not the head of a list: any name, string or constant.
+LEAF_HASH = atom_hash("?")
+
+
+def subtree_hashes(lisp_str, min_atoms):
+    """The hashes of the subtrees of a program with at least `min_atoms` atoms, in post-order.
+    A hash is of the shape of a subtree: the heads of its lists, and where its other leaves are,
+    but not what they are, as these are where an abstraction's holes usually are."""
+    hashes = []
+    # for every open list: the hashes of its children so far, and its atoms so far.
+    stack = []
+    for token in LispReader.tokenize(lisp_str):
+        if token == "(":
+            stack.append(([], 0))
+        elif token == ")":
+            child_hashes, atoms = stack.pop()
+            node_hash = zlib.crc32(struct.pack(f"<{len(child_hashes)}I", *child_hashes))
+            if atoms >= min_atoms:
+                hashes.append(node_hash)
+            if not stack:
+                break
+            stack[-1][0].append(node_hash)
+            stack[-1] = (stack[-1][0], stack[-1][1] + atoms)
+        elif stack:
+            stack[-1][0].append(atom_hash(token) if not stack[-1][0] else LEAF_HASH)
+            stack[-1] = (stack[-1][0], stack[-1][1] + 1)
+    return hashes
+
+
+def repeated_programs(programs, min_atoms):
+    """Which of `programs` have a subtree of at least `min_atoms` atoms whose shape is repeated
+    in the corpus, in another program or in the same one. The others share nothing stitch could
+    abstract over with an abstraction of that many atoms, with holes only at leaves. A hash
+    collision only keeps a program it need not keep."""
+    program_hashes = []
+    counts = {}
+    for program in programs:
+        hashes = subtree_hashes(program, min_atoms)
+        for subtree_hash in hashes:
+            counts[subtree_hash] = counts.get(subtree_hash, 0) + 1
+        program_hashes.append(set(hashes))
+    return [any(counts[i] > 1 for i in hashes) for hashes in program_hashes]
+
+
+class CloneFilter:
+    """
+    Runs stitch only on the programs that repeat some of their structure in the corpus.
+    Most files of a repository share no large subtree with any other, and only grow
+    stitch's search. The others pass through as they are: their rewritten program is the
+    original one. The stitch output is then that of the whole corpus, in its order.
+
+    The filter is a heuristic: an abstraction with a hole in place of a larger subtree can
+    match programs that share no shape of `min_atoms` atoms, and those are not rewritten
+    with it.
+    """
+
+    def __init__(self, min_atoms):
+        self.min_atoms = min_atoms
+
+    def settings(self):
+        """What the result depends on, besides the programs and stitch's flags."""
+        return {"min_atoms": self.min_atoms}
+
+    def compress(self, file_json_map, compress):
+        """The stitch output for `file_json_map`, from `compress`, which compresses a file
+        json map of the repeated programs."""
+        files = list(file_json_map)
+        kept = repeated_programs(list(file_json_map.values()), self.min_atoms)
+        print(f"Compressing the {sum(kept)} of {len(files)} files with repeated structure.")
+        stitch_out = compress({file: file_json_map[file] for file, keep in zip(files, kept) if keep}) \
+            if any(kept) else {"rewritten": [], "abstractions": []}
+
+        passed_through = [file_json_map[file] for file, keep in zip(files, kept) if not keep]
+        spliced = {key: stitch_out[key] for key in stitch_out.keys()}
+        spliced["original"] = list(file_json_map.values())
+        for key in ["rewritten", "rewritten_dreamcoder"]:
+            # a program without abstractions reads the same in dreamcoder's format.
+            if spliced.get(key) is not None:
+                rewritten_kept = iter(spliced[key])
+                spliced[key] = [next(rewritten_kept) if keep else file_json_map[file]
+                                for file, keep in zip(files, kept)]
+        if "original_cost" in spliced and "final_cost" in spliced:
+            passed_cost = sum(program_cost(i) for i in passed_through)
+            spliced["original_cost"] += passed_cost
+            spliced["final_cost"] += passed_cost
+            spliced["compression_ratio"] = spliced["original_cost"] / spliced["final_cost"]
+        return spliced
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from pybrary_extraction.lisp2py.LispReader import LispReader
+
+# stitch's default costs of a primitive and of an application.
+COST_PRIM = 100
+COST_APP = 1
+
+
+def program_cost(lisp_str):
+    """The cost stitch gives a program without lambdas or variables, as in its
+    original_cost and final_cost. Every list of n items is n - 1 curried
+    applications, which adds up to one application less than there are atoms."""
+    atoms = sum(1 for token in LispReader.tokenize(lisp_str) if token not in "()")
+    return (COST_PRIM + COST_APP) * atoms - COST_APP
+
+
+def file_hash(code_str):
+    return hashlib.sha256(code_str.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class LeroyManifest:
+    """
+    What the last full Leroy run produced: the abstractions of its library,
+    the string table of the encodings, and the hash and stitch costs of every
+    python file. An incremental run uses it to encode and rewrite only the
+    files that changed, against the same library.
+    """
+    VERSION = 2
+    FILENAME = "leroy_manifest.json"
+
+    def __init__(self, py_files_dir, flags, mangle_names, string_hashmap,
+                 stitch_abstractions, abstractions, files, full_compression_ratio=None, granularity="file"):
+        self.py_files_dir = py_files_dir
+        self.flags = flags
+        self.mangle_names = mangle_names
+        # what a program of the corpus was, a whole file or a definition, as in `Leroy.granularity`.
+        self.granularity = granularity
+        # string -> STRING_n id, as returned by `Py2Lisp.fromDirectoryToJson`.
+        self.string_hashmap = string_hashmap
+        # name, body, arity and dreamcoder form of each abstraction, as stitch output them.
+        self.stitch_abstractions = stitch_abstractions
+        # `StitchAbstraction.to_json` of each abstraction.
+        self.abstractions = abstractions
+        # file path -> {"hash", "original_cost", "rewritten_cost"}
+        self.files = files
+        # compression ratio right after the full run, to measure the drift of incremental runs against.
+        self.full_compression_ratio = full_compression_ratio
+
+    def compression_ratio(self):
+        original_cost = sum(i["original_cost"] for i in self.files.values())
+        rewritten_cost = sum(i["rewritten_cost"] for i in self.files.values())
+        return original_cost / rewritten_cost if rewritten_cost else 1.0
+
+    def set_file(self, file, code_str, original_lisps, rewritten_lisps):
+        """Record a file, from its programs: the whole file, or its pieces."""
+        self.files[file] = {
+            "hash": file_hash(code_str),
+            "original_cost": sum(program_cost(i) for i in original_lisps),
+            "rewritten_cost": sum(program_cost(i) for i in rewritten_lisps),
+        }
+
+    def is_compatible(self, py_files_dir, flags, mangle_names, granularity):
+        """Whether the library was extracted from the same directory, with the same settings."""
+        return self.py_files_dir == py_files_dir and self.flags == flags and self.mangle_names == mangle_names \
+            and self.granularity == granularity
+
+    def to_json(self):
+        return {
+            "version": LeroyManifest.VERSION,
+            "py_files_dir": self.py_files_dir,
+            "flags": self.flags,
+            "mangle_names": self.mangle_names,
+            "granularity": self.granularity,
+            "string_hashmap": self.string_hashmap,
+            "stitch_abstractions": self.stitch_abstractions,
+            "abstractions": self.abstractions,
+            "files": self.files,
+            "full_compression_ratio": self.full_compression_ratio,
+        }
+
+    def write(self, directory):
+        # write to a temporary file first, so that an interrupted run leaves the old manifest.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.to_json(), f)
+        os.replace(temp_path, os.path.join(directory, LeroyManifest.FILENAME))
+
+    @staticmethod
+    def read(directory):
+        """The manifest in `directory`, or None if there is none from this version of Leroy."""
+        try:
+            with open(os.path.join(directory, LeroyManifest.FILENAME)) as f:
+                manifest_json = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if manifest_json.pop("version", None) != LeroyManifest.VERSION:
+            return None
+        return LeroyManifest(**manifest_json)
@@ -1,12 +1,24 @@
-import json
+import concurrent.futures
+import itertools
+import sys
+
 import click
-import subprocess
 import pathlib
 import os
 import shutil
 
+from pybrary_extraction import profiling
 from pybrary_extraction.python2lisp import Py2Lisp
-from pybrary_extraction.lisp2py import Abstraction2Py, Rewrite2Py, Lisp2Py
+from pybrary_extraction.cache import EncodingCache, ResultCache
+from pybrary_extraction.incremental import LeroyManifest, file_hash
+from pybrary_extraction.stitch_output import StitchOutputFile, write_stitch_output
+from pybrary_extraction.clone_filter import CloneFilter
+from pybrary_extraction.program_pieces import GRANULARITIES, assemble_program, join_program, piece_count, \
+    split_programs
+from pybrary_extraction.sharding import ShardedCompression
+from pybrary_extraction.stitch_runner import StitchRunner
+from pybrary_extraction.lisp2py import AbstractionLibrary, Abstraction2Py, Rewrite2Py, Lisp2Py, DecodedCorpus
+from pybrary_extraction.lisp2py.Lisp2Py import ConstructionCache
 from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
 
 
@@ -17,12 +29,43 @@ def try_make_parent_dir(new_file_path):
         pass
 
 
+# (abstraction library, string hashmap, construction cache) of a rewrite worker process, set once
+# by `init_rewrite_worker`. It goes with the process, at the end of the run.
+rewrite_context = None
+
+
+def init_rewrite_worker(library, string_hashmap):
+    global rewrite_context
+    rewrite_context = (library, string_hashmap, ConstructionCache())
+    profiling.disable()  # only the parent's stages are reported.
+
+
+def rewrite_in_worker(rewrite):
+    try:
+        return Leroy.rewrite_to_py(rewrite, *rewrite_context)
+    except Exception as e:
+        raise Exception(f"Failed to rewrite: {rewrite}") from e
+
+
+def rewrite_piece_in_worker(rewrite):
+    try:
+        return Leroy.rewrite_piece_to_ast(rewrite, *rewrite_context)
+    except Exception as e:
+        raise Exception(f"Failed to rewrite: {rewrite}") from e
+
+
 class Leroy:
     LIBRARY_NAME = "leroy_library"
+    # programs sent to a rewrite worker at once. More only hold more of them in memory.
+    MAX_REWRITE_CHUNKSIZE = 16
 
     def __init__(self, py_files_dir, iterations,
                  max_arity, min_nodes_abstraction,
-                 donot_rerun, mangle_names):
+                 donot_rerun, mangle_names, workers=1,
+                 use_cache=True, cache_dir=None, stitch_backend="auto",
+                 incremental=False, drift_threshold=0.1, shard_by=None, shard_files=1000,
+                 shard_memory_mb=None, shard_cpu_seconds=None, clone_filter=False, granularity="file",
+                 liveness_sample=None):
 
         self.py_files_dir = py_files_dir
         self.min_nodes_abstraction = min_nodes_abstraction
@@ -30,93 +73,327 @@ class Leroy:
         self.max_arity = max_arity
         self.project_base_dir = pathlib.Path(__file__).parent.parent
         self.temp_dir = self.project_base_dir.joinpath("temp")
-        self.temp_filename = "in.json"
         self.stitch_outfile = "out.json"
+        if cache_dir is None:
+            cache_dir = self.project_base_dir.joinpath(".leroy_cache")
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.encoding_cache = EncodingCache(self.cache_dir.joinpath("encodings")) if use_cache else None
+        self.result_cache = ResultCache(self.cache_dir.joinpath("results")) if use_cache else None
 
-        # file path -> lisp-encoded ast
+        # file path -> lisp-encoded ast. With a granularity of "definition", the programs are the
+        # pieces of the files, and `self.layouts` has how each file's pieces go together.
         self.file_json_map = None
+        self.layouts = None
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity!r}, expected one of {GRANULARITIES}")
+        self.granularity = granularity
+        # the most uses of an abstraction its liveness analysis looks at, or None for all of them.
+        self.liveness_sample = liveness_sample
         self.string_hashmap = None
         self.donot_rerun = donot_rerun
         self.mangle_names = mangle_names
+        self.workers = workers
+        self.stitch_runner = StitchRunner(self.project_base_dir, self.temp_dir, stitch_backend)
+        self.sharded_compression = ShardedCompression(
+            self.stitch_runner, shard_by, shard_files, workers, shard_memory_mb, shard_cpu_seconds) \
+            if shard_by is not None else None
+        self.clone_filter = CloneFilter(min_nodes_abstraction) if clone_filter else None
+        self.incremental = incremental
+        self.drift_threshold = drift_threshold
         self.stitch_out = self.read_stitch_out()
+        # the manifest of the last run, which the next incremental run of this Leroy updates
+        # without reading it again.
+        self.manifest = None
+        # the rewritten programs of the last run, in the order of `self.file_json_map`: those of
+        # every file after a full run, and of the changed files after an incremental one.
+        self.rewritten_programs = None
 
     def run(self):
+        if self.incremental and self.run_incremental():
+            return
 
         self.clear_temp_dir()
-        self.file_json_map, string_hashmap = Py2Lisp.fromDirectoryToJson(
-            self.py_files_dir, self.mangle_names)
+        with profiling.stage("encoding"):
+            self.file_json_map, string_hashmap = Py2Lisp.fromDirectoryToJson(
+                self.py_files_dir, self.mangle_names, self.workers, self.encoding_cache)
+            if self.encoding_cache is not None:
+                self.encoding_cache.evict()
+            if self.granularity == "definition":
+                self.file_json_map, self.layouts = split_programs(self.file_json_map)
         self.string_hashmap = {v: k for k, v in string_hashmap.items()}  # reverse for convenience
-        with open(f"{self.temp_dir}/{self.temp_filename}", "w") as f:
-            json.dump(list(self.file_json_map.values()), f, indent=4)
 
-        if not self.donot_rerun and not self.result_is_cached():
-            self.run_stitch()
-        self.write_files()
+        if not self.donot_rerun:
+            with profiling.stage("stitch"):
+                self.run_stitch()
+        stitch_abstractions = self.write_files()
+        with profiling.stage("manifest"):
+            self.write_manifest(stitch_abstractions)
 
-    def run_stitch(self):
-        subprocess.run(
-            [
-                "cargo", "run",
-                "--manifest-path", f"{self.project_base_dir}/Cargo.toml",
-                "--release", '--bin=compress',
-                '--', f'{self.temp_dir}/{self.temp_filename}',
-                f'--iterations={self.iterations}',
-                f'--max-arity={self.max_arity}',
-                f'--out={self.temp_dir}/{self.stitch_outfile}',
-                "--prune-macro-abstractions",
-                "--no-opt-arity-zero",
-                f"--min-nodes-invention={self.min_nodes_abstraction}"
-            ]
+    def run_incremental(self):
+        """Update the outputs of the last full run for the python files that changed since,
+        rewriting them with the same library. Returns False if a full run is needed instead."""
+        manifest = self.manifest if self.manifest is not None else LeroyManifest.read(self.temp_dir)
+        if manifest is None or not manifest.is_compatible(
+                self.py_files_dir, self.stitch_flags(), self.mangle_names, self.granularity):
+            print("No earlier run with the same directory and flags to update, running a full compression.")
+            return False
+
+        sources = {}
+        for file in Py2Lisp.find_py_files(self.py_files_dir):
+            with open(file) as f:
+                sources[file] = f.read()
+        changed_files = [file for file, code_str in sources.items()
+                         if file not in manifest.files or manifest.files[file]["hash"] != file_hash(code_str)]
+        deleted_files = [file for file in manifest.files if file not in sources]
+
+        with profiling.stage("encoding"):
+            self.file_json_map, string_hashmap = Py2Lisp.encode_files(
+                changed_files, self.mangle_names, self.workers, self.encoding_cache, dict(manifest.string_hashmap))
+            if self.granularity == "definition":
+                self.file_json_map, self.layouts = split_programs(self.file_json_map)
+        stitch_rewritten = []
+        if changed_files:
+            self.stitch_runner.temp_dir = self.temp_dir
+            with profiling.stage("stitch"):
+                stitch_rewritten = self.stitch_runner.rewrite(
+                    list(self.file_json_map.values()), manifest.stitch_abstractions)
+        for file, original_lisps, rewritten_lisps in self.file_programs(stitch_rewritten):
+            manifest.set_file(file, sources[file], original_lisps, rewritten_lisps)
+        for file in deleted_files:
+            del manifest.files[file]
+
+        compression_ratio = manifest.compression_ratio()
+        if compression_ratio < manifest.full_compression_ratio * (1 - self.drift_threshold):
+            print(f"The compression ratio dropped from {manifest.full_compression_ratio:.3f} "
+                  f"to {compression_ratio:.3f}, running a full compression.")
+            self.manifest = None  # it has the costs of files whose outputs were not written.
+            return False
+
+        print(f"Updating {len(changed_files)} changed and {len(deleted_files)} deleted files.")
+        self.string_hashmap = {v: k for k, v in string_hashmap.items()}  # reverse for convenience
+        self.write_rewritten_programs(
+            stitch_rewritten, [StitchAbstraction.from_json(i) for i in manifest.abstractions])
+        for file in deleted_files:
+            try:
+                os.remove(self.output_path(file))
+            except FileNotFoundError:
+                pass
+        manifest.string_hashmap = string_hashmap
+        manifest.write(self.temp_dir)
+        self.manifest = manifest
+        self.rewritten_programs = stitch_rewritten
+        return True
+
+    def write_manifest(self, stitch_abstractions):
+        manifest = LeroyManifest(
+            self.py_files_dir, self.stitch_flags(), self.mangle_names,
+            {v: k for k, v in self.string_hashmap.items()},
+            [{key: i[key] for key in ("name", "body", "arity", "dreamcoder") if key in i}
+             for i in self.stitch_out["abstractions"]],
+            [i.to_json() for i in stitch_abstractions],
+            {}, granularity=self.granularity)
+        for file, original_lisps, rewritten_lisps in self.file_programs(self.stitch_out['rewritten']):
+            with open(file) as f:
+                manifest.set_file(file, f.read(), original_lisps, rewritten_lisps)
+        manifest.full_compression_ratio = manifest.compression_ratio()
+        manifest.write(self.temp_dir)
+        self.manifest = manifest
+
+    def stitch_flags(self):
+        """Every flag stitch runs with, and so part of the key of its cached result."""
+        return dict(
+            iterations=self.iterations,
+            max_arity=self.max_arity,
+            prune_macro_abstractions=True,
+            no_opt_arity_zero=True,
+            min_nodes_invention=self.min_nodes_abstraction
         )
 
-        self.stitch_out = self.read_stitch_out()
+    def cache_flags(self):
+        """Everything the stitch result depends on besides the programs, as the key of its cached result."""
+        cache_flags = dict(self.stitch_flags(), stitch=self.stitch_runner.settings())
+        if self.sharded_compression is not None:
+            cache_flags["sharding"] = self.sharded_compression.settings()
+        if self.clone_filter is not None:
+            cache_flags["clone_filter"] = self.clone_filter.settings()
+        return cache_flags
+
+    def run_stitch(self):
+        programs = list(self.file_json_map.values())
+        flags = self.stitch_flags()
+        cache_flags = self.cache_flags()
+        cached = self.result_cache.get_result(programs, cache_flags) if self.result_cache is not None else None
+        if cached is not None:
+            print("Reusing the stitch result of an earlier run with the same programs and flags.")
+            self.set_stitch_out(cached)
+            return
+
+        self.stitch_runner.temp_dir = self.temp_dir
+        if self.clone_filter is not None:
+            self.set_stitch_out(self.clone_filter.compress(
+                self.file_json_map, lambda file_json_map: self.compress(file_json_map, flags)))
+        else:
+            self.set_stitch_out(self.compress(self.file_json_map, flags))
+        if self.result_cache is not None:
+            self.result_cache.put_result(programs, cache_flags, self.stitch_out)
+            self.result_cache.evict()
+
+    def compress(self, file_json_map, flags):
+        if self.sharded_compression is not None:
+            return self.sharded_compression.compress(file_json_map, self.py_files_dir, flags)
+        return self.stitch_runner.compress(list(file_json_map.values()), **flags)
 
     def write_files(self):
 
         stitch_out = self.stitch_out
 
         stitch_rewritten = stitch_out['rewritten']
-        stitch_abstractions = [StitchAbstraction(i['body'], i['uses'], i['name'], self.string_hashmap)
-                               for i in stitch_out["abstractions"]]
-        original_lisp = stitch_out['original']
+        self.rewritten_programs = stitch_rewritten
+        with profiling.stage("abstractions"):
+            stitch_abstractions = [StitchAbstraction(i['body'], i['uses'], i['name'], self.string_hashmap)
+                                   for i in stitch_out["abstractions"]]
+            original_lisp = stitch_out['original']
 
-        self.write_abstractions(stitch_abstractions)
+            self.write_abstractions(stitch_abstractions)
         self.write_rewritten_programs(stitch_rewritten, stitch_abstractions)
+        return stitch_abstractions
 
     def read_stitch_out(self):
-        try:
-            with open(f"{self.temp_dir}/{self.stitch_outfile}") as f:
-                stitch_out = json.load(f)
-            return stitch_out
-        except FileNotFoundError:
-            return
+        out_path = self.temp_dir.joinpath(self.stitch_outfile)
+        if out_path.is_file():
+            return StitchOutputFile(out_path)
+        return None
+
+    def program_counts(self):
+        """(file, number of its programs) of every file, in the order of the programs."""
+        if self.layouts is None:
+            return [(file, 1) for file in self.file_json_map.keys()]
+        return [(file, piece_count(layout)) for file, layout in self.layouts.items()]
+
+    def file_programs(self, stitch_rewritten):
+        """(file, its original programs, its rewritten programs) of every file, in order."""
+        originals = iter(self.file_json_map.values())
+        rewrittens = iter(stitch_rewritten)
+        for file, count in self.program_counts():
+            yield file, list(itertools.islice(originals, count)), list(itertools.islice(rewrittens, count))
 
     def write_rewritten_programs(self, stitch_rewritten,
                                  stitch_abstractions: list[StitchAbstraction]):
-        for file, rewrite in zip(self.file_json_map.keys(), stitch_rewritten):
-            new_file_path = file.replace(self.py_files_dir, str(self.temp_dir))
-            try_make_parent_dir(new_file_path)
-            print(f"{new_file_path=}")
+        """Rewrite the programs on a process pool of `self.workers` processes, if more than one.
+        The files are written in order, with the same content as a serial run. The pieces of
+        a file are rewritten on their own, and put back together here."""
+        with profiling.stage("rewrite"):
+            # looked up by every call of an abstraction, in every program.
+            library = AbstractionLibrary(stitch_abstractions)
+            new_file_paths = [self.output_path(file) for file, _ in self.program_counts()]
+            if self.layouts is None:
+                self.write_programs(new_file_paths, self.map_rewrites(
+                    rewrite_in_worker, Leroy.rewrite_to_py, stitch_rewritten, library))
+            else:
+                self.write_programs(new_file_paths, self.assemble_programs(self.map_rewrites(
+                    rewrite_piece_in_worker, Leroy.rewrite_piece_to_ast, stitch_rewritten, library),
+                    library))
 
-            try:
-                py_code = Rewrite2Py(
+    def map_rewrites(self, worker_fn, fn, stitch_rewritten, library):
+        """`fn` of every rewritten program, in order, or `worker_fn` on the process pool."""
+        if self.workers > 1 and len(self.file_json_map) > 1:
+            chunksize = max(1, min(len(self.file_json_map) // (4 * self.workers), Leroy.MAX_REWRITE_CHUNKSIZE))
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=init_rewrite_worker,
+                    initargs=(library, self.string_hashmap)) as executor:
+                yield from Leroy.map_in_windows(
+                    executor, worker_fn, stitch_rewritten, 4 * self.workers * chunksize, chunksize)
+        else:
+            # the nodes of this run's programs, shared between them.
+            construction_cache = ConstructionCache()
+            for rewrite in stitch_rewritten:
+                yield fn(rewrite, library, self.string_hashmap, construction_cache)
+
+    def assemble_programs(self, pieces, library):
+        """The python code of every file, from the decoded pieces of all files, in order."""
+        originals = iter(self.file_json_map.values())
+        for layout in self.layouts.values():
+            count = piece_count(layout)
+            file_pieces = list(itertools.islice(pieces, count))
+            original_pieces = list(itertools.islice(originals, count))
+            yield assemble_program(
+                layout, file_pieces,
+                lambda i: Leroy.rewrite_piece_to_ast(original_pieces[i], library, self.string_hashmap)[0],
+                Leroy.LIBRARY_NAME)
+
+    @staticmethod
+    def map_in_windows(executor, fn, items, window, chunksize):
+        """`executor.map`, but submitting `window` items at a time: `executor.map` takes all
+        of `items` at once, which would read every program of the stitch output into memory."""
+        items = iter(items)
+        while batch := list(itertools.islice(items, window)):
+            yield from executor.map(fn, batch, chunksize=chunksize)
+
+    def output_path(self, file):
+        return file.replace(self.py_files_dir, str(self.temp_dir))
+
+    @staticmethod
+    def write_programs(new_file_paths, py_codes):
+        for new_file_path, py_code in zip(new_file_paths, py_codes):
+            with profiling.stage("write_files"):
+                try_make_parent_dir(new_file_path)
+                # written next to the file, then moved over it, so a reader never sees it half written.
+                with open(f"{new_file_path}.tmp", "w") as f:
+                    f.write(py_code)
+                os.replace(f"{new_file_path}.tmp", new_file_path)
+
+    @staticmethod
+    def rewrite_to_py(rewrite, stitch_abstractions, string_hashmap, construction_cache=None):
+        try:
+            with profiling.stage("rewrite_program"):
+                return Rewrite2Py(
+                    rewrite,
+                    library_name=Leroy.LIBRARY_NAME,
+                    available_abstractions=stitch_abstractions,
+                    string_hashmap=string_hashmap,
+                    construction_cache=construction_cache
+                ).convert(quiet=True)
+        except:
+            print(f"Failed to rewrite: {rewrite}")
+            raise
+
+    @staticmethod
+    def rewrite_piece_to_ast(rewrite, stitch_abstractions, string_hashmap, construction_cache=None):
+        """The statements of a rewritten piece of a file, without the imports of the
+        abstractions they use, and the names of those abstractions."""
+        try:
+            with profiling.stage("rewrite_program"):
+                rewrite2py = Rewrite2Py(
                     rewrite,
                     library_name=Leroy.LIBRARY_NAME,
                     available_abstractions=stitch_abstractions,
-                    string_hashmap=self.string_hashmap
-                ).convert()
-            except:
-                print(f"Failed to rewrite: {rewrite}")
-                raise
+                    string_hashmap=string_hashmap,
+                    construction_cache=construction_cache
+                )
+                rewrite2py.convert(unparse=False, quiet=True)
+        except:
+            print(f"Failed to rewrite: {rewrite}")
+            raise
+        abstractions_used = sorted(rewrite2py.abstractions_used)
+        return rewrite2py.converted_ast.body[len(abstractions_used):], abstractions_used
 
-            print(py_code)
-            with open(new_file_path, "w") as f:
-                f.write(py_code)
+    def original_programs(self):
+        """The original program of every file, for the liveness analysis. The pieces of a file are
+        put back together, so that a variable read in another piece, or after the statements of a
+        class body, is live out."""
+        if self.layouts is None:
+            return self.stitch_out['original']
+        pieces = iter(self.file_json_map.values())
+        return [join_program(layout, list(itertools.islice(pieces, piece_count(layout))))
+                for layout in self.layouts.values()]
 
     def write_abstractions(self, stitch_abstractions: list[StitchAbstraction]):
         library_functions = []
+        # decode every original program once, for all abstractions.
+        originals = DecodedCorpus(self.original_programs(), self.string_hashmap)
         for i, abstraction in enumerate(stitch_abstractions):
-            abstraction.compute_body_py(self.stitch_out['original'])
+            with profiling.stage("decode_abstraction", abstraction.abstraction_name):
+                abstraction.compute_body_py(originals, self.liveness_sample)
             library_functions.append(
                 abstraction.abstraction_body_py
             )
@@ -124,22 +401,24 @@ class Leroy:
             f.write("\n\n".join(library_functions))
 
     def clear_temp_dir(self):
-        try:
-            shutil.rmtree(self.temp_dir)
-        except FileNotFoundError:
-            pass
-        os.makedirs(self.temp_dir)
+        """Remove the outputs of the last run, but keep its stitch output, for --donot_rerun."""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        for path in self.temp_dir.iterdir():
+            if path.name == self.stitch_outfile:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
         if self.stitch_out:
-            with open(f"{self.temp_dir}/{self.stitch_outfile}", "w") as f:
-                json.dump(self.stitch_out, f, indent=4)
+            self.set_stitch_out(self.stitch_out)
 
-    def result_is_cached(self):
-        if self.stitch_out:
-            replace_equivalent = \
-                ['ProgramStatements' if i == '(ProgramStatements )' else i for i in list(self.file_json_map.values())]
-            if set(self.stitch_out['original']) == set(replace_equivalent):
-                return True
-        return False
+    def set_stitch_out(self, stitch_out):
+        """Keep `stitch_out`, a dict or a `StitchOutputFile`, as out.json in the temp dir, and
+        read it from there on demand."""
+        out_path = self.temp_dir.joinpath(self.stitch_outfile)
+        write_stitch_output(out_path, stitch_out)
+        self.stitch_out = StitchOutputFile(out_path)
 
 
 @click.command()
@@ -153,14 +432,73 @@ class Leroy:
 @click.option("--mangle_names", help='Whether to mangle names or not. '
                                      'To avoid name clashes with the `ast` library.',
               default=False, type=bool)
+@click.option("--workers", help='Number of processes used to encode and to rewrite the python files, and to compress shards.',
+              default=1, type=int)
+@click.option("--use_cache", help='Reuse the encodings of unchanged python files, and the stitch results '
+                                  'of the same programs and flags, from earlier runs.',
+              default=True, type=bool)
+@click.option("--cache_dir", help='Directory for cached results. Defaults to .leroy_cache at the root of this repo.',
+              default=None)
+@click.option("--stitch_backend", help='How to run stitch: in-process through the stitch_core bindings, '
+                                       'a prebuilt compress binary, cargo, or the first of these that works.',
+              default="auto", type=click.Choice(StitchRunner.BACKENDS))
+@click.option("--incremental", help='Only encode and rewrite the python files that changed since the last run, '
+                                    'with its library.',
+              default=False, type=bool)
+@click.option("--drift_threshold", help='In incremental mode, run a full compression instead once the compression '
+                                        'ratio dropped by this fraction since the last full run.',
+              default=0.1, type=float)
+@click.option("--profile", help='Write the wall time, cpu time, calls and peak memory of every stage of the run, '
+                                'in total and per abstraction, to this json file.',
+              default=None)
+@click.option("--profile_trace", help='With --profile, also write every stage as a Chrome trace to this file, '
+                                      'for ui.perfetto.dev.',
+              default=None)
+@click.option("--shard_by", help='Compress a large repository in shards of files from the same package directories, '
+                                 'or that share subtrees, on --workers processes, and merge their libraries.',
+              default=None, type=click.Choice(ShardedCompression.PARTITIONS))
+@click.option("--shard_files", help='With --shard_by, the most python files in a shard.', default=1000, type=int)
+@click.option("--shard_memory_mb", help='With --shard_by, the most memory (address space) the stitch run of a shard '
+                                        'may use. A shard over it adds nothing to the library.',
+              default=None, type=int)
+@click.option("--shard_cpu_seconds", help='With --shard_by, the most cpu time the stitch run of a shard may use.',
+              default=None, type=int)
+@click.option("--clone_filter", help='Only run stitch on the python files that repeat a subtree of at least '
+                                    '--min-nodes-abstraction atoms in the repository. The others are not rewritten.',
+              default=False, type=bool)
+@click.option("--granularity", help='What a program in the stitch corpus is: a whole python file, or a definition: '
+                                   'each top-level function, each method, and each run of other statements.',
+              default="file", type=click.Choice(GRANULARITIES))
+@click.option("--liveness_sample", help='Find the variables an abstraction returns from at most this many of its uses, '
+                                        'spread evenly over them, instead of all of them. Faster for abstractions '
+                                        'with very many uses, but a variable live out of only other uses is missed.',
+              default=None, type=int)
 def run_leroy(
         py_files_dir, iterations, max_arity, min_nodes_abstraction, donot_rerun,
-        mangle_names
+        mangle_names, workers, use_cache, cache_dir, stitch_backend, incremental, drift_threshold,
+        profile, profile_trace, shard_by, shard_files, shard_memory_mb, shard_cpu_seconds, clone_filter,
+        granularity, liveness_sample
 ):
+    profiler = profiling.enable(trace=profile_trace is not None) if profile else None
     l = Leroy(
-        py_files_dir, iterations, max_arity, min_nodes_abstraction, donot_rerun, mangle_names)
-    l.run()
+        py_files_dir, iterations, max_arity, min_nodes_abstraction, donot_rerun, mangle_names,
+        workers, use_cache, cache_dir, stitch_backend, incremental, drift_threshold,
+        shard_by, shard_files, shard_memory_mb, shard_cpu_seconds, clone_filter, granularity, liveness_sample)
+    try:
+        l.run()
+    finally:
+        # also for a run that failed, with the stages it finished.
+        if profiler is not None:
+            profiler.write_report(profile)
+            if profile_trace is not None:
+                profiler.write_trace(profile_trace)
+            print(profiler.summary())
 
 
 if __name__ == '__main__':
-    run_leroy()
+    if sys.argv[1:2] == ["serve"]:
+        # `leroy.py serve [OPTIONS]` keeps Leroy running, and answers requests on a Unix socket.
+        from pybrary_extraction.leroy_server import serve_leroy
+        serve_leroy(sys.argv[2:], prog_name="leroy.py serve")
+    else:
+        run_leroy()
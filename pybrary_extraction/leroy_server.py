@@ -0,0 +1,374 @@
+import ast
+import collections
+import contextlib
+import inspect
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import click
+
+from pybrary_extraction.incremental import file_hash
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.lisp2py import AbstractionLibrary, Rewrite2Py
+from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.stitch_runner import StitchRunner
+
+# JSON-RPC 2.0 error codes.
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class LeroyServer:
+    """
+    Keeps a Leroy run in memory and answers requests about it over a Unix socket,
+    so that editors and hooks do not pay for imports, encoding and reloading
+    stitch's output on every call. The manifest, the string table, the library,
+    and the encoded and rewritten program of every file stay in memory between
+    requests. A file of the corpus that did not change since is decoded once, and
+    is not rewritten again.
+
+    The protocol is JSON-RPC 2.0, one request or response per line. Methods:
+    - rewrite {path | source}: the python code of a file, rewritten with the library.
+    - abstractions {path | source}: the abstractions the rewrite of a file uses,
+      or every abstraction of the library without params.
+    - update: update the outputs for the files that changed, as `--incremental` does.
+    - recompress: run a full compression now.
+    - status: the size of the corpus and of the library.
+    - shutdown: stop the server.
+
+    A watcher thread polls the source tree and runs `update` when a file changes.
+    """
+
+    def __init__(self, leroy: Leroy, socket_path, poll_interval=1.0):
+        self.leroy = leroy
+        self.socket_path = str(socket_path)
+        self.poll_interval = poll_interval
+        # one request, or update, at a time. Leroy's runs are not thread safe.
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.manifest = None
+        self.abstractions = []  # of the current library.
+        self.abstractions_by_name = {}
+        self.library = AbstractionLibrary()  # of the abstractions, for Rewrite2Py.
+        # file path -> (its encoding, its program rewritten with the library), of every file of the corpus.
+        self.corpus = {}
+        # file path -> its `Rewrite2Py`, converted, for the files of the corpus requested since they changed.
+        self.decoded = {}
+        # absolute path -> file path in the manifest, of every file of the corpus.
+        self.corpus_files = {}
+        self.updated_at = None
+        self.sources_snapshot = None
+        self.server = None
+        self.methods = {
+            "rewrite": self.rewrite,
+            "abstractions": self.abstractions_used,
+            "update": self.update,
+            "recompress": self.recompress,
+            "status": self.status,
+            "shutdown": self.shutdown,
+        }
+
+    @contextlib.contextmanager
+    def quiet(self):
+        """Leroy prints the progress of its runs, which a server does not need."""
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    def start(self):
+        """Bring the outputs up to date, then listen on the socket."""
+        with self.lock:
+            self.sources_snapshot = self.take_sources_snapshot()
+            self.run_leroy(incremental=True)
+        try:
+            os.remove(self.socket_path)  # left behind by a server that did not shut down.
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self.server = LeroyRequestServer(self.socket_path, self)
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.stopped.set()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def run_leroy(self, incremental):
+        self.leroy.incremental = incremental
+        with self.quiet():
+            self.leroy.run()
+        if self.leroy.manifest is not self.manifest:
+            # a full run, or the first run of this server: a new manifest, and with it a new library.
+            self.manifest = self.leroy.manifest
+            self.abstractions = [StitchAbstraction.from_json(i) for i in self.manifest.abstractions]
+            self.abstractions_by_name = {i.abstraction_name: i for i in self.abstractions}
+            self.library = AbstractionLibrary(self.abstractions)
+            self.corpus = {}
+            self.decoded = {}
+        for file, original_lisps, rewritten_lisps in self.leroy.file_programs(self.leroy.rewritten_programs):
+            self.corpus[file] = (original_lisps[0], rewritten_lisps[0])
+            self.decoded.pop(file, None)
+        for file in [file for file in self.corpus if file not in self.manifest.files]:
+            del self.corpus[file]
+            self.decoded.pop(file, None)
+        self.corpus_files = {os.path.abspath(file): file for file in self.manifest.files}
+        self.updated_at = time.time()
+
+    def take_sources_snapshot(self):
+        snapshot = {}
+        for file in Py2Lisp.find_py_files(self.leroy.py_files_dir):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            snapshot = self.take_sources_snapshot()
+            if snapshot != self.sources_snapshot:
+                try:
+                    with self.lock:
+                        self.update()
+                except Exception as e:
+                    print(f"Failed to update after a change in {self.leroy.py_files_dir}: {e}")
+
+    def handle(self, request_line):
+        """The response to one request line, or None for a notification."""
+        try:
+            request = json.loads(request_line)
+        except json.JSONDecodeError as e:
+            return LeroyServer.error_response(None, PARSE_ERROR, str(e))
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return LeroyServer.error_response(None, INVALID_REQUEST, "Expected an object with a method.")
+
+        request_id = request.get("id")
+        method = self.methods.get(request["method"])
+        params = request.get("params", {})
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Unknown method {request['method']!r}.")
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, "Expected params by name.")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise RpcError(INVALID_PARAMS, str(e))
+            with self.lock:
+                result = method(**params)
+        except RpcError as e:
+            return LeroyServer.error_response(request_id, e.code, str(e))
+        except Exception as e:
+            return LeroyServer.error_response(request_id, SERVER_ERROR, f"{type(e).__name__}: {e}")
+        if "id" not in request:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    @staticmethod
+    def error_response(request_id, code, message):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+    def resolve_path(self, path):
+        """`path` made absolute. A relative path is relative to the python files directory,
+        since the server does not know the working directory of its clients."""
+        if path is None:
+            return None
+        return os.path.abspath(os.path.join(self.leroy.py_files_dir, path))
+
+    def read_source(self, path, source):
+        if source is not None:
+            return source
+        if path is None:
+            raise RpcError(INVALID_PARAMS, "Expected a path or a source.")
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+    def decode(self, rewritten, string_hashmap) -> Rewrite2Py:
+        rewrite = Rewrite2Py(
+            rewritten,
+            library_name=Leroy.LIBRARY_NAME,
+            available_abstractions=self.library,
+            string_hashmap=string_hashmap)
+        rewrite.convert(unparse=False, quiet=True)
+        return rewrite
+
+    def rewrite_source(self, code_str, path=None) -> Rewrite2Py:
+        """Rewrite `code_str` with the current library, without writing anything. The file at
+        `path`, an absolute path, of the corpus, if `code_str` is still its code, is decoded once
+        and then kept."""
+        file = self.corpus_files.get(path)
+        in_corpus = file is not None and self.manifest.files[file]["hash"] == file_hash(code_str)
+        if in_corpus and file in self.decoded:
+            return self.decoded[file]
+
+        if in_corpus and file in self.corpus:
+            rewritten, string_hashmap = self.corpus[file][1], self.leroy.string_hashmap
+        else:
+            local_encoding = Py2Lisp.encode_source_with_local_strings(code_str, self.leroy.mangle_names)
+            # strings the library does not know get new ids, for this rewrite only, in front of the string table.
+            encodings, string_hashmap = Py2Lisp.merge_local_encodings(
+                ["source"], [local_encoding], collections.ChainMap({}, self.manifest.string_hashmap))
+            encoding = encodings["source"]
+            rewritten = self.leroy.stitch_runner.rewrite([encoding], self.manifest.stitch_abstractions)[0]
+            string_hashmap = collections.ChainMap(
+                {v: k for k, v in string_hashmap.maps[0].items()}, self.leroy.string_hashmap)
+            if in_corpus:
+                # not rewritten by the runs of this server, which started from an earlier one's manifest.
+                self.corpus[file] = (encoding, rewritten)
+        rewrite = self.decode(rewritten, string_hashmap)
+        if in_corpus:
+            self.decoded[file] = rewrite
+        return rewrite
+
+    def rewrite(self, path=None, source=None):
+        path = self.resolve_path(path)
+        rewrite = self.rewrite_source(self.read_source(path, source), path)
+        return {"code": ast.unparse(rewrite.converted_ast), "abstractions": sorted(rewrite.abstractions_used)}
+
+    def abstractions_used(self, path=None, source=None):
+        if path is None and source is None:
+            names = [i.abstraction_name for i in self.abstractions]
+        else:
+            path = self.resolve_path(path)
+            names = sorted(self.rewrite_source(self.read_source(path, source), path).abstractions_used)
+        return [{"name": name, "body": self.abstractions_by_name[name].abstraction_body_py}
+                for name in names if name in self.abstractions_by_name]
+
+    def update(self):
+        self.sources_snapshot = self.take_sources_snapshot()
+        self.run_leroy(incremental=True)
+        return self.status()
+
+    def recompress(self):
+        self.sources_snapshot = self.take_sources_snapshot()
+        self.run_leroy(incremental=False)
+        return self.status()
+
+    def status(self):
+        return {
+            "py_files_dir": self.leroy.py_files_dir,
+            "files": len(self.manifest.files),
+            "abstractions": len(self.abstractions),
+            "compression_ratio": self.manifest.compression_ratio(),
+            "updated_at": self.updated_at,
+        }
+
+    def shutdown(self):
+        self.stopped.set()
+        # serve_forever waits for shutdown, so it cannot be called from a request.
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return True
+
+
+class LeroyRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.leroy_server.handle(line)
+            if response is not None:
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                self.wfile.flush()
+
+
+class LeroyRequestServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, leroy_server):
+        self.leroy_server = leroy_server
+        super().__init__(socket_path, LeroyRequestHandler)
+
+
+class LeroyClient:
+    """Sends requests to a running `LeroyServer`, over one connection."""
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(str(socket_path))
+        self.file = self.socket.makefile("rwb")
+        self.next_id = 0
+
+    def call(self, method, **params):
+        self.next_id += 1
+        request = {"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise RpcError(response["error"]["code"], response["error"]["message"])
+        return response["result"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@click.command()
+@click.option("--py_files_dir", help='directory containing python files to run leroy on.')
+@click.option("--iterations", help='Number of iterations to run stitch for.', default=3, type=int)
+@click.option("--max-arity", default=3, type=int, help='maximum number of parameters for an abstraction.')
+@click.option("--min-nodes-abstraction", help='minimum number of ast nodes in the abstraction',
+              default=10, type=int)
+@click.option("--mangle_names", help='Whether to mangle names or not. '
+                                     'To avoid name clashes with the `ast` library.',
+              default=False, type=bool)
+@click.option("--workers", help='Number of processes used to encode and to rewrite the python files.',
+              default=1, type=int)
+@click.option("--cache_dir", help='Directory for cached results. Defaults to .leroy_cache at the root of this repo.',
+              default=None)
+@click.option("--stitch_backend", help='How to run stitch, see leroy --help.',
+              default="auto", type=click.Choice(StitchRunner.BACKENDS))
+@click.option("--drift_threshold", help='Run a full compression once the compression ratio dropped by this '
+                                        'fraction since the last one.',
+              default=0.1, type=float)
+@click.option("--socket_path", help='Unix socket to listen on. Defaults to leroy.sock in the cache directory.',
+              default=None)
+@click.option("--poll_interval", help='Seconds between checks of the python files for changes.',
+              default=1.0, type=float)
+def serve_leroy(
+        py_files_dir, iterations, max_arity, min_nodes_abstraction, mangle_names, workers, cache_dir,
+        stitch_backend, drift_threshold, socket_path, poll_interval
+):
+    leroy = Leroy(
+        py_files_dir, iterations, max_arity, min_nodes_abstraction, False, mangle_names,
+        workers, True, cache_dir, stitch_backend, True, drift_threshold)
+    if socket_path is None:
+        socket_path = leroy.cache_dir.joinpath("leroy.sock")
+    server = LeroyServer(leroy, socket_path, poll_interval)
+    server.start()
+    print(f"Serving {py_files_dir} on {socket_path}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve_leroy()
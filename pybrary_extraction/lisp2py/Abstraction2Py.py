@@ -2,6 +2,7 @@ import ast
 import copy
 import sys
 
+from pybrary_extraction import profiling
 from pybrary_extraction.lisp2py.Lisp2Py import Lisp2Py
 from pybrary_extraction.lisp2py.utils import has_return_stmnt, get_undef_vars
 from pybrary_extraction.ast_utils import FindTargetVariables, FindReadVariables, FindFuncAndClassDefs, StringReplacer
@@ -37,9 +38,9 @@ class Abstraction2Py:
         if fn_name is None:
             fn_name = self.abstraction.abstraction_name
 
-        lisp_parts = Lisp2Py.parse_lisp(self.abstraction.abstraction_body_lisp)
-        lisp_parts = Lisp2Py.wrap_module(lisp_parts)
-        py_ast = Lisp2Py.construct(lisp_parts)
+        lisp_tree = Lisp2Py.parse_lisp_tree(self.abstraction.abstraction_body_lisp)
+        lisp_tree = Lisp2Py.wrap_module(lisp_tree)
+        py_ast = Lisp2Py.construct(lisp_tree)
         StringReplacer(self.string_hashmap).visit(py_ast)
         py_ast.type_ignores = []
         ast.fix_missing_locations(py_ast)
@@ -83,7 +84,8 @@ class Abstraction2Py:
     def get_additional_params(self, py_ast):
         """find additional parameters used by the abs_fn_def, which are not defined within"""
         py_ast_str = ast.unparse(py_ast)
-        undef_vars = sorted(get_undef_vars(py_ast_str))  # sort for determinism
+        with profiling.stage("free_variables"):
+            undef_vars = sorted(get_undef_vars(py_ast_str))  # sort for determinism
         for var in undef_vars:
             if not var.startswith(Abstraction2Py.PARAM_KEY) and \
                     var not in self.args_map.values():
@@ -125,6 +127,16 @@ class Abstraction2Py:
                 abs_fn_def.body.pop()  # remove last statement
                 abs_fn_def.body.append(last_stmnt)
 
+    def get_return_var_candidates(self, abs_fn_def):
+        """The variables that `get_return_vars` returns if they are live out of the block:
+        none, if the block returns already."""
+        if has_return_stmnt(abs_fn_def):
+            return set()
+        target_vars_finder = FindTargetVariables()
+        for b in abs_fn_def.body:
+            target_vars_finder.visit(b)
+        return set(target_vars_finder.lhs_vars)
+
     def get_return_vars(self, abs_fn_def):
         """Variable which are live out of the block, defined in the block,
         or are function/class definitions."""
@@ -0,0 +1,47 @@
+class AbstractionSignature:
+    """What rewriting the calls of an abstraction needs to know about it, computed once."""
+
+    def __init__(self, abstraction):
+        self.name = abstraction.abstraction_name
+        self.additional_params = tuple(i.param_name for i in abstraction.get_additional_params())
+        self.trailing_positions = tuple(sorted(i.position for i in abstraction.get_trailing_statement_params()))
+        self.returned_vars = tuple(abstraction.returned_vars)
+
+    def __setattr__(self, key, value):
+        if key in self.__dict__:
+            raise AttributeError(f"{key} of {self.name} cannot be changed")
+        super().__setattr__(key, value)
+
+
+class AbstractionLibrary:
+    """
+    The signature of each abstraction, by name, for Rewrite2Py and KickOutTrailingParam to
+    look up calls in. It is built once for a run, from the abstractions when they are done,
+    and is not changed after: worker processes get it as it is, instead of the abstractions.
+    Where two abstractions have the same name, the first one is kept.
+    """
+
+    def __init__(self, abstractions=()):
+        self.signatures = {}
+        for abstraction in abstractions:
+            if abstraction.abstraction_name not in self.signatures:
+                self.signatures[abstraction.abstraction_name] = AbstractionSignature(abstraction)
+
+    @staticmethod
+    def of(abstractions):
+        """`abstractions` if it is a library already, or else the library of the list."""
+        if isinstance(abstractions, AbstractionLibrary):
+            return abstractions
+        return AbstractionLibrary(abstractions)
+
+    def get(self, name) -> AbstractionSignature:
+        return self.signatures.get(name)
+
+    def __contains__(self, name):
+        return name in self.signatures
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __iter__(self):
+        return iter(self.signatures.values())
@@ -0,0 +1,65 @@
+import ast
+
+from pybrary_extraction import profiling
+from pybrary_extraction.lisp2py.Lisp2Py import ConstructionCache, Lisp2Py
+from pybrary_extraction.lisp2py.ExtractedFragment import AddScopeLinks
+from pybrary_extraction.lisp2py.FragmentIndex import FragmentIndex
+
+
+class DecodedProgram:
+    """An original program from stitch, decoded back to python on first use."""
+
+    def __init__(self, lisp, string_hashmap, construction_cache=None):
+        self.lisp = lisp
+        self.string_hashmap = string_hashmap
+        self.construction_cache = construction_cache
+        self._source = None
+        self._scoped_ast = None
+
+    @property
+    def source(self) -> str:
+        if self._source is None:
+            with profiling.stage("decode_originals"):
+                self._source = Lisp2Py(self.lisp, string_hashmap=self.string_hashmap,
+                                       construction_cache=self.construction_cache).convert(quiet=True)
+        return self._source
+
+    @property
+    def scoped_ast(self) -> ast.Module:
+        """The parsed source, with `parent_scope` set on every node (see `AddScopeLinks`)."""
+        if self._scoped_ast is None:
+            source = self.source
+            with profiling.stage("decode_originals"):
+                self._scoped_ast = ast.parse(source)
+                AddScopeLinks().visit(self._scoped_ast)
+        return self._scoped_ast
+
+
+class DecodedCorpus:
+    """
+    The original programs of a stitch run, shared by all of its abstractions,
+    so that each program is decoded and parsed at most once.
+    """
+
+    def __init__(self, original_lisps, string_hashmap):
+        self.string_hashmap = string_hashmap
+        # the nodes of the programs, shared while they are decoded, and gone with the corpus.
+        self.construction_cache = ConstructionCache()
+        self.programs = [DecodedProgram(lisp, string_hashmap, self.construction_cache) for lisp in original_lisps]
+        self._fragment_index = None
+
+    @property
+    def fragment_index(self) -> FragmentIndex:
+        """Built on first use, which decodes every program."""
+        if self._fragment_index is None:
+            self._fragment_index = FragmentIndex(self.programs)
+        return self._fragment_index
+
+    def __iter__(self):
+        return iter(self.programs)
+
+    def __len__(self):
+        return len(self.programs)
+
+    def __getitem__(self, index) -> DecodedProgram:
+        return self.programs[index]
@@ -2,23 +2,30 @@ import ast
 from typing import Union, Any
 
 from pybrary_extraction.ast_utils import FindReadVariables, line_col
+from pybrary_extraction.lisp2py.Liveness import Liveness
 
 
 class AddScopeLinks(ast.NodeVisitor):
     def __init__(self):
         self.parent_scope = None
 
-    def visit_FunctionDef(self, node: ast.FunctionDef) -> Any:
+    def visit_scope(self, node):
+        outer_scope = self.parent_scope
         self.parent_scope = node
         self.generic_visit(node)
+        self.parent_scope = outer_scope
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> Any:
+        self.visit_scope(node)
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> Any:
+        self.visit_scope(node)
 
     def visit_Module(self, node: ast.Module) -> Any:
-        self.parent_scope = node
-        self.generic_visit(node)
+        self.visit_scope(node)
 
     def visit_ClassDef(self, node: ast.ClassDef) -> Any:
-        self.parent_scope = node
-        self.generic_visit(node)
+        self.visit_scope(node)
 
     def visit(self, node):
         """Visit a node."""
@@ -67,27 +74,42 @@ class FindNodesWithinIndices(ast.NodeVisitor):
 
 class ExtractedFragment:
     def __init__(self, parent_scope: Union[ast.FunctionDef, ast.Module],
-                 start_line, end_line):
+                 start_line, end_line, last_statement=None, is_expression=False):
         self.parent_scope = parent_scope
 
         self.start_line = start_line
         self.end_line = end_line
+        # the statement that ends the fragment, or contains it for an expression.
+        self.last_statement = last_statement
+        self.is_expression = is_expression
         self.read_vars_visitor = FindReadVariables()
 
     def find_used_vars_later(self):
+        """Variables that are live out of the fragment."""
+        if self.last_statement is not None:
+            liveness = Liveness.of_scope(self.parent_scope)
+            if liveness.has_statement(self.last_statement):
+                if self.is_expression:
+                    # the rest of the statement runs after the expression.
+                    return liveness.live_before(self.last_statement) | liveness.live_after(self.last_statement)
+                return set(liveness.live_after(self.last_statement))
+
+        # without the statement, fall back to the variables read by later statements of the scope.
         for node in self.parent_scope.body:
             if node.lineno > self.end_line:
                 self.read_vars_visitor.visit(node)
         return set(self.read_vars_visitor.rhs_vars)
 
     @staticmethod
-    def create_from(full_code, extracted_part, start_index):
+    def create_from(full_code, extracted_part, start_index, code_ast=None):
+        """`code_ast`, if given, is `full_code` already parsed and visited by `AddScopeLinks`."""
         end_index = start_index + len(extracted_part)
         start_line, start_col = line_col(full_code, start_index)
         end_line, end_col = line_col(full_code, end_index)
 
-        code_ast = ast.parse(full_code)
-        AddScopeLinks().visit(code_ast)
+        if code_ast is None:
+            code_ast = ast.parse(full_code)
+            AddScopeLinks().visit(code_ast)
         node_finder = FindNodesWithinIndices(
             start_line, start_col,
             end_line, end_col)
@@ -95,4 +117,9 @@ class ExtractedFragment:
         biggest_node = max(node_finder.nodes_within_indices, key=lambda x: x.end_lineno - x.lineno)
         parent_scope = biggest_node.parent_scope
 
-        return ExtractedFragment(parent_scope, start_line, end_line)
+        # the outermost of the statements that end last.
+        statements = [node for node in node_finder.nodes_within_indices
+                      if isinstance(node, ast.stmt) and node.parent_scope is parent_scope]
+        last_statement = max(statements, key=lambda x: (x.end_lineno, -x.lineno)) if statements else None
+
+        return ExtractedFragment(parent_scope, start_line, end_line, last_statement)
@@ -148,10 +148,17 @@ class FixAstNodes(ast.NodeVisitor):
         return node
 
 
+    # the visit method of each class of node, of a FixAstNodes, which keeps no state.
+    visit_methods = {}
+
     @staticmethod
     def augment_pyast_node(node):
-        new_node = FixAstNodes().visit(node)
-        return new_node
+        visit = FixAstNodes.visit_methods.get(node.__class__)
+        if visit is None:
+            fixer = FixAstNodes()
+            visit = getattr(fixer, 'visit_' + node.__class__.__name__, fixer.generic_visit)
+            FixAstNodes.visit_methods[node.__class__] = visit
+        return visit(node)
 
     @staticmethod
     def make_empty_list_fields_if_not_exists(node, *field_names):
@@ -0,0 +1,116 @@
+import ast
+import re
+
+from pybrary_extraction.lisp2py.ExtractedFragment import ExtractedFragment
+
+# a keyword, or a dotted name.
+FIRST_WORD = re.compile(r"@?[\w.]*")
+
+
+class FragmentIndex:
+    """
+    Finds where a fragment of python code was extracted from, without
+    searching the text of every program.
+
+    Statements are indexed by their type and the first word of their source,
+    and single-line expressions by their source, so a lookup only compares
+    the candidates that share that key. Built once per `DecodedCorpus`.
+    """
+
+    def __init__(self, programs):
+        # (statement type, first word) -> [(program, first line, statement list, index in the list)]
+        self.statements = {}
+        # source of a single-line expression -> [(program, expression, statement that contains it)]
+        self.expressions = {}
+        for program in programs:
+            try:
+                code_ast = program.scoped_ast
+            except SyntaxError:
+                continue  # cannot contain a fragment we could locate.
+            self.add_program(program, code_ast)
+
+    def add_program(self, program, code_ast):
+        lines = program.source.split("\n")
+        # (node, innermost statement that contains it)
+        stack = [(code_ast, None)]
+        while stack:
+            node, statement = stack.pop()
+            if isinstance(node, ast.stmt):
+                statement = node
+            elif isinstance(node, ast.expr) and node.lineno == node.end_lineno:
+                text = lines[node.lineno - 1][node.col_offset:node.end_col_offset]
+                self.expressions.setdefault(text, []).append((program, node, statement))
+            for _, value in ast.iter_fields(node):
+                if isinstance(value, list) and value and isinstance(value[0], ast.stmt):
+                    for i, stmt in enumerate(value):
+                        first_line = FragmentIndex.first_line(lines, stmt)
+                        self.statements.setdefault(FragmentIndex.statement_key(stmt, first_line), []) \
+                            .append((program, first_line, value, i))
+                if isinstance(value, list):
+                    stack.extend((child, statement) for child in value if isinstance(child, ast.AST))
+                elif isinstance(value, ast.AST):
+                    stack.append((value, statement))
+
+    @staticmethod
+    def first_line(lines, stmt):
+        if getattr(stmt, 'decorator_list', None):
+            first = stmt.decorator_list[0]
+            return "@" + lines[first.lineno - 1][first.col_offset:]
+        return lines[stmt.lineno - 1][stmt.col_offset:]
+
+    @staticmethod
+    def statement_key(stmt, first_line):
+        return type(stmt).__name__, FIRST_WORD.match(first_line).group()
+
+    @staticmethod
+    def can_locate(body):
+        """Whether `locate` handles a fragment with this body. Otherwise, search the text."""
+        return len(body) == 1 and isinstance(body[0], (ast.expr, ast.Expr)) or \
+            len(body) > 0 and all(isinstance(node, ast.stmt) for node in body)
+
+    def locate(self, body) -> list[ExtractedFragment]:
+        """Where the statements, or the expression, in `body` occur: the first occurrence in each program."""
+        if len(body) == 1 and isinstance(body[0], (ast.expr, ast.Expr)):
+            occurrences = self.locate_expression(body[0].value if isinstance(body[0], ast.Expr) else body[0])
+        else:
+            occurrences = self.locate_statements(body)
+
+        first_in_program = {}
+        for program, nodes, last_statement in occurrences:
+            position = (nodes[0].lineno, nodes[0].col_offset)
+            if id(program) not in first_in_program or position < first_in_program[id(program)][0]:
+                first_in_program[id(program)] = (position, nodes, last_statement)
+
+        fragments = []
+        for _, nodes, last_statement in first_in_program.values():
+            fragments.append(
+                ExtractedFragment(last_statement.parent_scope, nodes[0].lineno, nodes[-1].end_lineno,
+                                  last_statement, is_expression=last_statement is not nodes[-1]))
+        return fragments
+
+    def locate_statements(self, body):
+        """
+        The last statement may also be the start of a longer one. Stitch
+        abstracts curried applications, so a use can leave out the trailing
+        fields of a node (e.g. `simple` of an `AnnAssign`).
+        """
+        texts = [ast.unparse(stmt) for stmt in body]
+        first_line = texts[0].split("\n")[0]
+        occurrences = []
+        for program, line, statements, start in self.statements.get(
+                FragmentIndex.statement_key(body[0], first_line), []):
+            if not line.startswith(first_line):
+                continue
+            candidate = statements[start:start + len(texts)]
+            if len(candidate) != len(texts):
+                continue
+            candidate_texts = [ast.unparse(stmt) for stmt in candidate]
+            if candidate_texts[:-1] == texts[:-1] and \
+                    (candidate_texts[-1] == texts[-1] or
+                     "\n" not in texts[-1] and candidate_texts[-1].startswith(texts[-1])):
+                occurrences.append((program, candidate, candidate[-1]))
+        return occurrences
+
+    def locate_expression(self, expr):
+        return [(program, [node], statement)
+                for program, node, statement in self.expressions.get(ast.unparse(expr), [])]
@@ -1,91 +1,239 @@
 import ast
+from array import array
 
-from pyparsing import OneOrMore, nestedExpr
-
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.lisp2py.LispTree import LispTree, LispTreeVisitor
 from pybrary_extraction.lisp2py.utils import MyList, MyKeyword, StatementList
 from pybrary_extraction.python2lisp import Py2Lisp
-from pybrary_extraction.ast_utils import get_all_ast_classes, StringReplacer, LispVisitor
+from pybrary_extraction.ast_utils import AST_CLASSES, StringReplacer
 from pybrary_extraction.lisp2py.FixAstNodes import FixAstNodes
 
 
-class WrapStatementList(LispVisitor):
-    def visit_ProgramStatements(self, lisp_root):
-        new_root = self.generic_visit(lisp_root)
-        new_root[1] = self.wrap_statements(new_root[1])  # 1st index contains the body
-        return new_root
+class WrapStatementList(LispTreeVisitor):
+    """Wraps the bodies of modules, functions, classes and for loops that are a single
+    statement in a chain of StatementList nodes."""
 
-    def visit_FunctionDef(self, lisp_root):
-        new_root = self.generic_visit(lisp_root)
-        if new_root[1][0] == Py2Lisp.keyword_for_keyword and new_root[1][1] == 'body':
-            new_root[1][2] = self.wrap_statements(new_root[1][2])
-        return new_root
+    def visit_ProgramStatements(self, node):
+        self.wrap_child(node, 1)  # 1st index contains the body
+        return self.generic_visit(node)
 
-    def visit_ClassDef(self, lisp_root):
-        new_root = self.generic_visit(lisp_root)
-        if new_root[2][0] == Py2Lisp.keyword_for_keyword and new_root[2][1] == 'body':
-            new_root[2][2] = self.wrap_statements(new_root[2][2])
-        return new_root
+    def visit_FunctionDef(self, node):
+        self.wrap_keyword_body(node, 1)
+        return self.generic_visit(node)
 
-    def visit_For(self, lisp_root):
-        new_root = self.generic_visit(lisp_root)
-        new_root[3] = self.wrap_statements(new_root[3])
-        return new_root
+    def visit_ClassDef(self, node):
+        self.wrap_keyword_body(node, 2)
+        return self.generic_visit(node)
 
-    def wrap_statements(self, lisp_parts):
-        if not isinstance(lisp_parts, list) or not len(lisp_parts) > 0:
-            return lisp_parts
+    def visit_For(self, node):
+        self.wrap_child(node, 3)
+        return self.generic_visit(node)
+
+    def wrap_keyword_body(self, node, index):
+        """Wrap the body of the child at `index`, if it is (__kw__ body statements)."""
+        tree = self.tree
+        if tree.length(node) > index:
+            keyword = tree.child(node, index)
+            if tree.head(keyword) == Py2Lisp.keyword_for_keyword and tree.length(keyword) > 2 \
+                    and tree.is_atom(tree.child(keyword, 1)) and tree.atom(tree.child(keyword, 1)) == 'body':
+                self.wrap_child(keyword, 2)
+
+    def wrap_child(self, node, index):
+        if self.tree.length(node) > index:
+            self.tree.set_child(node, index, self.wrap_statements(self.tree.child(node, index)))
+
+    def wrap_statements(self, node):
+        tree = self.tree
+        if tree.is_atom(node) or not tree.length(node):
+            return node
+
+        if tree.head(node) != Py2Lisp.statement_keyword:
+            return tree.add_list([tree.add_shared_atom(Py2Lisp.statement_keyword), node,
+                                  tree.add_shared_atom(Py2Lisp.empty_statement_keyword)])
+        return node
+
+
+def copy_node(node):
+    """A copy of a constructed node, with copies of its nodes and lists, that shares only
+    immutable values with it."""
+    if isinstance(node, MyList):
+        return MyList(*[copy_node(i) for i in node])
+    elif isinstance(node, list):
+        return [copy_node(i) for i in node]
+    elif isinstance(node, (ast.AST, MyKeyword, StatementList)):
+        new_node = node.__class__.__new__(node.__class__)
+        new_node.__dict__.update({k: copy_node(v) for k, v in node.__dict__.items()})
+        return new_node
+    return node
 
-        if lisp_parts[0] != Py2Lisp.statement_keyword:
-            return [Py2Lisp.statement_keyword, lisp_parts, Py2Lisp.empty_statement_keyword]
-        return lisp_parts
+
+class ConstructionCache:
+    """
+    The nodes Lisp2Py.construct made for the subtrees it saw. Each subtree is interned to an
+    id, from its atoms and the ids of its lists, so equal subtrees have the same id, and its
+    node is made once, from the nodes of its children. Nodes are shared between the subtrees
+    and programs they are made for, and are never handed out: construct returns a copy.
+
+    Whoever decodes a corpus keeps one for it, e.g. a Leroy run or a `DecodedCorpus`, and
+    it goes with them. Without one, construct makes one for the program.
+    """
+
+    def __init__(self):
+        self.subtree_ids = {}
+        self.nodes = {}
+        # the node of each atom, shared as the nodes of subtrees are.
+        self.leaf_nodes = {}
+
+    def clear(self):
+        """Forget every subtree and node, e.g. before programs that should not share them."""
+        self.subtree_ids.clear()
+        self.nodes.clear()
+        self.leaf_nodes.clear()
+
+    def intern(self, tree: LispTree):
+        """The id of each node of the tree at the root of `tree`, in an array by node. Nodes
+        not in the tree may be -1."""
+        atoms, starts, lengths, children = tree.atoms, tree.starts, tree.lengths, tree.children
+        symbol_ids = [self.subtree_id(i) for i in tree.symbols]
+        # atoms have the ids of their symbols from the start, lists once their children have ids.
+        ids = array('i', [symbol_ids[i] if i >= 0 else -1 for i in atoms])
+        # the children of a list come before it, unless a pass pointed it at a newer node, so
+        # most lists are interned in one pass in order, and the rest are left to a walk from
+        # the root. Lists no longer in the tree are interned too, which does no harm.
+        subtree_ids = self.subtree_ids
+        for node, atom in enumerate(atoms):
+            if atom < 0:
+                child_ids = [ids[i] for i in children[starts[~atom]:starts[~atom] + lengths[~atom]]]
+                if -1 not in child_ids:
+                    ids[node] = subtree_ids.setdefault(tuple(child_ids), len(subtree_ids))
+        stack = [tree.root]
+        while stack:
+            node = stack[-1]
+            if ids[node] != -1:
+                stack.pop()
+                continue
+            k = ~atoms[node]
+            child_nodes = children[starts[k]:starts[k] + lengths[k]]
+            child_ids = [ids[i] for i in child_nodes]
+            if -1 in child_ids:
+                stack += [i for i in child_nodes if ids[i] == -1]
+            else:
+                ids[node] = subtree_ids.setdefault(tuple(child_ids), len(subtree_ids))
+                stack.pop()
+        return ids
+
+    def subtree_id(self, key):
+        subtree_id = self.subtree_ids.get(key)
+        if subtree_id is None:
+            subtree_id = self.subtree_ids[key] = len(self.subtree_ids)
+        return subtree_id
 
 
 class Lisp2Py:
-    def __init__(self, lisp_str, string_hashmap=None):
+    # how many subtrees a construction cache keeps, before it starts over.
+    MAX_SUBTREES = 1 << 18
+
+    def __init__(self, lisp_str, string_hashmap=None, construction_cache=None):
         if string_hashmap is None:
             string_hashmap = {}
         self.lisp_str = lisp_str
         self.string_hashmap = string_hashmap
+        self.construction_cache = construction_cache
 
-    def convert(self):
-        py_ast = self.get_py_ast()
+    def convert(self, quiet=False):
+        py_ast = self.get_py_ast(quiet)
         py_ast = StringReplacer(string_hashmap=self.string_hashmap).visit(py_ast)
         py_ast.type_ignores = []
         ast.fix_missing_locations(py_ast)
-        print(ast.dump(py_ast, indent=4))
+        if not quiet:
+            print(ast.dump(py_ast, indent=4))
         return ast.unparse(py_ast)
 
-    def get_py_ast(self):
-        print(self.lisp_str)
-        lisp_parts = Lisp2Py.parse_lisp(self.lisp_str)
+    def get_py_ast(self, quiet=False):
+        if not quiet:
+            print(self.lisp_str)
+        lisp_tree = Lisp2Py.parse_lisp_tree(self.lisp_str)
 
         # construct python ast
-        return Lisp2Py.construct(lisp_parts)
+        return Lisp2Py.construct(lisp_tree, self.construction_cache)
 
     @staticmethod
     def parse_lisp(lisp_str):
         if lisp_str == Py2Lisp.module_keyword:
             return [Py2Lisp.module_keyword]
         else:
-            lisp_parts = OneOrMore(nestedExpr()).parseString(lisp_str).as_list()[0]
+            lisp_parts = LispReader.read(lisp_str)
             return lisp_parts
 
     @staticmethod
-    def construct(lisp_root):
-        if lisp_root == '__list__':
-            return MyList()
-        elif lisp_root == Py2Lisp.module_keyword:
-            return ast.Module(body=[])
-        elif isinstance(lisp_root, str):
-            return Lisp2Py.get_ast_node_from_string(lisp_root)
+    def parse_lisp_tree(lisp_str):
+        """`parse_lisp`, into a LispTree."""
+        if lisp_str == Py2Lisp.module_keyword:
+            return LispTree.from_lists([Py2Lisp.module_keyword])
+        return LispTree.read(lisp_str)
+
+    @staticmethod
+    def construct(lisp_root, cache: ConstructionCache = None):
+        """The python ast of a LispTree, or of nested lists of strings. Its nodes are made
+        with the nodes `cache` has from earlier programs, if given."""
+        lisp_tree = lisp_root if isinstance(lisp_root, LispTree) else LispTree.from_lists(lisp_root)
+        if cache is None:
+            cache = ConstructionCache()
+        elif len(cache.subtree_ids) > Lisp2Py.MAX_SUBTREES:
+            cache.clear()
+        ids = cache.intern(lisp_tree)
+        return copy_node(Lisp2Py.construct_shared(lisp_tree, lisp_tree.root, ids, cache))
+
+    @staticmethod
+    def construct_shared(lisp_tree, node, ids, cache):
+        """The python ast of `node`, which may share nodes with the cache."""
+        if lisp_tree.is_atom(node):
+            return Lisp2Py.leaf_node(lisp_tree.atom(node), cache)
+        subtree_id = ids[node]
+        py_ast_node = cache.nodes.get(subtree_id)
+        if py_ast_node is not None:
+            return py_ast_node
+
+        if lisp_tree.is_statement_link(node):
+            py_ast_node = Lisp2Py.construct_statements(lisp_tree, node, ids, cache)
         else:
             child_list = []
-            for c in lisp_root:
-                c_node = Lisp2Py.construct(c)
+            for c in lisp_tree.child_nodes(node):
+                c_node = Lisp2Py.construct_shared(lisp_tree, c, ids, cache)
                 child_list.append(c_node)
-
             py_ast_node = Lisp2Py.construct_ast_node(child_list)
-            return FixAstNodes.augment_pyast_node(py_ast_node)
+            py_ast_node = FixAstNodes.augment_pyast_node(py_ast_node)
+        cache.nodes[subtree_id] = py_ast_node
+        return py_ast_node
+
+    @staticmethod
+    def construct_statements(lisp_tree, node, ids, cache):
+        """The statements of a chain of StatementList nodes, as the StatementList of its first
+        link decodes to, walking the chain instead of recursing along it."""
+        statements = []
+        while lisp_tree.is_statement_link(node):
+            statements.append(Lisp2Py.construct_shared(lisp_tree, lisp_tree.child(node, 1), ids, cache))
+            node = lisp_tree.child(node, 2)
+        rest = Lisp2Py.construct_shared(lisp_tree, node, ids, cache)
+        if isinstance(rest, list):
+            statements += rest
+        else:
+            statements.append(rest)
+        return MyList(*[i for i in statements if i is not Py2Lisp.empty_statement_keyword])
+
+    @staticmethod
+    def leaf_node(atom, cache):
+        """The node of `atom`, as from `get_ast_node_from_string`, made once for `cache`."""
+        py_ast_node = cache.leaf_nodes.get(atom)
+        if py_ast_node is None:
+            if atom == '__list__':
+                py_ast_node = MyList()
+            elif atom == Py2Lisp.module_keyword:
+                py_ast_node = ast.Module(body=[])
+            else:
+                py_ast_node = Lisp2Py.get_ast_node_from_string(atom)
+            cache.leaf_nodes[atom] = py_ast_node
+        return py_ast_node
 
     @staticmethod
     def get_ast_node_from_string(lisp_root: str):
@@ -98,7 +246,7 @@ class Lisp2Py:
             else:
                 return ast.Name(id=lisp_root)
         except:
-            if lisp_root in get_all_ast_classes():
+            if lisp_root in AST_CLASSES:
                 ast_class = getattr(ast, lisp_root, None)
                 if ast_class is None:
                     return ast.Name(id=lisp_root)
@@ -132,6 +280,10 @@ class Lisp2Py:
 
     @staticmethod
     def wrap_module(lisp_parts):
+        if isinstance(lisp_parts, LispTree):
+            if lisp_parts.head(lisp_parts.root) != Py2Lisp.module_keyword:
+                lisp_parts.root = lisp_parts.add_list([lisp_parts.add_shared_atom(Py2Lisp.module_keyword), lisp_parts.root])
+            return lisp_parts
         if lisp_parts[0] != Py2Lisp.module_keyword:
             new_lisp_parts = [Py2Lisp.module_keyword, lisp_parts]
             return new_lisp_parts
@@ -139,4 +291,7 @@ class Lisp2Py:
 
     @staticmethod
     def wrap_statements_list(lisp_parts):
-        return WrapStatementList().visit(lisp_parts)
+        if isinstance(lisp_parts, LispTree):
+            lisp_parts.root = WrapStatementList(lisp_parts).visit(lisp_parts.root)
+            return lisp_parts
+        return Lisp2Py.wrap_statements_list(LispTree.from_lists(lisp_parts)).to_lists()
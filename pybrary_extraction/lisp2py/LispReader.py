@@ -0,0 +1,50 @@
+import re
+
+
+class LispReader:
+    """
+    Reader for the s-expressions produced by stitch and Py2Lisp.
+
+    Returns the same nested lists of strings as pyparsing's
+    `OneOrMore(nestedExpr()).parseString(lisp_str).as_list()[0]`, including its
+    handling of quoted strings, but reads iteratively, so arbitrarily deep
+    programs do not hit the recursion limit.
+    """
+
+    # a quoted string is a single token, as in pyparsing's `quotedString`.
+    QUOTED = r'"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"' \
+             r"|'(?:[^'\n\r\\]|''|\\(?:[^x]|x[0-9a-fA-F]+))*'"
+    # an atom runs up to whitespace, a parenthesis or the start of a quoted string.
+    ATOM = rf"""(?:[^ \t\n\r()"']|(?!{QUOTED})["'])+"""
+    TOKEN_PATTERN = re.compile(rf"\(|\)|{QUOTED}|{ATOM}")
+
+    @staticmethod
+    def tokenize(lisp_str):
+        return LispReader.TOKEN_PATTERN.findall(lisp_str)
+
+    @staticmethod
+    def read(lisp_str):
+        """Read the first s-expression in `lisp_str`. Anything after it is ignored."""
+        root = None
+        stack = []
+        for token in LispReader.tokenize(lisp_str):
+            if token == "(":
+                node = []
+                if stack:
+                    stack[-1].append(node)
+                else:
+                    root = node
+                stack.append(node)
+            elif token == ")":
+                if not stack:
+                    raise ValueError(f"Unexpected ')' in: {lisp_str[:100]}")
+                stack.pop()
+                if not stack:
+                    return root
+            elif stack:
+                stack[-1].append(token)
+            else:
+                raise ValueError(f"Expected '(' but found {token!r} in: {lisp_str[:100]}")
+        if root is None:
+            raise ValueError(f"No s-expression in: {lisp_str[:100]}")
+        raise ValueError(f"Missing ')' in: {lisp_str[:100]}")
@@ -0,0 +1,238 @@
+from array import array
+from collections import defaultdict
+from itertools import count
+
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.python2lisp import Py2Lisp
+
+
+class LispTree:
+    """
+    An s-expression in flat arrays, instead of nested lists of strings. Atoms are interned to
+    symbol ids, and each node is an index: node i is the atom `symbols[atoms[i]]` if
+    `atoms[i]` is not negative, or else the list k = ~atoms[i], whose children are the nodes
+    `children[starts[k]:starts[k] + lengths[k]]`.
+
+    Passes change a tree in place, by pointing a child at another node and by adding nodes.
+    Nodes no longer pointed at stay in the arrays, but are not part of the tree at `root`.
+    """
+
+    def __init__(self):
+        self.symbols = []
+        self.symbol_ids = {}
+        self.atoms = array('i')
+        self.starts = array('i')
+        self.lengths = array('i')
+        self.children = array('i')
+        self.root = -1
+        # the node of each symbol that add_shared_atom added.
+        self.shared_atoms = {}
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def symbol_id(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def add_atom(self, symbol):
+        self.atoms.append(self.symbol_id(symbol))
+        return len(self.atoms) - 1
+
+    def add_shared_atom(self, symbol):
+        """An atom node of `symbol`, the same one every time: passes never change an atom in
+        place, so it can be the child of any number of lists."""
+        node = self.shared_atoms.get(symbol)
+        if node is None:
+            node = self.shared_atoms[symbol] = self.add_atom(symbol)
+        return node
+
+    def add_list(self, child_nodes):
+        self.atoms.append(~len(self.starts))
+        self.starts.append(len(self.children))
+        self.lengths.append(len(child_nodes))
+        self.children.extend(child_nodes)
+        return len(self.atoms) - 1
+
+    def add_lists(self, lisp_root):
+        """Add the nested lists of strings `lisp_root`, without recursing. Returns its node."""
+        if isinstance(lisp_root, str):
+            return self.add_atom(lisp_root)
+        # for each list being added: an iterator over its children, and their nodes so far.
+        stack = [(iter(lisp_root), [])]
+        while True:
+            children, child_nodes = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                node = self.add_list(child_nodes)
+                if not stack:
+                    return node
+                stack[-1][1].append(node)
+            elif isinstance(child, str):
+                child_nodes.append(self.add_atom(child))
+            else:
+                stack.append((iter(child), []))
+
+    def is_atom(self, node):
+        return self.atoms[node] >= 0
+
+    def atom(self, node):
+        return self.symbols[self.atoms[node]]
+
+    def start(self, node):
+        """Where the children of a list node start in `children`."""
+        return self.starts[~self.atoms[node]]
+
+    def length(self, node):
+        return self.lengths[~self.atoms[node]]
+
+    def child(self, node, index):
+        return self.children[self.starts[~self.atoms[node]] + index]
+
+    def set_child(self, node, index, child):
+        self.children[self.starts[~self.atoms[node]] + index] = child
+
+    def child_nodes(self, node):
+        k = ~self.atoms[node]
+        start = self.starts[k]
+        return self.children[start:start + self.lengths[k]]
+
+    def head(self, node):
+        """The first child of a list node, if it is an atom, or None."""
+        k = ~self.atoms[node]
+        if k < 0 or not self.lengths[k]:
+            return None
+        symbol_id = self.atoms[self.children[self.starts[k]]]
+        if symbol_id < 0:
+            return None
+        return self.symbols[symbol_id]
+
+    def is_statement_link(self, node):
+        """Whether `node` is a link of a chain of StatementList nodes: (StatementList statement rest)."""
+        k = ~self.atoms[node]
+        return k >= 0 and self.lengths[k] == 3 and self.head(node) == Py2Lisp.statement_keyword
+
+    def to_lists(self, node=None):
+        """The nested lists of strings of the tree at `node`, or at the root, without recursing."""
+        if node is None:
+            node = self.root
+        if self.is_atom(node):
+            return self.atom(node)
+        root = []
+        stack = [(node, root)]
+        while stack:
+            node, lisp_root = stack.pop()
+            for child in self.child_nodes(node):
+                if self.is_atom(child):
+                    lisp_root.append(self.atom(child))
+                else:
+                    lisp_root.append([])
+                    stack.append((child, lisp_root[-1]))
+        return root
+
+    @staticmethod
+    def from_lists(lisp_root):
+        tree = LispTree()
+        tree.root = tree.add_lists(lisp_root)
+        return tree
+
+    @staticmethod
+    def read(lisp_str):
+        """Read the first s-expression in `lisp_str`, as `LispReader.read` does, into a tree."""
+        tree = LispTree()
+        # the symbol ids of the tokens, parentheses included, are looked up all at once.
+        symbol_ids = defaultdict(count().__next__)
+        open_id, close_id = symbol_ids["("], symbol_ids[")"]
+        token_ids = array('i', map(symbol_ids.__getitem__, LispReader.tokenize(lisp_str)))
+        tree.symbols = list(symbol_ids)
+        tree.symbol_ids = dict(symbol_ids)
+
+        atoms, starts, lengths, children = tree.atoms, tree.starts, tree.lengths, tree.children
+        # the nodes of the children so far of each open list.
+        stack = []
+        for symbol_id in token_ids:
+            if symbol_id == open_id:
+                stack.append([])
+            elif symbol_id == close_id:
+                if not stack:
+                    raise ValueError(f"Unexpected ')' in: {lisp_str[:100]}")
+                child_nodes = stack.pop()
+                node = len(atoms)
+                atoms.append(~len(starts))
+                starts.append(len(children))
+                lengths.append(len(child_nodes))
+                children.extend(child_nodes)
+                if not stack:
+                    tree.root = node
+                    return tree
+                stack[-1].append(node)
+            elif stack:
+                stack[-1].append(len(atoms))
+                atoms.append(symbol_id)
+            else:
+                raise ValueError(f"Expected '(' but found {tree.symbols[symbol_id]!r} in: {lisp_str[:100]}")
+        if not stack:
+            raise ValueError(f"No s-expression in: {lisp_str[:100]}")
+        raise ValueError(f"Missing ')' in: {lisp_str[:100]}")
+
+
+class LispTreeVisitor:
+    """
+    A visitor of a LispTree, which changes the tree in place. `visit` calls the
+    visit_<head> method of a list with an atom for its head, or else `generic_visit`, and
+    returns the node to put in place of the visited one. `generic_visit` visits the lists
+    among the children of a list, puts what their visits return in their place, then returns
+    `leave(node)`. Atoms are not visited: a visitor changes them from the list they are in.
+    """
+
+    def __init__(self, tree: LispTree):
+        self.tree = tree
+        # the visit method of each head.
+        self.visit_methods = {}
+        # a chain of a long block of statements is as deep as it is long, so it is visited
+        # along, instead of recursing, unless its links have a visit method of their own.
+        self.along_chains = not hasattr(self, "visit_StatementList")
+
+    def visit(self, node):
+        head = self.tree.head(node)
+        if head is not None:
+            return self.visit_method(head)(node)
+        return node
+
+    def visit_method(self, head):
+        fn = self.visit_methods.get(head)
+        if fn is None:
+            fn = self.visit_methods[head] = getattr(self, "visit_" + head, self.generic_visit)
+        return fn
+
+    def generic_visit(self, node):
+        tree = self.tree
+        if tree.is_atom(node):
+            return node
+        links = []
+        while self.along_chains and tree.is_statement_link(node):
+            links.append(node)
+            self.replace_children(node, 0, 2)
+            node = tree.child(node, 2)
+        if not links:
+            self.replace_children(node, 0, tree.length(node))
+            return self.leave(node)
+        new_node = self.visit(node)
+        for link in reversed(links):
+            tree.set_child(link, 2, new_node)
+            new_node = self.leave(link)
+        return new_node
+
+    def replace_children(self, node, start, end):
+        atoms, children = self.tree.atoms, self.tree.children
+        offset = self.tree.start(node)
+        for index in range(offset + start, offset + end):
+            if atoms[children[index]] < 0:
+                children[index] = self.visit(children[index])
+
+    def leave(self, node):
+        return node
@@ -0,0 +1,333 @@
+import ast
+
+
+class NameUses(ast.NodeVisitor):
+    """
+    Names read and written by a piece of code, in the scope it runs in.
+    Names bound by lambdas and comprehensions within it are their own;
+    nested functions and classes only contribute the names they read from outside.
+    """
+
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+
+    @staticmethod
+    def of(*nodes):
+        visitor = NameUses()
+        for node in nodes:
+            if isinstance(node, list):
+                for item in node:
+                    visitor.visit(item)
+            elif node is not None:
+                visitor.visit(node)
+        return visitor
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self.writes.add(node.id)
+        else:
+            # a deleted name has to be bound before.
+            self.reads.add(node.id)
+            if isinstance(node.ctx, ast.Del):
+                self.writes.add(node.id)
+
+    def visit_alias(self, node):
+        if node.name != '*':
+            self.writes.add(node.asname or node.name.split('.')[0])
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self.reads.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node):
+        if node.value is None:
+            # only annotates the name, does not bind it.
+            self.visit(node.annotation)
+            if not isinstance(node.target, ast.Name):
+                self.visit(node.target)
+        else:
+            self.generic_visit(node)
+
+    def visit_nested_scope(self, bound, code):
+        inner = NameUses.of(*code)
+        self.reads |= inner.reads - bound - inner.writes
+
+    def visit_Lambda(self, node):
+        self.visit_arguments_defaults(node.args)
+        self.visit_nested_scope(NameUses.arg_names(node.args), [node.body])
+
+    def visit_comprehension_node(self, node):
+        generators = node.generators
+        # the first iterable is evaluated outside the comprehension.
+        self.visit(generators[0].iter)
+        elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+        inner = NameUses.of(*elements, *[g.ifs for g in generators], *[g.iter for g in generators[1:]])
+        bound = NameUses.of(*[g.target for g in generators]).writes
+        self.reads |= inner.reads - bound
+        # names bound by assignment expressions leak out of comprehensions.
+        self.writes |= inner.writes - bound
+
+    visit_ListComp = visit_SetComp = visit_GeneratorExp = visit_DictComp = visit_comprehension_node
+
+    def visit_FunctionDef(self, node):
+        self.writes.add(node.name)
+        self.visit_arguments_defaults(node.args)
+        for child in node.decorator_list + [node.returns] + NameUses.annotations(node.args):
+            if child is not None:
+                self.visit(child)
+        self.reads |= NameUses.free_reads(node, NameUses.arg_names(node.args))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self.writes.add(node.name)
+        for child in node.decorator_list + node.bases + node.keywords:
+            self.visit(child)
+        self.reads |= NameUses.free_reads(node, set())
+
+    @staticmethod
+    def free_reads(scope, bound):
+        """Names the body of a function or class reads from outside. Cached on the node,
+        since the enclosing scopes all ask for them."""
+        reads = getattr(scope, 'free_reads', None)
+        if reads is None:
+            inner = NameUses.of(scope.body)
+            reads = scope.free_reads = inner.reads - bound - inner.writes
+        return reads
+
+    def visit_arguments_defaults(self, args):
+        for default in args.defaults + args.kw_defaults:
+            if default is not None:
+                self.visit(default)
+
+    @staticmethod
+    def arg_names(args):
+        all_args = args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]
+        return {arg.arg for arg in all_args if arg is not None}
+
+    @staticmethod
+    def annotations(args):
+        all_args = args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]
+        return [arg.annotation for arg in all_args if arg is not None and arg.annotation is not None]
+
+
+class CfgNode:
+    """A simple statement, or the header of a compound statement."""
+
+    def __init__(self, uses=(), defs=()):
+        self.uses = set(uses)
+        self.defs = set(defs)
+        self.successors = []
+        self.live_in = set()
+
+
+class Liveness:
+    """
+    Backward liveness analysis over the control-flow graph of one scope:
+    the body of a module, function or class. Statements of nested functions
+    and classes belong to their own scope.
+
+    Build it with `Liveness.of_scope`, which caches the result on the scope
+    node, so every later query for that scope is a lookup.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.nodes = []
+        # id(statement) -> node that runs the statement.
+        self.entries = {}
+        # id(statement) -> node that control reaches when the statement completes.
+        self.continuations = {}
+        # enclosing loops, (header, node after the loop).
+        self.loops = []
+        # entries of the enclosing exception handlers and finally blocks.
+        self.handlers = []
+        self.finals = []
+
+        self.exit = self.new_node(uses=Liveness.live_at_exit(scope))
+        self.entry = self.build_body(scope.body, self.exit)
+        self.solve()
+
+    @staticmethod
+    def of_scope(scope) -> 'Liveness':
+        liveness = getattr(scope, 'liveness', None)
+        if liveness is None:
+            liveness = scope.liveness = Liveness(scope)
+        return liveness
+
+    def has_statement(self, stmt):
+        return id(stmt) in self.entries
+
+    def live_after(self, stmt) -> set:
+        """Names that may be read after `stmt` completes, before they are assigned again."""
+        return self.continuations[id(stmt)].live_in
+
+    def live_before(self, stmt) -> set:
+        return self.entries[id(stmt)].live_in
+
+    @staticmethod
+    def live_at_exit(scope):
+        if isinstance(scope, ast.ClassDef):
+            # the names assigned in a class body become its attributes.
+            return NameUses.of(scope.body).writes
+        declared = set()
+        if isinstance(scope, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # assignments to global and nonlocal names outlive the call.
+            for stmt in Liveness.own_statements(scope.body):
+                if isinstance(stmt, (ast.Global, ast.Nonlocal)):
+                    declared.update(stmt.names)
+        return declared
+
+    @staticmethod
+    def own_statements(body):
+        """Statements in `body`, including nested blocks, but not in nested functions or classes."""
+        stack = list(body)
+        while stack:
+            stmt = stack.pop()
+            yield stmt
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            for _, value in ast.iter_fields(stmt):
+                if isinstance(value, list):
+                    for item in value:
+                        if isinstance(item, ast.stmt):
+                            stack.append(item)
+                        elif isinstance(item, (ast.ExceptHandler, ast.match_case)):
+                            stack.extend(item.body)
+
+    def new_node(self, uses=(), defs=(), successors=()):
+        node = CfgNode(uses, defs)
+        node.successors.extend(successors)
+        # any statement within a try may raise.
+        node.successors.extend(self.handlers)
+        self.nodes.append(node)
+        return node
+
+    def build_body(self, body, after):
+        """Build the statements of `body`, which continue to `after`. Returns the entry node."""
+        for stmt in reversed(body):
+            self.continuations[id(stmt)] = after
+            after = self.entries[id(stmt)] = self.build_statement(stmt, after)
+        return after
+
+    def build_statement(self, stmt, after):
+        method = 'build_' + stmt.__class__.__name__
+        builder = getattr(self, method, None)
+        if builder is not None:
+            return builder(stmt, after)
+        uses = NameUses.of(stmt)
+        return self.new_node(uses.reads, uses.writes, [after])
+
+    def build_Return(self, stmt, after):
+        target = self.finals[-1] if self.finals else self.exit
+        return self.new_node(NameUses.of(stmt.value).reads, successors=[target])
+
+    def build_Raise(self, stmt, after):
+        uses = NameUses.of(stmt.exc, stmt.cause).reads
+        if self.handlers:
+            return self.new_node(uses)
+        return self.new_node(uses, successors=[self.finals[-1] if self.finals else self.exit])
+
+    def build_Break(self, stmt, after):
+        return self.new_node(successors=[self.loops[-1][1]] if self.loops else [after])
+
+    def build_Continue(self, stmt, after):
+        return self.new_node(successors=[self.loops[-1][0]] if self.loops else [after])
+
+    def build_If(self, stmt, after):
+        body = self.build_body(stmt.body, after)
+        orelse = self.build_body(stmt.orelse, after)
+        return self.new_node(NameUses.of(stmt.test).reads, successors=[body, orelse])
+
+    def build_While(self, stmt, after):
+        header = self.new_node(NameUses.of(stmt.test).reads)
+        orelse = self.build_body(stmt.orelse, after)
+        self.loops.append((header, after))
+        body = self.build_body(stmt.body, header)
+        self.loops.pop()
+        header.successors[:0] = [body, orelse]
+        return header
+
+    def build_For(self, stmt, after):
+        header = self.new_node(NameUses.of(stmt.iter).reads)
+        orelse = self.build_body(stmt.orelse, after)
+        self.loops.append((header, after))
+        body = self.build_body(stmt.body, header)
+        self.loops.pop()
+        target = NameUses.of(stmt.target)
+        next_item = self.new_node(target.reads, target.writes, [body])
+        header.successors[:0] = [next_item, orelse]
+        return header
+
+    build_AsyncFor = build_For
+
+    def build_With(self, stmt, after):
+        uses = NameUses.of(stmt.items)
+        return self.new_node(uses.reads, uses.writes, [self.build_body(stmt.body, after)])
+
+    build_AsyncWith = build_With
+
+    def build_Try(self, stmt, after):
+        finalbody = self.build_body(stmt.finalbody, after) if stmt.finalbody else after
+        if stmt.finalbody:
+            self.finals.append(finalbody)
+        handlers = []
+        for handler in stmt.handlers:
+            handler_body = self.build_body(handler.body, finalbody)
+            defs = {handler.name} if handler.name else set()
+            handlers.append(self.new_node(NameUses.of(handler.type).reads, defs, [handler_body]))
+        orelse = self.build_body(stmt.orelse, finalbody)
+
+        self.handlers += handlers
+        if stmt.finalbody:
+            self.handlers.append(finalbody)
+        body = self.build_body(stmt.body, orelse)
+        del self.handlers[len(self.handlers) - len(handlers) - bool(stmt.finalbody):]
+        if stmt.finalbody:
+            self.finals.pop()
+        return self.new_node(successors=[body])
+
+    build_TryStar = build_Try
+
+    def build_Match(self, stmt, after):
+        cases = []
+        for case in stmt.cases:
+            pattern = NameUses.of(case.pattern, case.guard)
+            pattern.writes |= Liveness.pattern_captures(case.pattern)
+            cases.append(self.new_node(pattern.reads, pattern.writes, [self.build_body(case.body, after)]))
+        return self.new_node(NameUses.of(stmt.subject).reads, successors=cases + [after])
+
+    @staticmethod
+    def pattern_captures(pattern):
+        captures = set()
+        for node in ast.walk(pattern):
+            if isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+                captures.add(node.name)
+            elif isinstance(node, ast.MatchMapping) and node.rest:
+                captures.add(node.rest)
+        return captures
+
+    def solve(self):
+        predecessors = {id(node): [] for node in self.nodes}
+        for node in self.nodes:
+            for successor in node.successors:
+                predecessors[id(successor)].append(node)
+
+        # nodes are created from the end of the scope, so start with them.
+        worklist = self.nodes[::-1]
+        queued = {id(node) for node in worklist}
+        while worklist:
+            node = worklist.pop()
+            queued.discard(id(node))
+            live_out = set()
+            for successor in node.successors:
+                live_out |= successor.live_in
+            live_in = node.uses | (live_out - node.defs)
+            if live_in != node.live_in:
+                node.live_in = live_in
+                for predecessor in predecessors[id(node)]:
+                    if id(predecessor) not in queued:
+                        queued.add(id(predecessor))
+                        worklist.append(predecessor)
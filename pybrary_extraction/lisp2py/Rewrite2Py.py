@@ -1,27 +1,86 @@
 import ast
-import copy
 import sys
 from typing import Any
 
-from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
 from pybrary_extraction.python2lisp import Py2Lisp
-from pybrary_extraction.lisp2py.Lisp2Py import Lisp2Py
+from pybrary_extraction.lisp2py.Lisp2Py import Lisp2Py, WrapStatementList
 # from pybrary_extraction.python2lisp import Py2Lisp
 from pybrary_extraction.ast_utils import StringReplacer
+from pybrary_extraction.lisp2py.AbstractionLibrary import AbstractionLibrary
 from pybrary_extraction.lisp2py.KickTrailingParamsVisitor import KickOutTrailingParam
 from pybrary_extraction.lisp2py.ExtractedFragment import AddScopeLinks
 
-class AbstractionCall:
-    def __init__(self, func_name, params=None):
-        self.func_name = func_name
-        self.params = params
 
-        self.items = ['Call', func_name]
-        if params:
-            self.items += params
+class RewriteCalls(WrapStatementList):
+    """
+    The passes of Rewrite2Py over a LispTree, in one traversal, in place: bodies are wrapped
+    in chains of StatementList nodes, as by WrapStatementList, abstraction calls in Call nodes
+    with the abstraction's additional parameters, and calls that are statements in Expr
+    nodes, or in Assign nodes of the variables the abstraction returns.
+    """
 
-    def __getitem__(self, item):
-        return self.items[item]
+    def __init__(self, tree, rewrite: "Rewrite2Py"):
+        super().__init__(tree)
+        self.rewrite = rewrite
+        self.abstraction_symbols = {i for i, symbol in enumerate(tree.symbols)
+                                    if symbol.startswith(rewrite.abstraction_prefix)}
+        self.statement_symbol = tree.symbol_id(Py2Lisp.statement_keyword)
+
+    def visit(self, node):
+        head = self.tree.head(node)
+        if head is None:
+            return self.generic_visit(node)  # every list is visited, whatever its head.
+        return self.visit_method(head)(node)
+
+    def leave(self, node):
+        tree = self.tree
+        atoms, children = tree.atoms, tree.children
+        start = tree.start(node)
+        end = start + tree.length(node)
+        if start == end:
+            return node
+        if self.abstraction_symbols:
+            for index in range(start + 1, end):
+                if atoms[children[index]] in self.abstraction_symbols:
+                    # an abstraction that is not applied to arguments.
+                    self.rewrite.abstractions_used.add(tree.atom(children[index]))
+                    children[index] = tree.add_list([tree.add_shared_atom('Call'), children[index]])
+
+        head_symbol = atoms[children[start]]
+        if head_symbol in self.abstraction_symbols:
+            # an abstraction applied to its arguments.
+            head = tree.symbols[head_symbol]
+            self.rewrite.abstractions_used.add(head)
+            args = list(children[start + 1:end])
+            signature = self.rewrite.library.get(head)
+            if signature is not None:
+                args += [tree.add_shared_atom(i) for i in signature.additional_params]
+            node = tree.add_list([tree.add_shared_atom('Call'), children[start],
+                                  tree.add_list([tree.add_shared_atom(Py2Lisp.list_keyword), *args])])
+        elif head_symbol == self.statement_symbol and end - start > 1:
+            statement = children[start + 1]
+            if tree.head(statement) == 'Call':
+                children[start + 1] = self.wrap_call(statement)
+        return node
+
+    def wrap_call(self, call_node):
+        """An unwrapped call node, as a statement."""
+        tree = self.tree
+        abstraction_name = tree.child(call_node, 1) if tree.length(call_node) > 1 else None
+        signature = None
+        if abstraction_name is not None and tree.is_atom(abstraction_name):
+            signature = self.rewrite.library.get(tree.atom(abstraction_name))
+        if signature is not None and signature.returned_vars:
+            returned_vars = [tree.add_shared_atom(i) for i in signature.returned_vars]
+            if len(returned_vars) == 1:
+                targets = returned_vars
+            else:
+                targets = [tree.add_list([tree.add_shared_atom('Tuple'),
+                                          tree.add_list([tree.add_shared_atom(Py2Lisp.list_keyword), *returned_vars])])]
+            return tree.add_list([tree.add_shared_atom('Assign'),
+                                  tree.add_list([tree.add_shared_atom(Py2Lisp.list_keyword), *targets]), call_node])
+        # '(ProgramStatements (Assign (__list__ x) (Call fn_0)))'
+        return tree.add_list([tree.add_shared_atom('Expr'), call_node])
 
 
 class Rewrite2Py:
@@ -33,115 +92,48 @@ class Rewrite2Py:
                  available_abstractions: list,
                  abstraction_prefix='fn_',
                  library_name='leroy_library',
-                 string_hashmap=None):
+                 string_hashmap=None,
+                 construction_cache=None):
 
         self.lisp_str = lisp_str
         self.available_abstractions = available_abstractions
+        # a list of StitchAbstraction, or the AbstractionLibrary of the run.
+        self.library = AbstractionLibrary.of(available_abstractions)
         self.abstraction_prefix = abstraction_prefix
         self.abstractions_used = set()
         self.library_name = library_name
         if string_hashmap is None:
             string_hashmap = {}
         self.string_hashmap = string_hashmap
+        # a `ConstructionCache` shared with the other programs of the run, if any.
+        self.construction_cache = construction_cache
         self.converted_ast = None
 
-    def convert(self, unparse=True):
+    def convert(self, unparse=True, quiet=False):
 
-        lisp_parts = Lisp2Py.parse_lisp(self.lisp_str)
-        lisp_parts = Lisp2Py.wrap_module(lisp_parts)
-        lisp_parts = Lisp2Py.wrap_statements_list(lisp_parts)
-        lisp_parts = self.create_abstraction_calls(lisp_parts)
-        lisp_parts = self.make_calls_exprs(lisp_parts)
-        self.check_for_list_param(lisp_parts)
-        py_ast = Lisp2Py.construct(lisp_parts)
-        if len(self.available_abstractions):
+        lisp_tree = Lisp2Py.parse_lisp_tree(self.lisp_str)
+        lisp_tree = Lisp2Py.wrap_module(lisp_tree)
+        lisp_tree.root = RewriteCalls(lisp_tree, self).visit(lisp_tree.root)
+        self.check_for_list_param(lisp_tree)
+        py_ast = Lisp2Py.construct(lisp_tree, self.construction_cache)
+        if len(self.library):
             AddScopeLinks().visit(py_ast)
-            KickOutTrailingParam(self.available_abstractions).visit(py_ast)
+            KickOutTrailingParam(self.library).visit(py_ast)
         StringReplacer(self.string_hashmap).visit(py_ast)
         py_ast = self.add_library_import_statements(py_ast)
         py_ast.type_ignores = []
         ast.fix_missing_locations(py_ast)
-        print(ast.dump(py_ast, indent=4))
+        if not quiet:
+            print(ast.dump(py_ast, indent=4))
         self.converted_ast = py_ast
         if unparse:
             return ast.unparse(py_ast)
 
-    def check_for_list_param(self, lisp_parts):
-        if len(lisp_parts) > 1 and \
-                isinstance(lisp_parts[1], list) and \
-                len(lisp_parts[1]) and \
-                lisp_parts[1][0] == Py2Lisp.list_keyword:
+    def check_for_list_param(self, lisp_tree):
+        root = lisp_tree.root
+        if lisp_tree.length(root) > 1 and lisp_tree.head(lisp_tree.child(root, 1)) == Py2Lisp.list_keyword:
             raise Exception(f"Shouldn't be {Py2Lisp.list_keyword} here.")
 
-    def create_abstraction_calls(self, lisp_root):
-        """Wrap abstraction calls with 'Call' nodes and pass additional
-        parameters if necessary."""
-        if isinstance(lisp_root, str):
-            if lisp_root.startswith(self.abstraction_prefix):
-                self.abstractions_used.add(lisp_root)
-                return AbstractionCall(lisp_root)
-            return lisp_root
-        elif isinstance(lisp_root, list):
-            new_lisp = []
-            for node in lisp_root:
-                new_lisp.append(self.create_abstraction_calls(node))
-
-            # if lisp_root[0].startswith(self.abstraction_prefix):
-            if isinstance(new_lisp[0], AbstractionCall):
-                fn_name = new_lisp[0].func_name
-                args = copy.deepcopy(new_lisp[1:])
-                matches = self.get_matching_abstraction(fn_name)
-                if len(matches) > 0:
-                    additional_params = matches[0].get_additional_params()
-                    if len(additional_params) > 0:
-                        args += additional_params
-
-                new_lisp_root = ['Call', fn_name, ['__list__', *args]]
-
-                self.abstractions_used.add(fn_name)
-                return new_lisp_root
-            return new_lisp
-
-    def make_calls_exprs(self, lisp_root):
-        """Wrap function calls with 'Expr' nodes in case they are outer level statements."""
-        if isinstance(lisp_root, str):
-            return lisp_root
-        elif isinstance(lisp_root, list):
-            # recursion
-            final_list = []
-            for node in lisp_root:
-                final_list.append(
-                    self.make_calls_exprs(node)
-                )
-            if lisp_root[0]==Py2Lisp.statement_keyword\
-                and (isinstance(lisp_root[1], list) or isinstance(lisp_root[1], AbstractionCall)) \
-                and lisp_root[1][0]=='Call':
-                # an unwrapped call node.
-
-                call_node = lisp_root[1]
-                abstraction_name = call_node[1]
-                matches = self.get_matching_abstraction(abstraction_name)
-                new_nodes = None
-                if len(matches) > 0 and matches[0].returned_vars:
-                    if len(matches[0].returned_vars)==1:
-                        new_nodes= ['Assign', ['__list__', *matches[0].returned_vars], call_node]
-                    else:
-                        new_nodes = ['Assign',
-                                     ['__list__', ['Tuple', ['__list__', *matches[0].returned_vars]]],
-                                     call_node
-                                     ]
-                else:
-                    # '(ProgramStatements (Assign (__list__ x) (Call fn_0)))'
-                    new_nodes = ['Expr', call_node]
-                final_list[1] = new_nodes
-            # wrap here.
-            return final_list
-
-        return lisp_root
-
-    def get_matching_abstraction(self, abstraction_name: str) -> list[StitchAbstraction]:
-        return list(filter(lambda x: x.abstraction_name == abstraction_name, self.available_abstractions))
-
     def add_library_import_statements(self, py_ast):
         import_statements = []
         for abstraction_name in sorted(list(self.abstractions_used)):
@@ -1,5 +1,6 @@
 import ast
 
+from pybrary_extraction import profiling
 import pybrary_extraction.lisp2py as lisp2py
 import pybrary_extraction.python2lisp as python2lisp
 from pybrary_extraction.ast_utils import FindReadVariables
@@ -16,24 +17,50 @@ class StitchParam:
 
 
 class StitchUse:
+    """A use of an abstraction, with its application and target decoded on first use."""
+
     def __init__(self, application, target, string_hashmap):
         # target code-scope where abstraction is applied.
         self.application = application
         self.target = target
         self.string_hashmap = string_hashmap
-
-        Py2Lisp = python2lisp.Py2Lisp
-        wrapped_app = f"({Py2Lisp.module_keyword} " \
-                      f"({Py2Lisp.statement_keyword} ({application}) {Py2Lisp.empty_statement_keyword}))"
-
-        rewrite_app = lisp2py.Rewrite2Py(wrapped_app, available_abstractions=[], string_hashmap=self.string_hashmap)
-        rewrite_app.convert(unparse=False)
-        self.application_ast: ast.Module = rewrite_app.converted_ast
-        rewrite_target = lisp2py.Rewrite2Py(target, available_abstractions=[], string_hashmap=self.string_hashmap)
-        self.target_py = rewrite_target.convert()
-        self.target_ast: ast.Module = rewrite_target.converted_ast
+        self._application_ast = None
+        self._target_py = None
+        self._target_ast = None
         self.parameter_map = {} # map of param_name -> value passes
 
+    @property
+    def application_ast(self) -> ast.Module:
+        if self._application_ast is None:
+            Py2Lisp = python2lisp.Py2Lisp
+            wrapped_app = f"({Py2Lisp.module_keyword} " \
+                          f"({Py2Lisp.statement_keyword} ({self.application}) {Py2Lisp.empty_statement_keyword}))"
+            with profiling.stage("decode_uses"):
+                rewrite_app = lisp2py.Rewrite2Py(wrapped_app, available_abstractions=[],
+                                                 string_hashmap=self.string_hashmap)
+                rewrite_app.convert(unparse=False, quiet=True)
+            self._application_ast = rewrite_app.converted_ast
+        return self._application_ast
+
+    @property
+    def target_py(self) -> str:
+        if self._target_py is None:
+            self.decode_target()
+        return self._target_py
+
+    @property
+    def target_ast(self) -> ast.Module:
+        if self._target_ast is None:
+            self.decode_target()
+        return self._target_ast
+
+    def decode_target(self):
+        with profiling.stage("decode_uses"):
+            rewrite_target = lisp2py.Rewrite2Py(self.target, available_abstractions=[],
+                                                string_hashmap=self.string_hashmap)
+            self._target_py = rewrite_target.convert(quiet=True)
+        self._target_ast = rewrite_target.converted_ast
+
     def set_params_map_from_stitch_params(self, stitch_params: set[StitchParam]):
         func_call: ast.Call = self.application_ast.body[-1].value
         for param in stitch_params:
@@ -62,42 +89,53 @@ class StitchAbstraction:
     def __init__(self, abstraction_body_lisp, uses, abstraction_name, string_hashmap):
         self.abstraction_body_lisp = abstraction_body_lisp
         self.uses = uses
-        self.uses_py = []
         self.parameters: set[StitchParam] = set()  # input parameters
         self.live_vars_out = set()  # live variables out the block
         self.returned_vars = set()  # variables returned by the abstraction
         self.abstraction_body_py = None
         self.abstraction_name = abstraction_name
         self.string_hashmap = string_hashmap
-
-        for use in self.uses:
-            for application, target in use.items():
-                # 'application' is a function call that always looks like
-                # fn_0 param1 param2 param3 ...
-
-                self.uses_py.append(
-                    StitchUse(
-                        application, target, self.string_hashmap
-                    )
-                )
-
-    def get_and_set_live_out(self, original_lisps):
-        py_originals = []
-        for lisp in original_lisps:
-            py_originals.append(
-                lisp2py.Lisp2Py(lisp, string_hashmap=self.string_hashmap).convert())
+        self._uses_py = None
+
+    @property
+    def uses_py(self) -> list[StitchUse]:
+        """A StitchUse of every use. None of them is decoded until it is looked at."""
+        if self._uses_py is None:
+            # 'application' is a function call that always looks like
+            # fn_0 param1 param2 param3 ...
+            self._uses_py = [StitchUse(application, target, self.string_hashmap)
+                             for use in self.uses for application, target in use.items()]
+        return self._uses_py
+
+    def sample_uses(self, sample=None):
+        """The uses, or at most `sample` of them, spread evenly over the uses."""
+        uses_py = self.uses_py
+        if sample is None or len(uses_py) <= sample:
+            return uses_py
+        return [uses_py[i * len(uses_py) // sample] for i in range(sample)]
+
+    def get_and_set_live_out(self, original_lisps, candidates=None, sample=None):
+        """`original_lisps` is a list of lisp programs, or a `DecodedCorpus` shared with other abstractions.
+        The variables live out of any use are live out of the abstraction. Once all of `candidates`,
+        if given, are live out, the remaining uses cannot change what is returned, and are skipped.
+        With a `sample`, only that many uses are looked at, which may miss live variables."""
+        if isinstance(original_lisps, lisp2py.DecodedCorpus):
+            py_originals = original_lisps
+        else:
+            py_originals = lisp2py.DecodedCorpus(original_lisps, self.string_hashmap)
 
         live_vars_out = set()
-        for use in self.uses_py:
+        for use in self.sample_uses(sample):
+            if candidates is not None and live_vars_out.issuperset(candidates):
+                break
             use.set_params_map_from_stitch_params(self.parameters)
-            live_vars_out = self.find_live_vars_from_extracted_fragment(py_originals, use)
-            live_vars_out = live_vars_out.union(
+            use_live_vars = self.find_live_vars_from_extracted_fragment(py_originals, use)
+            use_live_vars = use_live_vars.union(
                 self.find_live_vars_from_trailing_statements(use))
             name_map = use.get_param_map_filtered_by_names()
-            if intersecting := live_vars_out.intersection(set(name_map.keys())):
-                live_vars_out = live_vars_out.union({name_map[i] for i in intersecting})
-
-
+            if intersecting := use_live_vars.intersection(set(name_map.keys())):
+                use_live_vars = use_live_vars.union({name_map[i] for i in intersecting})
+            live_vars_out = live_vars_out.union(use_live_vars)
 
         self.live_vars_out = self.live_vars_out.union(live_vars_out)
         return live_vars_out
@@ -121,18 +159,25 @@ class StitchAbstraction:
         is_abstraction_call = lambda x: isinstance(x, ast.Call) and x.func.id.startswith("fn_")
         new_body = list(filter(lambda x:
                                not isinstance(x, ast.ImportFrom) and not is_abstraction_call(x), use.target_ast.body))
+        if lisp2py.FragmentIndex.can_locate(new_body):
+            for fragment in py_originals.fragment_index.locate(new_body):
+                live_vars_out = live_vars_out.union(fragment.find_used_vars_later())
+            return live_vars_out
+
         target = ast.unparse(ast.Module(body=new_body, type_ignores=[]))
         for py_orig in py_originals:
-            index = py_orig.find(target)
+            index = py_orig.source.find(target)
             if index != -1:
                 # Found the code where the method was extracted.
                 live_vars = lisp2py.ExtractedFragment \
-                    .create_from(py_orig, target, index).find_used_vars_later()
+                    .create_from(py_orig.source, target, index, py_orig.scoped_ast).find_used_vars_later()
                 live_vars_out = live_vars_out.union(live_vars)
         return live_vars_out
 
     def get_additional_params(self):
-        return [i for i in self.parameters if not i.param_name.startswith(lisp2py.Abstraction2Py.PARAM_KEY)]
+        # in the order of the abstraction's function arguments.
+        return [i for i in sorted(self.parameters, key=lambda x: x.position)
+                if not i.param_name.startswith(lisp2py.Abstraction2Py.PARAM_KEY)]
 
     def get_trailing_statement_params(self)-> list[StitchParam]:
         return list(filter(lambda x: x.is_trailing, self.parameters))
@@ -142,13 +187,36 @@ class StitchAbstraction:
             if p.param_name in params:
                 p.is_trailing = True
 
-    def compute_body_py(self, stitch_originals):
+    def to_json(self):
+        """What rewriting calls of the abstraction, and writing it, need of it, as json."""
+        return {
+            "name": self.abstraction_name,
+            "body": self.abstraction_body_lisp,
+            "parameters": [[i.param_name, i.position, i.is_trailing]
+                           for i in sorted(self.parameters, key=lambda x: x.position)],
+            "live_vars_out": sorted(self.live_vars_out),
+            "returned_vars": list(self.returned_vars),
+            "body_py": self.abstraction_body_py,
+        }
+
+    @staticmethod
+    def from_json(abstraction_json):
+        abstraction = StitchAbstraction(abstraction_json["body"], [], abstraction_json["name"], {})
+        abstraction.parameters = {StitchParam(*param) for param in abstraction_json["parameters"]}
+        abstraction.live_vars_out = set(abstraction_json["live_vars_out"])
+        abstraction.returned_vars = abstraction_json["returned_vars"]
+        abstraction.abstraction_body_py = abstraction_json["body_py"]
+        return abstraction
+
+    def compute_body_py(self, stitch_originals, liveness_sample=None):
         abstraction_py_obj = lisp2py.Abstraction2Py(self, self.string_hashmap)
         self.abstraction_body_py = \
             abstraction_py_obj.convert(add_return_value=False)
         self.set_trailing_statement_param(*abstraction_py_obj.trailing_statement_params)
 
-        self.get_and_set_live_out(stitch_originals)
+        with profiling.stage("liveness"):
+            candidates = abstraction_py_obj.get_return_var_candidates(abstraction_py_obj.abstraction_body_as_fndef)
+            self.get_and_set_live_out(stitch_originals, candidates, liveness_sample)
         abstraction_py_obj.add_return_value(abstraction_py_obj.abstraction_body_as_fndef)
         self.abstraction_body_py = ast.unparse(abstraction_py_obj.abstraction_body_as_fndef)
         return self.abstraction_body_py
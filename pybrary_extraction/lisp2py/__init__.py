@@ -1,4 +1,7 @@
+from .AbstractionLibrary import AbstractionLibrary
 from .Rewrite2Py import Rewrite2Py
 from .Lisp2Py import Lisp2Py
 from .Abstraction2Py import Abstraction2Py
-from .ExtractedFragment import ExtractedFragment
\ No newline at end of file
+from .ExtractedFragment import ExtractedFragment
+from .FragmentIndex import FragmentIndex
+from .DecodedCorpus import DecodedCorpus
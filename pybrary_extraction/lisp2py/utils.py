@@ -1,5 +1,6 @@
 import ast
-import pylint
+import builtins
+import symtable
 import tempfile
 import json
 import re
@@ -29,13 +30,15 @@ class StatementList:
 
     @staticmethod
     def _decode(start_statement):
-        all_statements_list = [start_statement.statement1]
-        if isinstance(start_statement.statement2, StatementList):
-            all_statements_list += StatementList._decode(start_statement.statement2)
-        elif isinstance(start_statement.statement2, list):
-            all_statements_list += start_statement.statement2
+        all_statements_list = []
+        statement = start_statement
+        while isinstance(statement, StatementList):
+            all_statements_list.append(statement.statement1)
+            statement = statement.statement2
+        if isinstance(statement, list):
+            all_statements_list += statement
         else:
-            all_statements_list.append(start_statement.statement2) #appends any statement
+            all_statements_list.append(statement) #appends any statement
         return all_statements_list
 
 
@@ -46,18 +49,193 @@ def has_return_stmnt(py_ast):
     return False
 
 
+# names that are defined in every module, besides the builtins.
+MODULE_NAMES = {'__file__', '__path__', '__builtins__'}
+# names that are defined in every class body.
+CLASS_NAMES = {'__module__', '__qualname__'}
+
+
 def get_undef_vars(code_str):
-    '''Find undefined variables within the code-block'''
+    '''Find undefined variables within the code-block.
 
-    ERR_CODE = 'E0602'
+    A name is undefined when it is read in a scope that resolves it to the
+    module, and neither the module, a `global` declaration nor the builtins
+    define it, or when it is deleted in a scope that never binds it.
+    Reads guarded by `except NameError` are not reported.
+    Agrees with pylint's E0602 (undefined-variable) on the code we generate.'''
+    try:
+        py_ast = ast.parse(code_str)
+        module_table = symtable.symtable(code_str, "<abstraction>", "exec")
+    except SyntaxError:
+        return set()
+
+    bindings = NameBindings()
+    bindings.visit(py_ast)
+
+    defined = set(dir(builtins)) | MODULE_NAMES
+    for symbol in module_table.get_symbols():
+        if symbol.is_assigned() or symbol.is_imported() or symbol.is_annotated() or symbol.is_namespace():
+            defined.add(symbol.get_name())
+    defined -= bindings.module_deleted_only
+
+    undef_vars = set(bindings.module_deleted_only)
+    tables = [module_table]
+    while tables:
+        table = tables.pop()
+        tables += table.get_children()
+        for symbol in table.get_symbols():
+            name = symbol.get_name()
+            if symbol.is_declared_global() and symbol.is_assigned():
+                defined.add(name)
+            if symbol.is_referenced() and resolves_to_module(table, symbol) and \
+                    not (table.get_type() == 'class' and name in CLASS_NAMES):
+                undef_vars.add(name)
+
+    return ((undef_vars - defined) | bindings.local_deleted_only) & bindings.unguarded
+
+
+def resolves_to_module(table, symbol):
+    if table.get_type() != 'module' and \
+            (symbol.is_assigned() or symbol.is_parameter() or symbol.is_imported()):
+        # before python 3.13, symtable takes every scope named "top" for the module,
+        # and then reports the names it binds as global.
+        return symbol.is_declared_global()
+    return symbol.is_global()
+
+
+class NameBindings(ast.NodeVisitor):
+    """
+    What `symtable` cannot tell us: names that a scope deletes but never binds,
+    and names read or deleted at least once outside a `try` that handles NameError.
+    """
+
+    def __init__(self):
+        # (bound, deleted) names of the enclosing scopes, innermost last.
+        self.scopes = [(set(), set())]
+        self.name_error_guarded = False
+        self.unguarded = set()
+        self.module_deleted_only = set()
+        self.local_deleted_only = set()
+
+    def visit_Module(self, node):
+        self.generic_visit(node)
+        bound, deleted = self.scopes[0]
+        self.module_deleted_only = deleted - bound
+
+    def bind(self, name):
+        if name is not None:
+            self.scopes[-1][0].add(name)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self.bind(node.id)
+            return
+        if isinstance(node.ctx, ast.Del):
+            self.scopes[-1][1].add(node.id)
+        if not self.name_error_guarded:
+            self.unguarded.add(node.id)
+
+    def visit_arg(self, node):
+        self.bind(node.arg)
+        self.generic_visit(node)
+
+    def visit_alias(self, node):
+        if node.name != '*':
+            self.bind(node.asname or node.name.split('.')[0])
+
+    def visit_Global(self, node):
+        for name in node.names:
+            self.bind(name)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_ExceptHandler(self, node):
+        self.bind(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchAs(self, node):
+        self.bind(node.name)
+        self.generic_visit(node)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node):
+        self.bind(node.rest)
+        self.generic_visit(node)
+
+    def visit_scope(self, node, outer_fields, inner_fields):
+        if hasattr(node, 'name'):
+            self.bind(node.name)
+        for field in outer_fields:
+            self.visit_field(node, field)
+        self.scopes.append((set(), set()))
+        for field in inner_fields:
+            self.visit_field(node, field)
+        bound, deleted = self.scopes.pop()
+        self.local_deleted_only |= deleted - bound
+
+    def visit_field(self, node, field):
+        value = getattr(node, field, None)
+        if isinstance(value, list):
+            for child in value:
+                self.visit(child)
+        elif isinstance(value, ast.AST):
+            self.visit(value)
+
+    def visit_FunctionDef(self, node):
+        # decorators, defaults and annotations are evaluated in the enclosing scope.
+        self.visit_scope(node, ['decorator_list', 'returns'], ['args', 'body'])
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.visit_scope(node, [], ['args', 'body'])
+
+    def visit_ClassDef(self, node):
+        self.visit_scope(node, ['decorator_list', 'bases', 'keywords'], ['body'])
+
+    def visit_Try(self, node):
+        guarded = self.name_error_guarded
+        # pylint also trusts the else clause of a guarded try.
+        self.name_error_guarded = guarded or any(
+            NameBindings.handles_name_error(handler) for handler in node.handlers)
+        for child in node.body + node.orelse:
+            self.visit(child)
+        self.name_error_guarded = guarded
+        for child in node.handlers + node.finalbody:
+            self.visit(child)
+
+    visit_TryStar = visit_Try
 
-    code_file = tempfile.NamedTemporaryFile("w", prefix='code_')
+    @staticmethod
+    def handles_name_error(handler):
+        if handler.type is None:
+            return False
+        exceptions = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        return any(isinstance(e, ast.Name) and e.id in ('NameError', 'UnboundLocalError')
+                   for e in exceptions)
+
+
+def get_undef_vars_pylint(code_str):
+    '''Find undefined variables within the code-block, with pylint.'''
+    code_file = tempfile.NamedTemporaryFile("w", prefix='code_', suffix='.py')
     code_file.write(code_str)
     code_file.flush()
+    undef_vars = pylint_undef_vars([code_file.name]).get(code_file.name, set())
+    code_file.close()
+    return undef_vars
+
+
+def pylint_undef_vars(paths):
+    '''Run pylint's undefined-variable check (E0602) once over `paths`.
+    Returns the undefined variables of every file that has any.'''
+    import pylint  # optional dependency: pip install pylint
+
+    ERR_CODE = 'E0602'
+
     pylint_out = tempfile.NamedTemporaryFile("w", prefix='pylint_')
-    # pylint_out.close()
     try:
-        pylint.run_pylint(["pylint", code_file.name,
+        pylint.run_pylint(["pylint", *paths,
                            "--errors-only", "--disable=all",
                            "--enable=E0602", "--output-format=json", f"--output={pylint_out.name}"])
     except SystemExit:
@@ -67,12 +245,11 @@ def get_undef_vars(code_str):
         out_data = json.loads(f.read())
 
     pylint_out.close()
-    code_file.close()
 
-    undef_vars = set()
+    undef_vars = {}
     for d in out_data:
         if (d['message-id'] == ERR_CODE):
             var_name = re.findall('\'([^"]*)\'', d['message'])[0]
-            undef_vars.add(var_name)
+            undef_vars.setdefault(d['path'], set()).add(var_name)
 
     return undef_vars
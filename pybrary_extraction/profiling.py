@@ -0,0 +1,169 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not on windows.
+    resource = None
+
+# the profiler of the current run, set by `enable`. Stages are not timed while it is None.
+profiler = None
+
+
+def enable(trace=False):
+    """Start recording stages, for the rest of the process or until `disable`."""
+    global profiler
+    profiler = Profiler(trace)
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
+
+
+def stage(name, abstraction=None):
+    """Time the code in this context as a call of the stage `name`, if profiling is enabled.
+    See `Profiler.stage`."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, abstraction)
+
+
+def peak_rss_bytes():
+    """The peak resident set size of this process, and of its largest finished child process."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes, but in bytes on macOS.
+    unit = 1 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit
+
+
+def cpu_seconds():
+    """The cpu time of this process, and of its finished child processes, e.g. of a process pool."""
+    if resource is None:
+        return time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = None
+        self.rss_increase_bytes = 0  # how much the calls raised the peak rss.
+
+    def add(self, wall_seconds, cpu_seconds, rss_before, rss_after):
+        self.calls += 1
+        self.wall_seconds += wall_seconds
+        self.cpu_seconds += cpu_seconds
+        if rss_after is not None:
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss_after)
+            self.rss_increase_bytes += rss_after - rss_before
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "rss_increase_bytes": self.rss_increase_bytes,
+        }
+
+
+class Profiler:
+    """
+    Wall time, cpu time, calls and peak rss of each stage of a Leroy run, in total
+    and per abstraction, and optionally every call as a Chrome trace event, which
+    perfetto (ui.perfetto.dev) and chrome://tracing can show.
+
+    Stages nest, and the time of a stage includes the stages inside it. A stage
+    belongs to the abstraction it is given, or else to that of the stage it is in.
+    Stages that run in worker processes are not recorded, only the stage that
+    waits for them.
+    """
+    VERSION = 1
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}  # stage name -> StageStats, in the order they first started.
+        self.abstractions = {}  # abstraction name -> stage name -> StageStats
+        self.trace_events = []
+        self.open_stages = []  # (name, abstraction) of the stages running now, innermost last.
+        self.start_wall = time.perf_counter()
+        self.start_cpu = cpu_seconds()
+
+    @contextlib.contextmanager
+    def stage(self, name, abstraction=None):
+        if abstraction is None and self.open_stages:
+            abstraction = self.open_stages[-1][1]
+        self.open_stages.append((name, abstraction))
+        stats = self.stages.setdefault(name, StageStats())
+        rss_before = peak_rss_bytes()
+        cpu_before = cpu_seconds()
+        wall_before = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_after = time.perf_counter()
+            cpu_after = cpu_seconds()
+            rss_after = peak_rss_bytes()
+            self.open_stages.pop()
+            measures = (wall_after - wall_before, cpu_after - cpu_before, rss_before, rss_after)
+            stats.add(*measures)
+            if abstraction is not None:
+                self.abstractions.setdefault(abstraction, {}).setdefault(name, StageStats()).add(*measures)
+            if self.trace:
+                self.add_trace_event(name, abstraction, wall_before, wall_after)
+
+    def add_trace_event(self, name, abstraction, wall_before, wall_after):
+        event = {
+            "name": name,
+            "cat": "leroy",
+            "ph": "X",  # a complete event, with its duration.
+            "ts": (wall_before - self.start_wall) * 1e6,
+            "dur": (wall_after - wall_before) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if abstraction is not None:
+            event["args"] = {"abstraction": abstraction}
+        self.trace_events.append(event)
+
+    def report(self):
+        return {
+            "version": Profiler.VERSION,
+            "command": sys.argv,
+            "total": {
+                "wall_seconds": time.perf_counter() - self.start_wall,
+                "cpu_seconds": cpu_seconds() - self.start_cpu,
+                "peak_rss_bytes": peak_rss_bytes(),
+            },
+            "stages": {name: stats.to_json() for name, stats in self.stages.items()},
+            "abstractions": {abstraction: {name: stats.to_json() for name, stats in stages.items()}
+                             for abstraction, stages in self.abstractions.items()},
+        }
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def write_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """The stages as a table, slowest first."""
+        lines = [f"{'stage':<20} {'calls':>8} {'wall s':>9} {'cpu s':>9} {'peak rss MB':>12}"]
+        for name, stats in sorted(self.stages.items(), key=lambda x: -x[1].wall_seconds):
+            peak_rss = f"{stats.peak_rss_bytes / 2 ** 20:.1f}" if stats.peak_rss_bytes is not None else "-"
+            lines.append(f"{name:<20} {stats.calls:>8} {stats.wall_seconds:>9.3f} {stats.cpu_seconds:>9.3f} "
+                         f"{peak_rss:>12}")
+        return "\n".join(lines)
@@ -0,0 +1,180 @@
+import ast
+
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.python2lisp import Py2Lisp
+
+GRANULARITIES = ("file", "definition")
+DEFINITION_KEYWORDS = ("FunctionDef", "AsyncFunctionDef", "ClassDef")
+METHOD_KEYWORDS = ("FunctionDef", "AsyncFunctionDef")
+# the body of a class shell, which its methods and statements replace.
+SHELL_BODY = Py2Lisp.generated_constructed_list(["Pass"])
+
+
+def read_spans(lisp_str):
+    """The s-expression of `lisp_str`, as for `LispReader.read`, but with where each part of it
+    is: a list is a (start, end, children) tuple, an atom a (start, end, None) tuple."""
+    stack = []
+    for match in LispReader.TOKEN_PATTERN.finditer(lisp_str):
+        token = match.group(0)
+        if token == "(":
+            stack.append((match.start(), []))
+        elif token == ")":
+            start, children = stack.pop()
+            node = (start, match.end(), children)
+            if not stack:
+                return node
+            stack[-1][1].append(node)
+        elif stack:
+            stack[-1][1].append((match.start(), match.end(), None))
+    raise ValueError(f"Not an s-expression: {lisp_str[:100]}")
+
+
+def head(lisp_str, node):
+    """The first atom of a list node, or None."""
+    children = node[2]
+    if not children or children[0][2] is not None:
+        return None
+    return lisp_str[children[0][0]:children[0][1]]
+
+
+def chain_statements(lisp_str, chain):
+    """The statements of a right-nested chain of StatementList nodes."""
+    statements = []
+    while chain[2] is not None and head(lisp_str, chain) == Py2Lisp.statement_keyword and len(chain[2]) == 3:
+        statement, chain = chain[2][1], chain[2][2]
+        if chain[2] is None and lisp_str[statement[0]:statement[1]] == Py2Lisp.empty_statement_keyword:
+            break  # the chain of an empty block.
+        statements.append(statement)
+    return statements
+
+
+def class_body(lisp_str, node):
+    """The chain of the body of a ClassDef node."""
+    for child in node[2][1:]:
+        if child[2] is not None and head(lisp_str, child) == Py2Lisp.keyword_for_keyword and \
+                lisp_str[child[2][1][0]:child[2][1][1]] == "body":
+            return child[2][2]
+    return None
+
+
+def program_of(statements):
+    """The encoding of a module of `statements`, the encodings of its statements."""
+    return f"({Py2Lisp.module_keyword} {Py2Lisp.generated_constructed_list(statements)})"
+
+
+def split_statements(lisp_str, statements, pieces):
+    """Append pieces of `statements` to `pieces`: each function on its own, and each run of
+    other statements together. Returns the indices of the pieces, in order."""
+    indices = []
+    run = []
+    for statement in statements + [None]:
+        if statement is None or (statement[2] is not None and head(lisp_str, statement) in METHOD_KEYWORDS):
+            if run:
+                indices.append(len(pieces))
+                pieces.append(program_of(run))
+                run = []
+            if statement is not None:
+                indices.append(len(pieces))
+                pieces.append(program_of([lisp_str[statement[0]:statement[1]]]))
+        else:
+            run.append(lisp_str[statement[0]:statement[1]])
+    return indices
+
+
+def split_program(lisp_str):
+    """Split the encoding of a module into the encodings of smaller modules: one for each
+    top-level function, one for each method of a top-level class and for each run of other
+    statements in it, with the class itself, its body left out, in one more, and one for each
+    run of other module-level statements.
+
+    Returns the pieces, and the layout `assemble_program` puts them back together with: for
+    each part of the module in order, {"piece": index} or {"class": index, "body": [index, ...]}.
+    A module that would be a single piece is not split."""
+    root = read_spans(lisp_str)
+    if head(lisp_str, root) != Py2Lisp.module_keyword or len(root[2]) != 2:
+        return [lisp_str], [{"piece": 0}]
+    pieces = []
+    layout = []
+    run = []
+    for statement in chain_statements(lisp_str, root[2][1]) + [None]:
+        keyword = head(lisp_str, statement) if statement is not None and statement[2] is not None else None
+        if statement is not None and keyword not in DEFINITION_KEYWORDS:
+            run.append(statement)
+            continue
+        if run:
+            layout += [{"piece": i} for i in split_statements(lisp_str, run, pieces)]
+            run = []
+        if statement is None:
+            break
+        body = class_body(lisp_str, statement) if keyword == "ClassDef" else None
+        body_statements = chain_statements(lisp_str, body) if body is not None else []
+        if any(i[2] is not None and head(lisp_str, i) in METHOD_KEYWORDS for i in body_statements):
+            layout.append({"class": len(pieces), "body": None})
+            pieces.append(program_of([lisp_str[statement[0]:body[0]] + SHELL_BODY + lisp_str[body[1]:statement[1]]]))
+            layout[-1]["body"] = split_statements(lisp_str, body_statements, pieces)
+        else:
+            layout += [{"piece": i} for i in split_statements(lisp_str, [statement], pieces)]
+    if len(pieces) <= 1:
+        return [lisp_str], [{"piece": 0}]
+    return pieces, layout
+
+
+def split_programs(file_json_map):
+    """The pieces of every program of `file_json_map`, keyed by file and index, in order, and
+    the layout of each file's pieces."""
+    pieces_map = {}
+    layouts = {}
+    for file, lisp_str in file_json_map.items():
+        pieces, layouts[file] = split_program(lisp_str)
+        for i, piece in enumerate(pieces):
+            pieces_map[f"{file}:{i}"] = piece
+    return pieces_map, layouts
+
+
+def piece_statements(piece):
+    """The encodings of the statements of a piece."""
+    root = read_spans(piece)
+    return [piece[statement[0]:statement[1]] for statement in chain_statements(piece, root[2][1])]
+
+
+def join_program(layout, pieces):
+    """The encoding of the module that `split_program` split into `pieces`, with `layout`."""
+    if layout == [{"piece": 0}]:
+        return pieces[0]
+    statements = []
+    for part in layout:
+        if "piece" in part:
+            statements += piece_statements(pieces[part["piece"]])
+            continue
+        shell, = piece_statements(pieces[part["class"]])
+        body = class_body(shell, read_spans(shell))
+        body_statements = [statement for i in part["body"] for statement in piece_statements(pieces[i])]
+        statements.append(shell[:body[0]] + Py2Lisp.generated_constructed_list(body_statements) + shell[body[1]:])
+    return program_of(statements)
+
+
+def piece_count(layout):
+    return sum(1 + len(part["body"]) if "class" in part else 1 for part in layout)
+
+
+def assemble_program(layout, pieces, decode_original, library_name):
+    """The python code of a module from its decoded pieces: the statements of each piece, and
+    the abstractions it uses. A class whose shell was rewritten as a whole, and so no longer
+    decodes to a class, keeps its original shell from `decode_original`, which decodes the
+    original piece at an index."""
+    body = []
+    for part in layout:
+        if "piece" in part:
+            body += pieces[part["piece"]][0]
+            continue
+        shell = pieces[part["class"]][0]
+        if len(shell) != 1 or not isinstance(shell[0], ast.ClassDef):
+            shell = decode_original(part["class"])
+        shell[0].body = [statement for i in part["body"] for statement in pieces[i][0]]
+        body += shell
+    abstractions_used = sorted({name for _, used in pieces for name in used})
+    imports = [ast.ImportFrom(module=library_name, names=[ast.alias(name=name)], level=0)
+               for name in abstractions_used]
+    module = ast.Module(body=imports + body, type_ignores=[])
+    ast.fix_missing_locations(module)
+    return ast.unparse(module)
@@ -1,8 +1,14 @@
 import ast
+import concurrent.futures
+import re
+from itertools import repeat
+from types import GeneratorType
 from typing import Any
 import os
 import sys
 
+from pybrary_extraction import profiling
+
 
 class Py2Lisp(ast.NodeVisitor):
     list_keyword = "__list__"
@@ -12,9 +18,18 @@ class Py2Lisp(ast.NodeVisitor):
     empty_vararg_keyword = 'EMPTY_vararg'
     empty_kwarg_keyword = 'EMPTY_kwarg'
     keyword_for_keyword = "__kw__"
+    # bump whenever the encoding changes, to invalidate cached encodings.
+    encoder_version = 1
+    string_id_template = "STRING_{}"
+    # placeholder for string ids local to a single file. The NUL character
+    # cannot appear in an identifier or a number, so the placeholder never
+    # collides with any other lisp token.
+    local_string_id_template = "\0{}\0"
+    local_string_id_pattern = re.compile("\0([0-9]+)\0")
 
     def __init__(self, string_hash_map=None,
-                 mangle_names=False):
+                 mangle_names=False,
+                 string_id_template=None):
         super().__init__()
         self.string_count = 0
         if string_hash_map is None:
@@ -23,15 +38,29 @@ class Py2Lisp(ast.NodeVisitor):
             self.string_hash_map = string_hash_map
             self.string_count += len(string_hash_map)
         self.mangle_names = mangle_names
+        if string_id_template is None:
+            string_id_template = Py2Lisp.string_id_template
+        self.string_id_template = string_id_template
+        self.out = None  # output buffer of the node being encoded.
 
     @staticmethod
-    def fromDirectoryToJson(
-            directory_path, mangle_names=False):
+    def find_py_files(directory_path):
+        """All .py files below `directory_path`, in sorted path order."""
         py_files = []
-        for folder, subfolders, files in os.walk(directory_path):
-            for file in files:
-                if file.endswith('.py'):
-                    py_files.append(os.path.join(folder, file))
+        with profiling.stage("walk"):
+            for folder, subfolders, files in os.walk(directory_path):
+                subfolders.sort()  # os.walk visits subfolders in this (in-place sorted) order.
+                for file in sorted(files):
+                    if file.endswith('.py'):
+                        py_files.append(os.path.join(folder, file))
+        return py_files
+
+    @staticmethod
+    def fromDirectoryToJson(
+            directory_path, mangle_names=False, workers=1, cache=None):
+        py_files = Py2Lisp.find_py_files(directory_path)
+        if workers > 1 or cache is not None:
+            return Py2Lisp.encode_files(py_files, mangle_names, workers, cache)
 
         out_json = {}
 
@@ -39,15 +68,97 @@ class Py2Lisp(ast.NodeVisitor):
         for file in py_files:
             with open(file) as f:
                 code_str = f.read()
-            code_ast = ast.parse(code_str)
+            with profiling.stage("parse"):
+                code_ast = ast.parse(code_str)
             p2lisp = Py2Lisp(string_hash_map=string_hash_map, mangle_names=mangle_names)
-            lisp_str = p2lisp.visit(code_ast)
+            with profiling.stage("py2lisp"):
+                lisp_str = p2lisp.visit(code_ast)
             out_json[file] = lisp_str
 
             print(f"{p2lisp.string_hash_map=}")
 
         return out_json, string_hash_map
 
+    @staticmethod
+    def encode_source_with_local_strings(code_str, mangle_names=False):
+        """Encode python source with a string table local to it.
+
+        Returns the lisp string, with string ids left as local placeholders,
+        and the string literals in order of first appearance."""
+        p2lisp = Py2Lisp(mangle_names=mangle_names,
+                         string_id_template=Py2Lisp.local_string_id_template)
+        with profiling.stage("parse"):
+            code_ast = ast.parse(code_str)
+        with profiling.stage("py2lisp"):
+            lisp_str = p2lisp.visit(code_ast)
+        return lisp_str, list(p2lisp.string_hash_map)
+
+    @staticmethod
+    def encode_file_with_local_strings(file, mangle_names=False):
+        with open(file) as f:
+            code_str = f.read()
+        return Py2Lisp.encode_source_with_local_strings(code_str, mangle_names)
+
+    @staticmethod
+    def merge_local_encodings(py_files, local_encodings, string_hash_map=None):
+        """Assign global STRING_n ids to per-file encodings.
+
+        Files are merged in the order of `py_files`, so the ids (and therefore the
+        output) are the same as encoding the files one after another with a shared
+        string table."""
+        if string_hash_map is None:
+            string_hash_map = {}
+        out_json = {}
+        for file, (lisp_str, local_strings) in zip(py_files, local_encodings):
+            global_ids = []
+            for string in local_strings:
+                if string not in string_hash_map:
+                    string_hash_map[string] = Py2Lisp.string_id_template.format(len(string_hash_map))
+                global_ids.append(string_hash_map[string])
+            out_json[file] = Py2Lisp.local_string_id_pattern.sub(
+                lambda m: global_ids[int(m.group(1))], lisp_str)
+        return out_json, string_hash_map
+
+    @staticmethod
+    def encode_files(py_files, mangle_names=False, workers=1, cache=None, string_hash_map=None):
+        """Encode `py_files` with per-file string tables and merge them.
+
+        Files found in `cache` (an `EncodingCache`) are neither parsed nor visited.
+        The rest are encoded on a process pool of `workers` processes, if more than one.
+        The output is identical to a serial run of `fromDirectoryToJson`.
+        New strings are added to `string_hash_map`, if given, after the ones it has."""
+        local_encodings = {}
+        sources = {}
+        if cache is not None:
+            for file in py_files:
+                with open(file) as f:
+                    code_str = f.read()
+                cached = cache.get_encoding(code_str, mangle_names)
+                if cached is None:
+                    sources[file] = code_str
+                else:
+                    local_encodings[file] = cached
+        files_to_encode = [file for file in py_files if file not in local_encodings]
+
+        if cache is not None:
+            encode, inputs = Py2Lisp.encode_source_with_local_strings, [sources[i] for i in files_to_encode]
+        else:
+            encode, inputs = Py2Lisp.encode_file_with_local_strings, files_to_encode
+        if workers > 1 and len(inputs) > 1:
+            chunksize = max(1, len(inputs) // (4 * workers))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                new_encodings = list(executor.map(encode, inputs, repeat(mangle_names), chunksize=chunksize))
+        else:
+            new_encodings = [encode(i, mangle_names) for i in inputs]
+
+        for file, encoding in zip(files_to_encode, new_encodings):
+            local_encodings[file] = encoding
+            if cache is not None:
+                cache.put_encoding(sources[file], mangle_names, *encoding)
+
+        return Py2Lisp.merge_local_encodings(
+            py_files, [local_encodings[file] for file in py_files], string_hash_map)
+
     @staticmethod
     def fromFilePath(filePath):
         with open(filePath) as f:
@@ -56,6 +167,52 @@ class Py2Lisp(ast.NodeVisitor):
         lisp_str = Py2Lisp().visit(code_ast)
         return lisp_str
 
+    def visit(self, node):
+        """Encode `node`. Returns its lisp string, or None if the node is not encoded
+        (e.g. the Load/Store contexts)."""
+        outer_out, self.out = self.out, []
+        try:
+            encoded = self.emit(node)
+            out = self.out
+        finally:
+            self.out = outer_out
+        if encoded:
+            return "".join(out)
+        return None
+
+    def emit(self, node):
+        """Append the encoding of `node` to `self.out`. Returns whether anything was appended.
+
+        Visitor methods either append to `self.out` directly, or are generators that
+        yield child nodes. Each `yield child` encodes the child in place and evaluates to
+        whether the child was encoded. The children are driven from an explicit stack,
+        so deeply nested code does not hit the recursion limit, and every token is
+        appended exactly once."""
+        out = self.out
+        stack = []  # (visitor generator, length of out when its node started)
+        child, encoded = node, None
+        while True:
+            if child is not None:
+                child_start = len(out)
+                visitor = getattr(self, 'visit_' + child.__class__.__name__, self.generic_visit)
+                result = visitor(child)
+                if isinstance(result, GeneratorType):
+                    stack.append((result, child_start))
+                    encoded = None
+                else:
+                    encoded = len(out) > child_start
+                    if not stack:
+                        return encoded
+            generator, node_start = stack[-1]
+            try:
+                child = generator.send(encoded)
+            except StopIteration:
+                stack.pop()
+                encoded = len(out) > node_start
+                if not stack:
+                    return encoded
+                child = None
+
     def generic_visit(self, node: ast.AST) -> Any:
         return self.visit_and_get_lisp_str(node)
 
@@ -63,10 +220,44 @@ class Py2Lisp(ast.NodeVisitor):
     def generated_constructed_list(program_elements):
         if len(program_elements) == 0:
             return f"({Py2Lisp.statement_keyword} {Py2Lisp.empty_statement_keyword} {Py2Lisp.empty_statement_keyword})"
-        lisp_str = Py2Lisp.empty_statement_keyword
-        for ele in program_elements[::-1]:
-            lisp_str = f"({Py2Lisp.statement_keyword} {ele} {lisp_str})"
-        return lisp_str
+        return "".join(f"({Py2Lisp.statement_keyword} {ele} " for ele in program_elements) \
+            + Py2Lisp.empty_statement_keyword + ")" * len(program_elements)
+
+    def emit_constructed_list(self, items, force_encode=False):
+        """Generator which emits `items` as a right-nested chain of StatementList nodes,
+        like `generated_constructed_list`. Evaluates to whether the list was encoded."""
+        out = self.out
+        encoded_items = 0
+        for item in items:
+            item_start = len(out)
+            out.append(f"({Py2Lisp.statement_keyword} ")
+            if (yield item):
+                out.append(" ")
+                encoded_items += 1
+            else:
+                del out[item_start:]
+        if encoded_items:
+            out.append(Py2Lisp.empty_statement_keyword)
+            out.append(")" * encoded_items)
+        elif force_encode:
+            out.append(Py2Lisp.generated_constructed_list([]))
+        return encoded_items > 0 or force_encode
+
+    def emit_list(self, items, force_encode=False):
+        """Generator which emits `items` as a __list__ node. Evaluates to whether the list was encoded."""
+        out = self.out
+        out.append(f"({Py2Lisp.list_keyword} ")
+        encoded_items = 0
+        for item in items:
+            item_start = len(out)
+            if encoded_items:
+                out.append(" ")
+            if (yield item):
+                encoded_items += 1
+            else:
+                del out[item_start:]
+        out.append(")")
+        return encoded_items > 0 or force_encode
 
     def visit_and_get_lisp_str(self, node,
                                force_encode_args=None,
@@ -76,52 +267,46 @@ class Py2Lisp(ast.NodeVisitor):
             force_encode_args = []
         if encode_fields_as_constructed_list is None:
             encode_fields_as_constructed_list = []
-        params = []
-        encoded_field_names = []
+        out = self.out
+        node_start = len(out)
+        out.append(f"({node.__class__.__name__}")
+        encoded_fields = 0
         for field, value in ast.iter_fields(node):
-            if isinstance(value, list):
-                list_params = []
-                for item in value:
-                    if isinstance(item, ast.AST):
-                        val = self.visit(item)
-                        if val is not None:
-                            list_params.append(val)
-                if field in force_encode_args or list_params:
-                    if field in encode_fields_as_constructed_list:
-                        params.append(
-                            Py2Lisp.generated_constructed_list(list_params))
-                    else:
-                        params.append(f"({Py2Lisp.list_keyword} " + " ".join(list_params) + ")")
-                    encoded_field_names.append(field)
+            field_start = len(out)
+            out.append(" ")
+            if encode_as_kw:
+                out.append(f"({Py2Lisp.keyword_for_keyword} {field} ")
 
+            if isinstance(value, list):
+                items = [item for item in value if isinstance(item, ast.AST)]
+                if field in encode_fields_as_constructed_list:
+                    encoded = yield from self.emit_constructed_list(items, field in force_encode_args)
+                else:
+                    encoded = yield from self.emit_list(items, field in force_encode_args)
             elif isinstance(value, ast.AST):
-                val = self.visit(value)
-                if val is not None:
-                    params.append(val)
-                    encoded_field_names.append(field)
+                encoded = yield value
             elif value is not None:
-                params.append(str(value))
-                encoded_field_names.append(field)
-
-        if encode_as_kw:
-            params_str = " ".join(
-                [f"({Py2Lisp.keyword_for_keyword} {fn} {p})" for fn, p in zip(encoded_field_names, params)])
+                out.append(str(value))
+                encoded = True
+            else:
+                encoded = False
+
+            if not encoded:
+                del out[field_start:]
+                continue
+            if encode_as_kw:
+                out.append(")")
+            encoded_fields += 1
+
+        if encoded_fields:
+            out.append(")")
         else:
-            params_str = " ".join(params)
-
-        if len(params):
-            lisp_string = f"({node.__class__.__name__} {params_str})"
-        else:
-            lisp_string = node.__class__.__name__
-        return lisp_string
+            out[node_start] = node.__class__.__name__
 
     def visit_Module(self, node: ast.Module) -> Any:
-        params = []
-        for b in node.body:
-            params.append(self.visit(b))
-        module_in_lisp = Py2Lisp.generated_constructed_list(params)
-        lisp_str = f"(ProgramStatements {module_in_lisp})"
-        return lisp_str
+        self.out.append(f"({Py2Lisp.module_keyword} ")
+        yield from self.emit_constructed_list(node.body, force_encode=True)
+        self.out.append(")")
 
     def visit_Load(self, node: ast.Load) -> Any:
         return
@@ -132,15 +317,17 @@ class Py2Lisp(ast.NodeVisitor):
     def visit_Constant(self, node: ast.Constant) -> Any:
         if isinstance(node.value, str):
             if node.value not in self.string_hash_map:
-                self.string_hash_map[node.value] = f"STRING_{self.string_count}"
+                self.string_hash_map[node.value] = self.string_id_template.format(self.string_count)
                 self.string_count += 1
-            return self.string_hash_map[node.value]
-        return str(node.value)
+            self.out.append(self.string_hash_map[node.value])
+        else:
+            self.out.append(str(node.value))
 
     def visit_Name(self, node: ast.Name) -> Any:
         if self.mangle_names:
-            return f"_{str(node.id)}"  # name mangling
-        return str(node.id)
+            self.out.append(f"_{str(node.id)}")  # name mangling
+        else:
+            self.out.append(str(node.id))
 
     def visit_FunctionDef(self, node: ast.FunctionDef) -> Any:
         return self.visit_and_get_lisp_str(
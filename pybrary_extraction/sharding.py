@@ -0,0 +1,219 @@
+import concurrent.futures
+import copy
+import heapq
+import math
+import os
+import re
+
+from pybrary_extraction.clone_filter import subtree_hashes
+from pybrary_extraction.stitch_runner import StitchRunner, StitchUnavailable
+
+try:
+    import resource
+except ImportError:  # not on windows.
+    resource = None
+
+# what a library needs of an abstraction of compress's output, to rewrite with it.
+LIBRARY_KEYS = ("name", "body", "arity", "dreamcoder")
+ABSTRACTION_PREFIX = "fn_"
+ABSTRACTION_NAME_PATTERN = re.compile(rf"(?<![^\s()]){ABSTRACTION_PREFIX}[0-9]+(?![^\s()])")
+
+
+def partition_by_directory(files, py_files_dir, shard_files):
+    """Split `files` into shards of at most `shard_files` files, keeping the files of a
+    package directory together where it fits. A directory with too many files is split
+    by its subdirectories, and neighbouring small directories share a shard."""
+    groups = split_directory(sorted(files), len(os.path.normpath(py_files_dir).split(os.sep)), shard_files)
+    shards = [[]]
+    for group in groups:
+        if len(shards[-1]) + len(group) > shard_files:
+            shards.append([])
+        shards[-1] += group
+    return [i for i in shards if i]
+
+
+def split_directory(files, depth, shard_files):
+    """Groups of at most `shard_files` of `files`, which are sorted and below the same
+    directory, `depth` path components deep."""
+    if len(files) <= shard_files:
+        return [files]
+    by_subdirectory = {}
+    for file in files:
+        parts = os.path.normpath(file).split(os.sep)
+        # files directly in the directory are a group of their own.
+        by_subdirectory.setdefault(parts[depth] if len(parts) > depth + 1 else None, []).append(file)
+    if len(by_subdirectory) == 1 and None in by_subdirectory:
+        return [files[i:i + shard_files] for i in range(0, len(files), shard_files)]
+    groups = []
+    for subdirectory_files in by_subdirectory.values():
+        groups += split_directory(subdirectory_files, depth + 1, shard_files)
+    return groups
+
+
+def subtree_sketch(lisp_str, min_atoms=10, size=64):
+    """The `size` smallest hashes of the subtrees of a program with at least `min_atoms` atoms.
+    Programs that share many subtrees share many of these hashes (a bottom-k sketch)."""
+    return heapq.nsmallest(size, set(subtree_hashes(lisp_str, min_atoms)))
+
+
+def partition_by_subtrees(file_json_map, shard_files):
+    """Split the files into shards of at most `shard_files` files, putting files that share
+    subtrees in the same shard, so that each shard's stitch run sees their common code.
+    Each file goes to the shard it shares the most sketch hashes with, or else to the
+    emptiest shard, while the shard has room."""
+    files = sorted(file_json_map)
+    num_shards = max(1, math.ceil(len(files) / shard_files))
+    shards = [[] for _ in range(num_shards)]
+    shards_of_hash = {}  # sketch hash -> {shard: files in it with the hash}
+    for file in files:
+        sketch = subtree_sketch(file_json_map[file])
+        scores = {}
+        for sketch_hash in sketch:
+            for shard, count in shards_of_hash.get(sketch_hash, {}).items():
+                scores[shard] = scores.get(shard, 0) + count
+        open_shards = [i for i in range(num_shards) if len(shards[i]) < shard_files]
+        shard = max(open_shards, key=lambda i: (scores.get(i, 0), -len(shards[i]), -i))
+        shards[shard].append(file)
+        for sketch_hash in sketch:
+            counts = shards_of_hash.setdefault(sketch_hash, {})
+            counts[shard] = counts.get(shard, 0) + 1
+    return [i for i in shards if i]
+
+
+def body_template(body, names):
+    """`body` split around the abstractions it uses: a tuple of its text, with the index in
+    `names` of each abstraction in between, so that it can be compared across shards."""
+    parts = ABSTRACTION_NAME_PATTERN.split(body)
+    used = ABSTRACTION_NAME_PATTERN.findall(body)
+    template = [parts[0]]
+    for name, part in zip(used, parts[1:]):
+        template += [names[name] if name in names else name, part]
+    return tuple(template)
+
+
+def merge_libraries(libraries):
+    """One library of the abstractions of `libraries`, the libraries of the shards, each in the
+    order stitch found them. Abstractions with the same body, once the abstractions they use
+    are renamed, are merged. The most useful come first, but always after those they use,
+    since stitch rewrites with each abstraction in turn."""
+    merged = {}  # body template -> index of the merged abstraction
+    abstractions = []  # merged abstractions
+    for library in libraries:
+        names = {}  # name in the shard -> index of the merged abstraction
+        for abstraction in library:
+            template = body_template(abstraction["body"], names)
+            if template not in merged:
+                merged[template] = len(abstractions)
+                abstractions.append(dict({key: abstraction[key] for key in LIBRARY_KEYS if key in abstraction},
+                                         template=template, utility=0))
+            abstractions[merged[template]]["utility"] += abstraction.get("utility", 0)
+            names[abstraction["name"]] = merged[template]
+
+    ordered = []
+    placed = set()
+    for index in sorted(range(len(abstractions)), key=lambda i: -abstractions[i]["utility"]):
+        # the abstractions it uses, which come before it, in post-order.
+        stack = [(index, False)]
+        while stack:
+            index, children_placed = stack.pop()
+            if children_placed:
+                ordered.append(index)
+            elif index not in placed:
+                placed.add(index)
+                stack.append((index, True))
+                template = abstractions[index]["template"]
+                stack += [(i, False) for i in reversed(template[1::2]) if isinstance(i, int)]
+
+    final_names = {index: f"{ABSTRACTION_PREFIX}{i}" for i, index in enumerate(ordered)}
+    library = []
+    for index in ordered:
+        abstraction = {key: abstractions[index][key] for key in LIBRARY_KEYS if key in abstractions[index]}
+        abstraction["name"] = final_names[index]
+        abstraction["body"] = "".join(final_names[i] if isinstance(i, int) else i
+                                      for i in abstractions[index]["template"])
+        library.append(abstraction)
+    return library
+
+
+def limit_resources(memory_mb, cpu_seconds):
+    """Limit the address space and cpu time of this process, and of the processes it starts."""
+    if resource is None:
+        return
+    if memory_mb is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 2 ** 20, memory_mb * 2 ** 20))
+    if cpu_seconds is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+
+
+def compress_shard(stitch_runner, programs, flags):
+    os.makedirs(stitch_runner.temp_dir, exist_ok=True)
+    stitch_out = stitch_runner.compress(programs, **flags)
+    # only the library goes back to the parent, not the shard's uses and rewritten programs.
+    return [{key: i[key] for key in LIBRARY_KEYS + ("utility",) if key in i} for i in stitch_out["abstractions"]]
+
+
+class ShardedCompression:
+    """
+    Compresses a corpus too large for one stitch run in shards: partitions the files,
+    by package directory or by the subtrees they share, runs stitch on each shard in a
+    process of its own, at most `workers` at a time and within the given limits, and
+    merges the libraries of the shards. The whole corpus is then rewritten with the
+    merged library, which gives an output like compress's for Leroy to decode.
+
+    A shard that fails, e.g. when it runs out of memory or cpu time, adds nothing to the
+    library, but its files are still rewritten.
+    """
+    PARTITIONS = ("directory", "subtrees")
+
+    def __init__(self, stitch_runner: StitchRunner, partition="directory", shard_files=1000, workers=1,
+                 memory_mb=None, cpu_seconds=None):
+        if partition not in ShardedCompression.PARTITIONS:
+            raise ValueError(f"Unknown partition {partition!r}, expected one of {ShardedCompression.PARTITIONS}")
+        self.stitch_runner = stitch_runner
+        self.partition = partition
+        self.shard_files = shard_files
+        self.workers = workers
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+
+    def settings(self):
+        """What the result depends on, besides the programs and stitch's flags. The limits decide
+        which shards fail, and so what the merged library has."""
+        return {"partition": self.partition, "shard_files": self.shard_files,
+                "memory_mb": self.memory_mb, "cpu_seconds": self.cpu_seconds}
+
+    def shards(self, file_json_map, py_files_dir):
+        if self.partition == "directory":
+            return partition_by_directory(file_json_map, py_files_dir, self.shard_files)
+        return partition_by_subtrees(file_json_map, self.shard_files)
+
+    def compress(self, file_json_map, py_files_dir, flags):
+        shards = self.shards(file_json_map, py_files_dir)
+        print(f"Compressing {len(file_json_map)} files in {len(shards)} shards.")
+        libraries = self.compress_shards([[file_json_map[file] for file in shard] for shard in shards], flags)
+        library = merge_libraries(libraries)
+        programs = list(file_json_map.values())
+        if not library:
+            return {"original": programs, "rewritten": programs, "abstractions": []}
+        stitch_out = self.stitch_runner.rewrite_output(programs, library)
+        if stitch_out.get("abstractions") is None:
+            raise StitchUnavailable("The stitch rewrite binary does not write the uses of the abstractions. "
+                                    "Rebuild it, or use the stitch_core bindings.")
+        return stitch_out
+
+    def compress_shards(self, shards, flags):
+        """The library of each shard, or an empty one for a shard that failed."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as threads:
+            return list(threads.map(self.compress_in_process, range(len(shards)), shards, [flags] * len(shards)))
+
+    def compress_in_process(self, index, programs, flags):
+        stitch_runner = copy.copy(self.stitch_runner)
+        stitch_runner.temp_dir = self.stitch_runner.temp_dir.joinpath("shards", f"shard_{index}")
+        # a process for each shard, so that one that is killed for its limits fails alone.
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, initializer=limit_resources, initargs=(self.memory_mb, self.cpu_seconds)) as executor:
+            try:
+                return executor.submit(compress_shard, stitch_runner, programs, flags).result()
+            except Exception as e:
+                print(f"Shard {index} of {len(programs)} programs failed: {type(e).__name__}: {e}")
+                return []
@@ -0,0 +1,218 @@
+import json
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1 << 16
+
+
+class JsonReader:
+    """
+    Reads a json document from a file one value at a time, so that arrays and
+    objects can be consumed item by item. Only the value being read, and a
+    chunk of the file, are in memory at once.
+    """
+    WHITESPACE = " \t\n\r"
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read_more(self, size):
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def next_char(self):
+        """The next character that is not whitespace, without consuming it. Empty at the end."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JsonReader.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.read_more(self.chunk_size)
+
+    def expect(self, chars):
+        char = self.next_char()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r} in {self.f.name}")
+        self.pos += 1
+        return char
+
+    def read_value(self):
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may go on in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # read at least as much again as the value so far, to not decode it over and over.
+            self.read_more(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def skip_value(self):
+        """Skip the next value, an array or object item by item."""
+        char = self.next_char()
+        if char == "[":
+            for _ in self.iter_array():
+                pass
+        elif char == "{":
+            for _ in self.iter_object():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def iter_array(self):
+        """The items of the next value, an array."""
+        self.expect("[")
+        if self.next_char() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.expect(",]") == "]":
+                return
+
+    def iter_object(self):
+        """The keys of the next value, an object. Read or skip each key's value before the next key."""
+        self.expect("{")
+        if self.next_char() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+class JsonArrayInFile:
+    """A top-level array of a `StitchOutputFile`. Every iteration reads it from the file again."""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def __iter__(self):
+        with open(self.path) as f:
+            reader = JsonReader(f)
+            if StitchOutputFile.find_key(reader, self.key):
+                yield from reader.iter_array()
+
+
+class StitchOutputFile:
+    """
+    The json output of stitch in a file, read on demand. Fields read as with a dict,
+    but an array field is a `JsonArrayInFile`, whose items are read one at a time
+    as it is iterated: the programs and abstractions are never all in memory.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    @staticmethod
+    def find_key(reader, key):
+        """Move `reader` to the value of the top-level `key`. Returns whether the key was found."""
+        for other_key in reader.iter_object():
+            if other_key == key:
+                return True
+            reader.skip_value()
+        return False
+
+    def __getitem__(self, key):
+        with open(self.path) as f:
+            reader = JsonReader(f)
+            if not StitchOutputFile.find_key(reader, key):
+                raise KeyError(key)
+            if reader.next_char() == "[":
+                return JsonArrayInFile(self.path, key)
+            return reader.read_value()
+
+    def keys(self):
+        with open(self.path) as f:
+            reader = JsonReader(f)
+            keys = []
+            for key in reader.iter_object():
+                keys.append(key)
+                reader.skip_value()
+            return keys
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def load(self) -> dict:
+        """The whole output, in memory."""
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def write_json_atomically(path, write):
+    """Call `write` with a file in the directory of `path`, and move the file to `path`
+    once it is complete, so that readers never see half of it."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_json_array(path, items):
+    """Write `items` as a compact json array, one item at a time."""
+    def write(f):
+        f.write("[")
+        for i, item in enumerate(items):
+            if i:
+                f.write(",")
+            f.write(json.dumps(item, separators=(",", ":")))
+        f.write("]")
+    write_json_atomically(path, write)
+
+
+def write_stitch_output(path, stitch_out):
+    """Write `stitch_out`, a dict or a `StitchOutputFile`, compactly to `path`. Arrays of a
+    `StitchOutputFile` are copied item by item."""
+    if isinstance(stitch_out, StitchOutputFile):
+        if os.path.abspath(stitch_out.path) != os.path.abspath(path):
+            write_json_atomically(path, lambda f: copy_file(stitch_out.path, f))
+        return
+
+    def write(f):
+        f.write("{")
+        for i, (key, value) in enumerate(stitch_out.items()):
+            if i:
+                f.write(",")
+            f.write(json.dumps(key) + ":")
+            if isinstance(value, (list, JsonArrayInFile)):
+                f.write("[")
+                for j, item in enumerate(value):
+                    if j:
+                        f.write(",")
+                    f.write(json.dumps(item, separators=(",", ":")))
+                f.write("]")
+            else:
+                f.write(json.dumps(value, separators=(",", ":")))
+        f.write("}")
+    write_json_atomically(path, write)
+
+
+def copy_file(source_path, f):
+    with open(source_path) as source:
+        shutil.copyfileobj(source, f)
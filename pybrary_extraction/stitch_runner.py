@@ -0,0 +1,201 @@
+import importlib.metadata
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+
+from pybrary_extraction.stitch_output import StitchOutputFile, write_json_array
+
+
+class StitchUnavailable(Exception):
+    """The requested stitch backend cannot run here."""
+
+
+class StitchRunner:
+    """
+    Runs stitch's `compress` on a list of programs, and returns its json output,
+    or its `rewrite` of programs with abstractions stitch found earlier.
+
+    Backends:
+    - bindings: in-process through the `stitch_core` python bindings. The programs
+      and the result stay in memory, and there is no process or cargo overhead.
+    - binary: a prebuilt `compress` (or `rewrite`) binary, found with `find_binary`.
+    - cargo: `cargo run --release --bin=compress` in this repo, which builds it if needed.
+    - auto: the first of these that can run. The bindings are skipped if they are
+      missing, or were built from a stitch that does not know some of the flags.
+    """
+    BACKENDS = ("auto", "bindings", "binary", "cargo")
+    # path of a prebuilt compress binary, to use instead of looking for one.
+    BINARY_ENV_VAR = "STITCH_COMPRESS_BINARY"
+    REWRITE_BINARY_ENV_VAR = "STITCH_REWRITE_BINARY"
+
+    def __init__(self, project_base_dir, temp_dir, backend="auto", threads=1):
+        if backend not in StitchRunner.BACKENDS:
+            raise ValueError(f"Unknown stitch backend {backend!r}, expected one of {StitchRunner.BACKENDS}")
+        self.project_base_dir = pathlib.Path(project_base_dir)
+        self.temp_dir = pathlib.Path(temp_dir)
+        self.backend = backend
+        self.threads = threads
+        self.in_filename = "in.json"
+        self.out_filename = "out.json"
+        self.used_backend = None  # the backend of the last run.
+
+    def settings(self):
+        """What the result depends on, besides the programs and stitch's flags: the backend, and the
+        version of each backend it may run with. A binary has no version, so its size and time of
+        change stand for it, and cargo builds the stitch_core version in this repo's Cargo.toml."""
+        backends = StitchRunner.BACKENDS[1:] if self.backend == "auto" else (self.backend,)
+        return {"backend": self.backend,
+                "versions": {backend: getattr(self, f"{backend}_version")() for backend in backends}}
+
+    def bindings_version(self):
+        try:
+            return importlib.metadata.version("stitch_core")
+        except importlib.metadata.PackageNotFoundError:
+            return None
+
+    def binary_version(self):
+        binary = self.find_binary()
+        if binary is None:
+            return None
+        stat = binary.stat()
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def cargo_version(self):
+        try:
+            with open(self.project_base_dir.joinpath("Cargo.toml")) as f:
+                match = re.search(r'^version\s*=\s*"([^"]*)"', f.read(), re.MULTILINE)
+        except FileNotFoundError:
+            return None
+        return match.group(1) if match else None
+
+    def compress(self, programs, **flags):
+        """Run stitch on `programs`. `flags` are compress's command line flags, with
+        underscores for dashes, and True for flags without a value. Returns a dict
+        from the bindings, and a `StitchOutputFile` of out.json from the other backends."""
+        return self.run_with_backend("compress", programs, dict(flags, threads=self.threads))
+
+    def rewrite(self, programs, abstractions) -> list[str]:
+        """Rewrite `programs` with `abstractions`, in order, as compress did. Each abstraction is
+        a dict with the name, body, arity and dreamcoder fields of compress's output."""
+        return list(self.rewrite_output(programs, abstractions)["rewritten"])
+
+    def rewrite_output(self, programs, abstractions):
+        """Rewrite `programs` with `abstractions`, and return the output compress would have given
+        had it found them, with the uses of each abstraction. Abstractions that do not compress
+        the programs are left out. Rewrite binaries built before they wrote this output only
+        give the rewritten programs."""
+        return self.run_with_backend("rewrite", programs, abstractions)
+
+    def run_with_backend(self, command, programs, arg):
+        if self.backend == "auto":
+            for backend in StitchRunner.BACKENDS[1:]:
+                try:
+                    return self.run_with(command, backend, programs, arg)
+                except StitchUnavailable as e:
+                    print(f"stitch {backend} backend unavailable: {e}")
+            raise StitchUnavailable(f"No stitch backend can run. Install the stitch_core bindings, "
+                                    f"build the {command} binary, or install cargo.")
+        return self.run_with(command, self.backend, programs, arg)
+
+    def run_with(self, command, backend, programs, arg):
+        result = getattr(self, f"{command}_with_{backend}")(programs, arg)
+        self.used_backend = backend
+        return result
+
+    def compress_with_bindings(self, programs, flags):
+        try:
+            import stitch_core
+        except ImportError:
+            raise StitchUnavailable("stitch_core is not installed.")
+        flags = dict(flags)
+        try:
+            result = stitch_core.compress(
+                list(programs), flags.pop("iterations"), flags.pop("max_arity"), flags.pop("threads"),
+                silent=True, **flags)
+        except stitch_core.StitchException as e:
+            if "Error parsing arguments" in str(e):
+                # bindings built from a stitch without some of our flags.
+                raise StitchUnavailable(str(e).split("\n")[0])
+            raise
+        return result.json
+
+    def compress_with_binary(self, programs, flags):
+        return self.compress_with_command(self.binary_command("compress", StitchRunner.BINARY_ENV_VAR),
+                                          programs, flags)
+
+    def compress_with_cargo(self, programs, flags):
+        return self.compress_with_command(self.cargo_command("compress"), programs, flags)
+
+    def rewrite_with_bindings(self, programs, abstractions):
+        try:
+            import stitch_core
+        except ImportError:
+            raise StitchUnavailable("stitch_core is not installed.")
+        result = stitch_core.rewrite(
+            list(programs),
+            [stitch_core.Abstraction(i["name"], i["body"], i["arity"]) for i in abstractions],
+            panic_loud=False)
+        return result.json
+
+    def rewrite_with_binary(self, programs, abstractions):
+        return self.rewrite_with_command(self.binary_command("rewrite", StitchRunner.REWRITE_BINARY_ENV_VAR),
+                                         programs, abstractions)
+
+    def rewrite_with_cargo(self, programs, abstractions):
+        return self.rewrite_with_command(self.cargo_command("rewrite"), programs, abstractions)
+
+    def binary_command(self, name, env_var):
+        binary = self.find_binary(name, env_var)
+        if binary is None:
+            raise StitchUnavailable(f"No {name} binary in target/release, or in ${env_var}.")
+        return [str(binary)]
+
+    def cargo_command(self, name):
+        if shutil.which("cargo") is None:
+            raise StitchUnavailable("cargo is not installed.")
+        return ["cargo", "run", "--manifest-path", f"{self.project_base_dir}/Cargo.toml",
+                "--release", f"--bin={name}", "--"]
+
+    def find_binary(self, name="compress", env_var=BINARY_ENV_VAR):
+        candidates = []
+        if os.environ.get(env_var):
+            candidates.append(pathlib.Path(os.environ[env_var]))
+        candidates.append(self.project_base_dir.joinpath("target", "release", name))
+        for candidate in candidates:
+            if candidate.is_file() and os.access(candidate, os.X_OK):
+                return candidate
+        return None
+
+    def compress_with_command(self, command, programs, flags):
+        in_path = self.temp_dir.joinpath(self.in_filename)
+        out_path = self.temp_dir.joinpath(self.out_filename)
+        write_json_array(in_path, programs)
+        subprocess.run(command + [str(in_path), f"--out={out_path}"] + StitchRunner.command_line_flags(flags),
+                       check=True)
+        return StitchOutputFile(out_path)
+
+    def rewrite_with_command(self, command, programs, abstractions):
+        in_path = self.temp_dir.joinpath(self.in_filename)
+        abstractions_path = self.temp_dir.joinpath("abstractions.json")
+        out_path = self.temp_dir.joinpath("rewrite_out.json")
+        write_json_array(in_path, programs)
+        with open(abstractions_path, "w") as f:
+            json.dump({"abstractions": list(abstractions)}, f, separators=(",", ":"))
+        subprocess.run(command + [f"--program-file={in_path}", f"--inventions-file={abstractions_path}",
+                                  f"--out={out_path}"],
+                       check=True)
+        return StitchOutputFile(out_path)
+
+    @staticmethod
+    def command_line_flags(flags):
+        args = []
+        for name, value in flags.items():
+            name = "--" + name.replace("_", "-")
+            if value is True:
+                args.append(name)
+            elif value is not False and value is not None:
+                args.append(f"{name}={value}")
+        return args
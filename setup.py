@@ -5,5 +5,6 @@ setup(
     version='1.0',
     description='Library Extraction for Python!',
     packages=['pybrary_extraction'],  # same as name
-    install_requires=['click', 'pyparsing', 'pylint'],  # external packages as dependencies
+    install_requires=['click'],  # external packages as dependencies
+    extras_require={'pylint': ['pylint']},
 )
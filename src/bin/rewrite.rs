@@ -100,7 +100,7 @@ fn main() {
     let mut rewritten_frontiers: HashMap<String, Vec<String>> = HashMap::new();
 
     
-    let rewritten: Vec<String> = rewrite_with_inventions(&input.train_programs, &inventions[..], &args.cost).0;
+    let (rewritten, _, json_res) = rewrite_with_inventions(&input.train_programs, &inventions[..], &args.cost);
 
     match args.fmt {
         InputFormat::Dreamcoder => {
@@ -149,8 +149,9 @@ fn main() {
             std::fs::write(&args.out, serde_json::to_string_pretty(&json).unwrap()).unwrap();
         },
         InputFormat::ProgramsList => {
-            let json: Value = json!({ "rewritten": rewritten.iter().map(|p| p.to_string()).collect::<Vec<String>>() });
-            std::fs::write(&args.out, serde_json::to_string_pretty(&json).unwrap()).unwrap();
+            // the output compress would give with these inventions, including their uses.
+            // Its "rewritten" are the rewritten programs.
+            std::fs::write(&args.out, serde_json::to_string_pretty(&json_res).unwrap()).unwrap();
         }
     }
 }
@@ -0,0 +1,45 @@
+import pickle
+
+import pytest
+
+from pybrary_extraction.lisp2py import AbstractionLibrary, Rewrite2Py
+from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction, StitchParam
+
+
+def make_abstraction(name, parameters, returned_vars=()):
+    abstraction = StitchAbstraction("(Return #0)", [], name, {})
+    abstraction.parameters = set(parameters)
+    abstraction.returned_vars = list(returned_vars)
+    return abstraction
+
+
+def test_signature():
+    abstraction = make_abstraction("fn_0", [StitchParam("extra", 2), StitchParam("_param1", 1, is_trailing=True),
+                                            StitchParam("_param0", 0)], ["x", "y"])
+    signature = AbstractionLibrary([abstraction]).get("fn_0")
+    assert signature.additional_params == ("extra",)
+    assert signature.trailing_positions == (1,)
+    assert signature.returned_vars == ("x", "y")
+    with pytest.raises(AttributeError):
+        signature.returned_vars = ()
+
+
+def test_library():
+    first = make_abstraction("fn_0", [StitchParam("_param0", 0)], ["x"])
+    library = AbstractionLibrary([first, make_abstraction("fn_0", []), make_abstraction("fn_1", [])])
+    assert len(library) == 2 and "fn_1" in library and "fn_2" not in library
+    assert library.get("fn_2") is None
+    # the first abstraction of a name is the one calls are rewritten with.
+    assert library.get("fn_0").returned_vars == ("x",)
+    assert AbstractionLibrary.of(library) is library
+    # as rewrite worker processes get it.
+    assert pickle.loads(pickle.dumps(library)).get("fn_0").returned_vars == ("x",)
+
+
+def test_rewrite_with_library():
+    abstraction = make_abstraction("fn_0", [StitchParam("_param0", 0), StitchParam("extra", 1)], ["y"])
+    lisp_str = "(StatementList (fn_0 x) EMPTY_Statement)"
+    expected = Rewrite2Py(lisp_str, available_abstractions=[abstraction]).convert()
+    library = AbstractionLibrary([abstraction])
+    assert Rewrite2Py(lisp_str, available_abstractions=library).convert() == expected
+    assert expected == "from leroy_library import fn_0\ny = fn_0(x, extra)"
@@ -0,0 +1,103 @@
+import os
+import pathlib
+import time
+
+import pytest
+
+from pybrary_extraction.cache import DiskCache, EncodingCache, ResultCache
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.stitch_runner import StitchRunner, StitchUnavailable
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+
+def test_encoding_cache_matches_serial(tmp_path):
+    project_path = str(resources_path.joinpath("simple_project"))
+    serial_outs, serial_strings = Py2Lisp.fromDirectoryToJson(project_path)
+
+    cache = EncodingCache(tmp_path)
+    cold_outs, cold_strings = Py2Lisp.fromDirectoryToJson(project_path, cache=cache)
+    assert cache.hits == 0
+
+    cache = EncodingCache(tmp_path)
+    warm_outs, warm_strings = Py2Lisp.fromDirectoryToJson(project_path, cache=cache)
+    assert cache.misses == 0
+    assert cache.hits == len(serial_outs)
+
+    assert list(cold_outs.items()) == list(serial_outs.items())
+    assert list(warm_outs.items()) == list(serial_outs.items())
+    assert list(warm_strings.items()) == list(serial_strings.items())
+
+
+def test_encoding_cache_key():
+    code_str = "print('hi')"
+    assert EncodingCache.encoding_key(code_str, False) == EncodingCache.encoding_key(code_str, False)
+    assert EncodingCache.encoding_key(code_str, False) != EncodingCache.encoding_key(code_str, True)
+    assert EncodingCache.encoding_key(code_str, False) != EncodingCache.encoding_key(code_str + "\n", False)
+
+
+def test_evict_by_age(tmp_path):
+    cache = DiskCache(tmp_path, max_age_seconds=60)
+    cache.put("aa01", {"x": 1})
+    cache.put("aa02", {"x": 2})
+    an_hour_ago = time.time() - 3600
+    os.utime(cache.path_for("aa01"), (an_hour_ago, an_hour_ago))
+
+    assert cache.evict() == 1
+    assert cache.get("aa01") is None
+    assert cache.get("aa02") == {"x": 2}
+
+
+def test_evict_least_recently_used_by_size(tmp_path):
+    cache = DiskCache(tmp_path)
+    for i, key in enumerate(["bb01", "bb02", "bb03"]):
+        cache.put(key, {"x": "a" * 100})
+        os.utime(cache.path_for(key), (1000 + i, 1000 + i))
+    cache.get("bb01")  # now the most recently used.
+
+    cache.max_size_bytes = 2 * os.path.getsize(cache.path_for("bb01"))
+    assert cache.evict() == 1
+    assert cache.get("bb02") is None
+    assert cache.get("bb01") is not None
+    assert cache.get("bb03") is not None
+
+
+def test_result_cache_key():
+    programs = ["(a b)", "(c d)"]
+    flags = {"iterations": 3, "max_arity": 2}
+    assert ResultCache.result_key(programs, flags) == ResultCache.result_key(list(programs), dict(flags))
+    assert ResultCache.result_key(programs, flags) != ResultCache.result_key(programs[::-1], flags)
+    assert ResultCache.result_key(programs, flags) != ResultCache.result_key(programs, {**flags, "iterations": 4})
+    assert ResultCache.result_key(["(a b) (c d)"], flags) != ResultCache.result_key(["(a b)", "(c d)"], flags)
+
+
+def test_leroy_reuses_cached_result(tmp_path, monkeypatch):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = str(resources_path.joinpath("simple_project"))
+    # no stitch backend can run, so the result has to come from the cache.
+    monkeypatch.setenv(StitchRunner.BINARY_ENV_VAR, str(tmp_path.joinpath("missing")))
+    leroy = Leroy(project_path, 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"),
+                  stitch_backend="binary")
+    leroy.temp_dir = tmp_path.joinpath("out")
+
+    programs = list(Py2Lisp.fromDirectoryToJson(project_path)[0].values())
+    stitch_out = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy.result_cache.put_result(programs, leroy.cache_flags(), stitch_out)
+    leroy.run()
+    assert leroy.stitch_out.load() == stitch_out
+    assert leroy.temp_dir.joinpath(f"{Leroy.LIBRARY_NAME}.py").exists()
+
+    leroy.iterations = 2
+    with pytest.raises(StitchUnavailable):
+        leroy.run()
+
+
+def test_leroy_cache_key_has_stitch_backend(tmp_path):
+    leroy = Leroy(str(resources_path.joinpath("simple_project")), 1, 3, 10, False, False,
+                  cache_dir=tmp_path.joinpath("cache"), stitch_backend="binary")
+    assert leroy.cache_flags()["stitch"] == leroy.stitch_runner.settings()
+    other = Leroy(str(resources_path.joinpath("simple_project")), 1, 3, 10, False, False,
+                  cache_dir=tmp_path.joinpath("cache"), stitch_backend="bindings")
+    assert ResultCache.result_key(["(a b)"], leroy.cache_flags()) != \
+           ResultCache.result_key(["(a b)"], other.cache_flags())
@@ -0,0 +1,94 @@
+import contextlib
+import io
+import pathlib
+import shutil
+
+import pytest
+
+from pybrary_extraction.clone_filter import CloneFilter, repeated_programs, subtree_hashes
+from pybrary_extraction.incremental import program_cost
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+REPEATED = "(Call (Attribute (Name foo Load) bar Load) (list (Constant 1 None) (Constant 2 None)))"
+OTHER = "(Assign (list (Name x Store)) (BinOp (Name y Load) Add (Constant 3 None)))"
+
+
+def test_subtree_hashes():
+    hashes = subtree_hashes(f"(Module (list {REPEATED} {REPEATED}))", 5)
+    # the two calls with their attributes and arguments, the list of statements and the module.
+    assert len(hashes) == 8
+    assert hashes[:3] == hashes[3:6]
+    assert subtree_hashes(REPEATED, 5) == hashes[:3]
+    assert subtree_hashes(REPEATED, 100) == []
+
+
+def test_repeated_programs():
+    programs = [f"(Module (list {REPEATED}))", f"(Module (list {OTHER}))", f"(Expr {REPEATED})",
+                f"(Module (list {OTHER} {OTHER}))", "(Module (list pass))"]
+    assert repeated_programs(programs, 5) == [True, True, True, True, False]
+    assert repeated_programs(programs[:2], 5) == [False, False]
+    assert repeated_programs(programs, 100) == [False] * 5
+
+
+def test_clone_filter_splices_passed_through_programs():
+    file_json_map = {"a.py": f"(Module (list {REPEATED}))", "b.py": f"(Module (list {OTHER}))",
+                     "c.py": f"(Module (list {REPEATED} pass))"}
+    compressed = []
+
+    def compress(kept):
+        compressed.append(kept)
+        return {"original_cost": 10000, "final_cost": 5000, "compression_ratio": 2.0,
+                "original": list(kept.values()), "rewritten": ["(fn_0)", "(fn_0 pass)"],
+                "rewritten_dreamcoder": ["(#(lambda x))", "(#(lambda x) pass)"], "abstractions": [{"name": "fn_0"}]}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        stitch_out = CloneFilter(5).compress(file_json_map, compress)
+    assert list(compressed[0]) == ["a.py", "c.py"]
+    assert stitch_out["original"] == list(file_json_map.values())
+    assert stitch_out["rewritten"] == ["(fn_0)", file_json_map["b.py"], "(fn_0 pass)"]
+    assert stitch_out["rewritten_dreamcoder"][1] == file_json_map["b.py"]
+    assert stitch_out["abstractions"] == [{"name": "fn_0"}]
+    passed_cost = program_cost(file_json_map["b.py"])
+    assert stitch_out["original_cost"] == 10000 + passed_cost
+    assert stitch_out["compression_ratio"] == (10000 + passed_cost) / (5000 + passed_cost)
+
+
+def test_clone_filter_without_repeated_programs():
+    file_json_map = {"a.py": f"(Module (list {REPEATED}))", "b.py": f"(Module (list {OTHER}))"}
+    with contextlib.redirect_stdout(io.StringIO()):
+        stitch_out = CloneFilter(5).compress(file_json_map, lambda kept: pytest.fail("nothing to compress"))
+    assert stitch_out["rewritten"] == list(file_json_map.values())
+    assert stitch_out["abstractions"] == []
+
+
+def test_leroy_run_with_clone_filter(tmp_path):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    shutil.copytree(resources_path.joinpath("simple_project"), project_path)
+    project_path.joinpath("unique.py").write_text("import os\n\nprint(os.getcwd())\n")
+    leroy = Leroy(str(project_path), 1, 3, 10, False, False, use_cache=False, stitch_backend="bindings",
+                  clone_filter=True)
+    leroy.temp_dir = tmp_path.joinpath("out")
+    # the stitch_core bindings may not know all of Leroy's flags.
+    flags = dict(iterations=1, max_arity=3, no_opt_arity_zero=True)
+    leroy.stitch_flags = lambda: flags
+    with contextlib.redirect_stdout(io.StringIO()):
+        leroy.run()
+
+    file_json_map = Py2Lisp.fromDirectoryToJson(str(project_path))[0]
+    kept = repeated_programs(list(file_json_map.values()), 10)
+    unique_file = str(project_path.joinpath("unique.py"))
+    assert not kept[list(file_json_map).index(unique_file)] and sum(kept) > 1
+    expected = stitch_core.compress([program for program, keep in zip(file_json_map.values(), kept) if keep],
+                                    silent=True, **flags).json
+    stitch_out = leroy.stitch_out.load()
+    assert stitch_out["original"] == list(file_json_map.values())
+    # the kept programs are rewritten as stitch rewrites them on their own, the others not at all.
+    assert [rewritten for rewritten, keep in zip(stitch_out["rewritten"], kept) if keep] == expected["rewritten"]
+    assert [rewritten for rewritten, keep in zip(stitch_out["rewritten"], kept) if not keep] == \
+           [program for program, keep in zip(file_json_map.values(), kept) if not keep]
+    assert [i["body"] for i in stitch_out["abstractions"]] == [i["body"] for i in expected["abstractions"]]
+    assert leroy.temp_dir.joinpath("unique.py").exists()
@@ -0,0 +1,140 @@
+import ast
+
+from pybrary_extraction.lisp2py import DecodedCorpus, Lisp2Py
+from pybrary_extraction.lisp2py.DecodedCorpus import DecodedProgram
+from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
+
+abstraction_body_lisp = '(StatementList (Assign (__list__ x) 1) ' \
+                        '(StatementList (Assign (__list__ y) (UnaryOp USub 2))' \
+                        '#0' \
+                        '))'
+use = {"fn_0 (StatementList (Expr (Call print (__list__ x y))) EMPTY_Statement)":
+           '(StatementList (Assign (__list__ x) 1) ' \
+           '(StatementList (Assign (__list__ y) (UnaryOp USub 2))' \
+           '(StatementList (Expr (Call print (__list__ x y))) EMPTY_Statement)' \
+           '))'}
+stitch_originals = ['(ProgramStatements (StatementList (Assign (__list__ x) 1) ' \
+                    '(StatementList (Assign (__list__ y) (UnaryOp USub 2))' \
+                    '(StatementList (Expr (Call print (__list__ x y))) EMPTY_Statement)' \
+                    ')))',
+                    '(ProgramStatements (StatementList (Assign (__list__ z) STRING_0) EMPTY_Statement))']
+
+
+def test_programs_are_decoded_lazily():
+    corpus = DecodedCorpus(stitch_originals, {"STRING_0": "hi"})
+    assert all(program._source is None for program in corpus)
+
+    assert corpus[1].source == "z = 'hi'"
+    assert corpus[0]._source is None
+    assert corpus[1].scoped_ast is corpus[1].scoped_ast
+    assert corpus[1].scoped_ast.body[0].parent_scope is corpus[1].scoped_ast
+
+
+def test_corpus_is_shared_across_abstractions():
+    corpus = DecodedCorpus(stitch_originals, {})
+    abstraction_1 = StitchAbstraction(abstraction_body_lisp, [use], "fn_0", {})
+    abstraction_2 = StitchAbstraction(abstraction_body_lisp, [use], "fn_1", {})
+    py_1 = abstraction_1.compute_body_py(corpus)
+    first_ast = corpus[0].scoped_ast
+    py_2 = abstraction_2.compute_body_py(corpus)
+    assert corpus[0].scoped_ast is first_ast
+    assert py_1 == py_2.replace("fn_1", "fn_0")
+
+    from_lisps = StitchAbstraction(abstraction_body_lisp, [use], "fn_0", {}).compute_body_py(stitch_originals)
+    assert py_1 == from_lisps == "def fn_0():\n    x = 1\n    y = -2\n    return (x, y)"
+    assert corpus[0].source == Lisp2Py(stitch_originals[0]).convert()
+
+
+def parse_body(code_str):
+    return ast.parse(code_str).body
+
+
+def index_of(*sources):
+    corpus = DecodedCorpus([], {})
+    for source in sources:
+        program = DecodedProgram(None, {})
+        program._source = source
+        corpus.programs.append(program)
+    return corpus.fragment_index
+
+
+def test_locate_statements():
+    index = index_of("x = 1\ny = 2\nprint(x)",
+                     "def f():\n    x = 1\n    y = 2\n    return x + y\nz = 3",
+                     "xx = 1\ny = 2")
+    fragments = index.locate(parse_body("x = 1\ny = 2"))
+    assert len(fragments) == 2
+    assert [fragment.end_line for fragment in fragments] == [2, 3]
+    assert fragments[0].find_used_vars_later() == {"print", "x"}
+    assert isinstance(fragments[1].parent_scope, ast.FunctionDef)
+    assert fragments[1].find_used_vars_later() == {"x", "y"}
+
+
+def test_locate_first_occurrence_in_program():
+    index = index_of("x = 1\nprint(x)\nx = 1\nprint(y)")
+    fragments = index.locate(parse_body("x = 1"))
+    assert len(fragments) == 1
+    assert fragments[0].end_line == 1
+
+
+def test_locate_expression():
+    index = index_of("def f(a):\n    b = g(a) + 1\n    return b", "gg(a)")
+    fragments = index.locate(parse_body("g(a)"))
+    assert len(fragments) == 1
+    assert fragments[0].parent_scope.name == "f"
+    # the rest of the statement, and the return after it.
+    assert fragments[0].find_used_vars_later() == {"a", "b", "g"}
+
+
+def test_locate_partial_application():
+    # the use of an abstraction over `(AnnAssign target annotation value)` leaves out `simple`.
+    index = index_of("class Node:\n    next: Node | None = None\n    data: int")
+    fragments = index.locate(parse_body("next: Node | None"))
+    assert len(fragments) == 1
+    assert fragments[0].parent_scope.name == "Node"
+
+
+def use_printing(*names):
+    statement = f"(StatementList (Expr (Call print (__list__ {' '.join(names)}))) EMPTY_Statement)"
+    return {f"fn_0 {statement}":
+                '(StatementList (Assign (__list__ x) 1) '
+                f'(StatementList (Assign (__list__ y) (UnaryOp USub 2)) {statement}))'}
+
+
+def original_printing(*names):
+    return '(ProgramStatements (StatementList (Assign (__list__ x) 1) ' \
+           '(StatementList (Assign (__list__ y) (UnaryOp USub 2)) ' \
+           f"(StatementList (Expr (Call print (__list__ {' '.join(names)}))) EMPTY_Statement))))"
+
+
+def test_uses_are_decoded_lazily():
+    abstraction = StitchAbstraction(abstraction_body_lisp, [use, use_printing("x")], "fn_0", {})
+    assert abstraction._uses_py is None
+    assert all(i._application_ast is None and i._target_ast is None for i in abstraction.uses_py)
+    assert abstraction.uses_py[1].target_py == "x = 1\ny = -2\nprint(x)"
+    assert abstraction.uses_py[0]._target_ast is None
+
+
+def test_live_vars_out_of_all_uses():
+    corpus = DecodedCorpus([original_printing("x"), original_printing("y")], {})
+    abstraction = StitchAbstraction(abstraction_body_lisp, [use_printing("x"), use_printing("y")], "fn_0", {})
+    assert abstraction.compute_body_py(corpus) == "def fn_0():\n    x = 1\n    y = -2\n    return (x, y)"
+
+
+def test_liveness_stops_once_every_candidate_is_live():
+    broken_use = {"fn_0 (StatementList (": "("}
+    abstraction = StitchAbstraction(abstraction_body_lisp, [use, broken_use], "fn_0", {})
+    # x and y are live out of the first use, so the second one cannot change what is returned.
+    assert abstraction.compute_body_py(stitch_originals) == \
+           "def fn_0():\n    x = 1\n    y = -2\n    return (x, y)"
+    assert abstraction.uses_py[1]._application_ast is None
+
+
+def test_sample_uses():
+    abstraction = StitchAbstraction(abstraction_body_lisp, [use_printing(f"x{i}") for i in range(10)], "fn_0", {})
+    assert abstraction.sample_uses(3) == [abstraction.uses_py[i] for i in [0, 3, 6]]
+    assert abstraction.sample_uses(10) == abstraction.sample_uses() == abstraction.uses_py
+    corpus = DecodedCorpus([original_printing("x"), original_printing("y")], {})
+    sampled = StitchAbstraction(abstraction_body_lisp, [use_printing("x"), use_printing("y")], "fn_0", {})
+    # the sample misses the use that y is live out of.
+    assert sampled.compute_body_py(corpus, liveness_sample=1) == "def fn_0():\n    x = 1\n    y = -2\n    return x"
@@ -0,0 +1,127 @@
+import pathlib
+import shutil
+
+import pytest
+
+from pybrary_extraction.incremental import LeroyManifest, program_cost
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.program_pieces import split_programs
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.stitch_runner import StitchRunner
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+
+def test_program_cost():
+    assert program_cost("a") == 100
+    assert program_cost("(a b c)") == 302
+    assert program_cost("(a (b c))") == 302
+    assert program_cost("(Constant 'a b' None)") == 302
+
+
+def test_program_cost_matches_stitch():
+    stitch_core = pytest.importorskip("stitch_core")
+    programs = list(Py2Lisp.fromDirectoryToJson(str(resources_path.joinpath("simple_project")))[0].values())
+    stitch_out = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    assert sum(program_cost(i) for i in programs) == stitch_out["original_cost"]
+    assert sum(program_cost(i) for i in stitch_out["rewritten"]) == stitch_out["final_cost"]
+
+
+def new_leroy(tmp_path, drift_threshold=0.1, granularity="file"):
+    leroy = Leroy(str(tmp_path.joinpath("project")), 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"),
+                  incremental=True, drift_threshold=drift_threshold, granularity=granularity)
+    leroy.temp_dir = tmp_path.joinpath("out")
+    return leroy
+
+
+@pytest.fixture
+def full_run(tmp_path):
+    """A full run on a copy of simple_project. Its stitch result is put in the cache beforehand,
+    since the stitch_core bindings may not know all of Leroy's flags."""
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    shutil.copytree(resources_path.joinpath("simple_project"), project_path)
+    leroy = new_leroy(tmp_path)
+    programs = list(Py2Lisp.fromDirectoryToJson(str(project_path))[0].values())
+    stitch_out = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy.result_cache.put_result(programs, leroy.cache_flags(), stitch_out)
+    leroy.run()
+    return project_path, leroy.temp_dir
+
+
+def test_incremental_run_updates_changed_files(tmp_path, full_run):
+    project_path, out_path = full_run
+    manifest = LeroyManifest.read(out_path)
+    assert len(manifest.files) == 6
+
+    project_path.joinpath("duplicate_almost", "f2.py").write_text(
+        'def main():\n    print("do something")\n    print("changed")')
+    project_path.joinpath("new").mkdir()
+    project_path.joinpath("new", "f3.py").write_text(
+        'def main():\n    print("do something")\n    print("new file")')
+    project_path.joinpath("duplicate_files", "f2.py").unlink()
+    # an unchanged file, whose output must not be written again.
+    out_path.joinpath("duplicate_almost", "f1.py").write_text("untouched")
+
+    new_leroy(tmp_path).run()
+
+    assert out_path.joinpath("duplicate_almost", "f2.py").read_text() == \
+           "from leroy_library import fn_0\nmain = fn_0('changed')"
+    assert out_path.joinpath("new", "f3.py").read_text() == \
+           "from leroy_library import fn_0\nmain = fn_0('new file')"
+    assert not out_path.joinpath("duplicate_files", "f2.py").exists()
+    assert out_path.joinpath("duplicate_almost", "f1.py").read_text() == "untouched"
+
+    manifest = LeroyManifest.read(out_path)
+    assert len(manifest.files) == 6
+    assert str(project_path.joinpath("new", "f3.py")) in manifest.files
+    assert "new file" in manifest.string_hashmap
+
+
+def test_incremental_run_without_changes(tmp_path, full_run):
+    project_path, out_path = full_run
+    leroy = new_leroy(tmp_path)
+    assert leroy.run_incremental()
+    assert leroy.file_json_map == {}
+
+
+def test_drift_needs_full_run(tmp_path, full_run):
+    project_path, out_path = full_run
+    # nothing in it can use the library, so the compression ratio drops.
+    project_path.joinpath("other.py").write_text("\n".join(f"x{i} = y{i} + {i}" for i in range(100)))
+    assert not new_leroy(tmp_path).run_incremental()
+    assert new_leroy(tmp_path, drift_threshold=1).run_incremental()
+
+
+def test_other_granularity_needs_full_run(tmp_path, full_run):
+    assert LeroyManifest.read(full_run[1]).granularity == "file"
+    assert not new_leroy(tmp_path, granularity="definition").run_incremental()
+
+
+def test_incremental_run_by_definition(tmp_path):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    shutil.copytree(resources_path.joinpath("simple_project"), project_path)
+    programs = list(Py2Lisp.fromDirectoryToJson(str(project_path))[0].values())
+    library = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True,
+                                   no_opt_arity_zero=True).json["abstractions"]
+    pieces = list(split_programs(Py2Lisp.fromDirectoryToJson(str(project_path))[0])[0].values())
+    leroy = new_leroy(tmp_path, granularity="definition")
+    leroy.result_cache.put_result(
+        pieces, leroy.cache_flags(), StitchRunner(tmp_path, tmp_path, "bindings").rewrite_output(pieces, library))
+    leroy.run()
+    out_path = leroy.temp_dir
+    assert LeroyManifest.read(out_path).granularity == "definition"
+
+    changed_file = project_path.joinpath("duplicate_almost", "f2.py")
+    changed_file.write_text('VERSION = 2\n\n\ndef main():\n    print("do something")\n    print("changed")')
+    leroy = new_leroy(tmp_path, granularity="definition")
+    assert leroy.run_incremental()
+
+    # the file is split in its two pieces, rewritten, and put back together.
+    assert list(leroy.file_json_map) == [f"{changed_file}:0", f"{changed_file}:1"]
+    assert out_path.joinpath("duplicate_almost", "f2.py").read_text() == \
+           "from leroy_library import fn_0\nVERSION = 2\nmain = fn_0('changed')"
+    costs = LeroyManifest.read(out_path).files[str(changed_file)]
+    assert costs["original_cost"] == sum(program_cost(i) for i in leroy.file_json_map.values())
+    assert costs["rewritten_cost"] < costs["original_cost"]
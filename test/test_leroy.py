@@ -2,6 +2,7 @@ import pytest
 import pathlib
 
 from pybrary_extraction.leroy import run_leroy, Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
 
 
 def test_simple_duplicate_files():
@@ -195,3 +196,30 @@ def test_Leroy_p2():
 def test_Leroy_write_abstractions():
     j = Leroy("../Python/data_structures", 5, 3, 10)
     j.write_abstractions([i['body'] for i in j.stitch_out["abstractions"]])
+
+
+def rewrite_with_workers(out_dir, workers):
+    stitch_core = pytest.importorskip("stitch_core")
+    py_files_dir = "resources/simple_project"
+    leroy = Leroy(py_files_dir, 1, 3, 10, True, False, workers=workers, use_cache=False)
+    leroy.temp_dir = out_dir
+    leroy.temp_dir.mkdir()
+    leroy.file_json_map, string_hashmap = Py2Lisp.fromDirectoryToJson(py_files_dir)
+    leroy.string_hashmap = {v: k for k, v in string_hashmap.items()}
+    leroy.stitch_out = stitch_core.compress(
+        list(leroy.file_json_map.values()), iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy.write_files()
+    return {str(path.relative_to(out_dir)): path.read_text() for path in sorted(out_dir.rglob("*.py"))}
+
+
+def test_rewrite_programs_parallel_matches_serial(tmp_path):
+    serial_files = rewrite_with_workers(tmp_path.joinpath("serial"), 1)
+    parallel_files = rewrite_with_workers(tmp_path.joinpath("parallel"), 2)
+    assert len(serial_files) > 1
+    assert parallel_files == serial_files
+
+
+def test_rewrite_programs_quietly(tmp_path, capsys):
+    rewrite_with_workers(tmp_path.joinpath("serial"), 1)
+    # no ast dump of every rewritten program.
+    assert "Module(" not in capsys.readouterr().out
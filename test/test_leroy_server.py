@@ -0,0 +1,149 @@
+import os
+import pathlib
+import shutil
+import threading
+import time
+
+import pytest
+
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.leroy_server import LeroyServer, LeroyClient, RpcError, METHOD_NOT_FOUND, INVALID_PARAMS, \
+    PARSE_ERROR
+from pybrary_extraction.python2lisp import Py2Lisp
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+NEW_FILE = 'def main():\n    print("do something")\n    print("new file")'
+
+
+@pytest.fixture
+def server(tmp_path):
+    """A server on a copy of simple_project. The stitch result of the project is put in the
+    cache beforehand, since the stitch_core bindings may not know all of Leroy's flags."""
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    shutil.copytree(resources_path.joinpath("simple_project"), project_path)
+    leroy = Leroy(str(project_path), 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"),
+                  incremental=True)
+    leroy.temp_dir = tmp_path.joinpath("out")
+    programs = list(Py2Lisp.fromDirectoryToJson(str(project_path))[0].values())
+    stitch_out = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy.result_cache.put_result(programs, leroy.cache_flags(), stitch_out)
+
+    server = LeroyServer(leroy, tmp_path.joinpath("leroy.sock"), poll_interval=0.05)
+    server.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    if not server.stopped.is_set():
+        server.shutdown()
+    thread.join(timeout=5)
+
+
+def test_requests(server):
+    with LeroyClient(server.socket_path, timeout=30) as client:
+        status = client.call("status")
+        assert status["files"] == 6
+        assert status["abstractions"] == 1
+
+        rewritten = client.call("rewrite", source=NEW_FILE)
+        assert rewritten == {"code": "from leroy_library import fn_0\nmain = fn_0('new file')",
+                             "abstractions": ["fn_0"]}
+        path = str(pathlib.Path(server.leroy.py_files_dir).joinpath("duplicate_almost", "f1.py"))
+        assert client.call("rewrite", path=path)["code"] == "from leroy_library import fn_0\nmain = fn_0('Hello world')"
+
+        assert [i["name"] for i in client.call("abstractions", source=NEW_FILE)] == ["fn_0"]
+        assert client.call("abstractions", source="x = 1") == []
+        library = client.call("abstractions")
+        assert library[0]["body"].startswith("def fn_0(_param0):")
+
+
+def test_errors(server):
+    with LeroyClient(server.socket_path, timeout=30) as client:
+        with pytest.raises(RpcError) as e:
+            client.call("compile")
+        assert e.value.code == METHOD_NOT_FOUND
+        with pytest.raises(RpcError) as e:
+            client.call("rewrite", file="f1.py")
+        assert e.value.code == INVALID_PARAMS
+        with pytest.raises(RpcError) as e:
+            client.call("rewrite")
+        assert e.value.code == INVALID_PARAMS
+        # the connection is still usable after errors.
+        assert client.call("status")["files"] == 6
+    assert server.handle(b"{not json")["error"]["code"] == PARSE_ERROR
+    assert server.handle(b'{"jsonrpc": "2.0", "method": "status"}') is None  # a notification.
+
+
+def test_watcher_updates_changed_files(server):
+    project_path = pathlib.Path(server.leroy.py_files_dir)
+    project_path.joinpath("f3.py").write_text(NEW_FILE)
+    output_path = server.leroy.temp_dir.joinpath("f3.py")
+    deadline = time.time() + 30
+    while not output_path.exists() and time.time() < deadline:
+        time.sleep(0.05)
+    assert output_path.read_text() == "from leroy_library import fn_0\nmain = fn_0('new file')"
+    with LeroyClient(server.socket_path, timeout=30) as client:
+        assert client.call("status")["files"] == 7
+
+
+def test_shutdown(server):
+    with LeroyClient(server.socket_path, timeout=30) as client:
+        assert client.call("shutdown") is True
+    assert server.stopped.wait(5)
+
+
+def test_unchanged_files_are_not_rewritten_again(server, monkeypatch):
+    path = str(pathlib.Path(server.leroy.py_files_dir).joinpath("duplicate_almost", "f1.py"))
+    assert path in server.corpus
+    rewrites = []
+    rewrite = server.leroy.stitch_runner.rewrite
+    monkeypatch.setattr(server.leroy.stitch_runner, "rewrite", lambda *args: rewrites.append(args) or rewrite(*args))
+    with server.lock:
+        assert server.rewrite(path=path)["code"] == "from leroy_library import fn_0\nmain = fn_0('Hello world')"
+        assert server.rewrite(path=path) == server.rewrite(source=pathlib.Path(path).read_text(), path=path)
+        assert rewrites == []
+
+        pathlib.Path(path).write_text(NEW_FILE)
+        server.update()
+    assert len(rewrites) == 1
+    with server.lock:
+        assert server.rewrite(path=path)["code"] == "from leroy_library import fn_0\nmain = fn_0('new file')"
+    assert len(rewrites) == 1
+
+
+def test_server_started_from_an_earlier_run(server, tmp_path):
+    leroy = Leroy(server.leroy.py_files_dir, 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"),
+                  incremental=True)
+    leroy.temp_dir = server.leroy.temp_dir
+    restarted = LeroyServer(leroy, tmp_path.joinpath("restarted.sock"))
+    with server.lock:
+        restarted.run_leroy(incremental=True)
+    # nothing changed, so nothing was rewritten: the files are rewritten on request, once.
+    assert restarted.corpus == {}
+    path = str(pathlib.Path(leroy.py_files_dir).joinpath("duplicate_almost", "f1.py"))
+    assert restarted.rewrite(path=path)["code"] == "from leroy_library import fn_0\nmain = fn_0('Hello world')"
+    assert list(restarted.corpus) == [path]
+    assert restarted.rewrite(source=NEW_FILE)["code"] == "from leroy_library import fn_0\nmain = fn_0('new file')"
+    assert list(restarted.corpus) == [path]
+
+
+def test_paths_of_corpus_files(server, tmp_path, monkeypatch):
+    # a corpus whose paths are relative to the working directory of the server.
+    monkeypatch.chdir(tmp_path)
+    leroy = Leroy("project", 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"), incremental=True)
+    leroy.temp_dir = tmp_path.joinpath("relative_out")
+    relative = LeroyServer(leroy, tmp_path.joinpath("relative.sock"))
+    with server.lock:
+        relative.run_leroy(incremental=True)
+    assert os.path.join("project", "duplicate_almost", "f1.py") in relative.corpus
+
+    rewrites = []
+    rewrite = leroy.stitch_runner.rewrite
+    monkeypatch.setattr(leroy.stitch_runner, "rewrite", lambda *args: rewrites.append(args) or rewrite(*args))
+    expected = "from leroy_library import fn_0\nmain = fn_0('Hello world')"
+    assert relative.rewrite(path=str(tmp_path.joinpath("project", "duplicate_almost", "f1.py")))["code"] == expected
+    # relative to the python files directory.
+    assert relative.rewrite(path=os.path.join("duplicate_almost", "f1.py"))["code"] == expected
+    assert [i["name"] for i in relative.abstractions_used(path=os.path.join("duplicate_almost", "f1.py"))] == ["fn_0"]
+    assert rewrites == []
@@ -1,6 +1,11 @@
+import ast
+
 import pytest
-from pybrary_extraction.lisp2py import Abstraction2Py, Rewrite2Py, Lisp2Py
+from pybrary_extraction.lisp2py import Abstraction2Py, DecodedCorpus, Rewrite2Py, Lisp2Py
+from pybrary_extraction.lisp2py.Lisp2Py import ConstructionCache
 from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction
+from pybrary_extraction.lisp2py.utils import StatementList
+from pybrary_extraction.python2lisp import Py2Lisp
 
 
 def test_basic():
@@ -529,3 +534,66 @@ def test_rewrite_to_py_forloop():
     py = Rewrite2Py(lisp_str, available_abstractions=[]).convert()
     print(py)
 
+
+
+def test_construct_copies_repeated_subtrees():
+    statement = "(Expr (Call print (__list__ (BinOp x Add 1))))"
+    lisp_str = f"(ProgramStatements (StatementList {statement} (StatementList {statement} EMPTY_Statement)))"
+    lisp_parts = Lisp2Py.wrap_statements_list(Lisp2Py.wrap_module(Lisp2Py.parse_lisp(lisp_str)))
+    cache = ConstructionCache()
+    module = Lisp2Py.construct(lisp_parts, cache)
+    assert ast.dump(module.body[0]) == ast.dump(module.body[1])
+    first, second = [list(ast.walk(i)) for i in module.body]
+    assert not {id(i) for i in first} & {id(i) for i in second}
+    assert module.body[0].value.args is not module.body[1].value.args
+
+    # nodes constructed again are not changed with the ones constructed before.
+    module.body[0].value.args.clear()
+    module = Lisp2Py.construct(lisp_parts, cache)
+    module.type_ignores = []
+    ast.fix_missing_locations(module)
+    assert ast.unparse(module) == "print(x + 1)\nprint(x + 1)"
+
+
+def test_construct_with_an_empty_cache():
+    lisp_str = "(ProgramStatements (StatementList (FunctionDef (__kw__ name f) (__kw__ args (arguments (__kw__ " \
+               "args (__list__ (arg a))))) (__kw__ body (StatementList (Return (BinOp a Add 1)) EMPTY_Statement))) " \
+               "(StatementList (Assign (__list__ b) (BinOp a Add 1)) EMPTY_Statement)))"
+    lisp_parts = Lisp2Py.wrap_statements_list(Lisp2Py.wrap_module(Lisp2Py.parse_lisp(lisp_str)))
+    cache = ConstructionCache()
+    expected = ast.dump(Lisp2Py.construct(lisp_parts, cache))
+    module = Lisp2Py.construct(lisp_parts, cache)
+    assert ast.dump(module) == expected
+    module.type_ignores = []
+    ast.fix_missing_locations(module)
+    assert ast.unparse(module) == "def f(a):\n    return a + 1\nb = a + 1"
+
+
+def test_construction_caches_are_not_shared():
+    first_corpus = ["(ProgramStatements (StatementList (Assign (__list__ a) (BinOp x Add 1)) EMPTY_Statement))"]
+    second_corpus = ["(ProgramStatements (StatementList (Return (Call f (__list__ y))) EMPTY_Statement))"]
+    first, second = DecodedCorpus(first_corpus, {}), DecodedCorpus(second_corpus, {})
+    assert [i.source for i in first] == ["a = x + 1"]
+    assert [i.source for i in second] == ["return f(y)"]
+    # the second corpus has only its own subtrees, as if it were decoded alone.
+    alone = ConstructionCache()
+    Lisp2Py(second_corpus[0], construction_cache=alone).convert(quiet=True)
+    assert second.construction_cache.subtree_ids == alone.subtree_ids
+    assert "Add" in first.construction_cache.leaf_nodes and "Add" not in second.construction_cache.leaf_nodes
+
+    first.construction_cache.clear()
+    assert not first.construction_cache.subtree_ids and not first.construction_cache.nodes
+    assert not first.construction_cache.leaf_nodes
+
+
+def test_decode_long_statement_chain():
+    n = 100000
+    statements = [f"(Assign (__list__ x_{i}) {i})" for i in range(n)]
+    lisp_str = f"(ProgramStatements {Py2Lisp.generated_constructed_list(statements)})"
+    py = Rewrite2Py(lisp_str, available_abstractions=[]).convert()
+    assert py.splitlines() == [f"x_{i} = {i}" for i in range(n)]
+
+    statement_list = "EMPTY_Statement"
+    for i in reversed(range(n)):
+        statement_list = StatementList(i, statement_list)
+    assert statement_list.decode() == list(range(n)) + ["EMPTY_Statement"]
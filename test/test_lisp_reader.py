@@ -0,0 +1,58 @@
+import json
+import pathlib
+
+import pytest
+
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.lisp2py import Lisp2Py
+
+data_path = pathlib.Path(__file__).parent.parent.joinpath("data", "python")
+
+
+def test_read():
+    assert LispReader.read("(Assign (__list__ x) (UnaryOp USub 1))") == \
+           ['Assign', ['__list__', 'x'], ['UnaryOp', 'USub', '1']]
+
+
+def test_read_whitespace_and_empty_lists():
+    assert LispReader.read("(a\n b\t(c) ())") == ['a', 'b', ['c'], []]
+
+
+def test_read_quoted_strings():
+    assert LispReader.read("(a \"x y\" b'c d)") == ['a', '"x y"', "b'c", 'd']
+    assert LispReader.read("(f b'a b')") == ['f', 'b', "'a b'"]
+    assert LispReader.read("(a it's)") == ['a', "it's"]
+
+
+def test_read_first_expression_only():
+    assert LispReader.read("(a) (b)") == ['a']
+    assert LispReader.read("(a))") == ['a']
+
+
+@pytest.mark.parametrize("lisp_str", ["", "a", "(a (b)", ")"])
+def test_read_invalid(lisp_str):
+    with pytest.raises(ValueError):
+        LispReader.read(lisp_str)
+
+
+def test_read_deep():
+    depth = 100000
+    lisp_str = "(ProgramStatements " + "(StatementList (Expr x) " * depth + "EMPTY_Statement" + ")" * (depth + 1)
+    node = LispReader.read(lisp_str)
+    for _ in range(depth + 1):
+        node = node[-1]
+    assert node == 'EMPTY_Statement'
+
+
+def test_parse_lisp_module_keyword():
+    assert Lisp2Py.parse_lisp("ProgramStatements") == ["ProgramStatements"]
+
+
+@pytest.mark.parametrize("corpus", sorted(data_path.glob("*.json")), ids=lambda x: x.name)
+def test_same_as_pyparsing(corpus):
+    pyparsing = pytest.importorskip("pyparsing")
+    with open(corpus) as f:
+        programs = json.load(f)
+    for program in programs[:10]:
+        assert LispReader.read(program) == \
+               pyparsing.OneOrMore(pyparsing.nestedExpr()).parseString(program).as_list()[0]
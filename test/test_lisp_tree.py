@@ -0,0 +1,93 @@
+import pytest
+
+from pybrary_extraction.lisp2py import Lisp2Py
+from pybrary_extraction.lisp2py.LispReader import LispReader
+from pybrary_extraction.lisp2py.LispTree import LispTree, LispTreeVisitor
+from pybrary_extraction.lisp2py.Rewrite2Py import Rewrite2Py, RewriteCalls
+from pybrary_extraction.lisp2py.StitchAbstraction import StitchAbstraction, StitchParam
+
+
+@pytest.mark.parametrize("lisp_str", [
+    "(Assign (__list__ x) (UnaryOp USub 1))",
+    "(a\n b\t(c) ())",
+    "(a \"x y\" b'c d)",
+    "(a) (b)",
+])
+def test_read(lisp_str):
+    tree = LispTree.read(lisp_str)
+    assert tree.to_lists() == LispReader.read(lisp_str)
+    assert LispTree.from_lists(tree.to_lists()).to_lists() == tree.to_lists()
+
+
+@pytest.mark.parametrize("lisp_str", ["", "a", "(a (b)", ")"])
+def test_read_invalid(lisp_str):
+    with pytest.raises(ValueError):
+        LispTree.read(lisp_str)
+
+
+def test_read_interns_symbols():
+    tree = LispTree.read("(Call f (__list__ x x))")
+    assert [i for i in tree.symbols if i not in "()"] == ['Call', 'f', '__list__', 'x']
+    assert len(tree) == 7
+    call_args = tree.child(tree.root, 2)
+    assert tree.head(call_args) == '__list__'
+    assert [tree.atom(i) for i in tree.child_nodes(call_args)] == ['__list__', 'x', 'x']
+
+
+def test_replacing_visitor():
+    class ReplacingVisitor(LispTreeVisitor):
+        def visit_FunctionDef(self, node):
+            new_node = self.generic_visit(node)
+            self.tree.set_child(new_node, 0, self.tree.add_atom('NewFunctionDef'))
+            return new_node
+
+    tree = LispTree.from_lists(['f1', ['FunctionDef', 'param1', ['FunctionDef', 'param2']]])
+    tree.root = ReplacingVisitor(tree).visit(tree.root)
+    assert tree.to_lists() == ['f1', ['NewFunctionDef', 'param1', ['NewFunctionDef', 'param2']]]
+
+
+def test_visit_long_statement_chain():
+    class NameVisitor(LispTreeVisitor):
+        def __init__(self, tree):
+            super().__init__(tree)
+            self.names = []
+
+        def visit_Name(self, node):
+            self.names.append(self.tree.atom(self.tree.child(node, 1)))
+            return node
+
+    n = 100000
+    lisp_str = "(ProgramStatements " + "".join(f"(StatementList (Expr (Name x_{i})) " for i in range(n)) + \
+               "EMPTY_Statement" + ")" * (n + 1)
+    tree = LispTree.read(lisp_str)
+    visitor = NameVisitor(tree)
+    assert visitor.visit(tree.root) == tree.root
+    # the statements are visited in order.
+    assert visitor.names == [f'x_{i}' for i in range(n)]
+
+
+def test_wrap_statements_list():
+    lisp_parts = ['ProgramStatements', ['FunctionDef', ['__kw__', 'body', ['Return', '1']]]]
+    assert Lisp2Py.wrap_statements_list(lisp_parts) == \
+           ['ProgramStatements',
+            ['StatementList',
+             ['FunctionDef', ['__kw__', 'body', ['StatementList', ['Return', '1'], 'EMPTY_Statement']]],
+             'EMPTY_Statement']]
+    assert lisp_parts == ['ProgramStatements', ['FunctionDef', ['__kw__', 'body', ['Return', '1']]]]
+
+
+def test_rewrite_calls():
+    abstraction = StitchAbstraction("(Return #0)", [], "fn_0", {})
+    abstraction.parameters = {StitchParam("_param0", 0), StitchParam("extra", 1)}
+    abstraction.returned_vars = ["y"]
+    rewrite = Rewrite2Py("", available_abstractions=[abstraction])
+    tree = Lisp2Py.wrap_module(LispTree.read(
+        "(StatementList (fn_0 x) (StatementList fn_1 (StatementList (For i fn_0 (Expr x)) EMPTY_Statement)))"))
+    tree.root = RewriteCalls(tree, rewrite).visit(tree.root)
+    assert tree.to_lists() == \
+           ['ProgramStatements',
+            ['StatementList', ['Assign', ['__list__', 'y'], ['Call', 'fn_0', ['__list__', 'x', 'extra']]],
+             ['StatementList', ['Expr', ['Call', 'fn_1']],
+              ['StatementList', ['For', 'i', ['Call', 'fn_0'], ['StatementList', ['Expr', 'x'], 'EMPTY_Statement']],
+               'EMPTY_Statement']]]]
+    assert rewrite.abstractions_used == {'fn_0', 'fn_1'}
@@ -0,0 +1,79 @@
+import ast
+
+from pybrary_extraction.lisp2py.Liveness import Liveness, NameUses
+
+
+def liveness_of(code_str, scope=lambda module: module):
+    module = ast.parse(code_str)
+    return Liveness.of_scope(scope(module)), module
+
+
+def test_live_after_straight_line():
+    liveness, module = liveness_of("x = 1\ny = 2\nx = y\nprint(x)")
+    # y is assigned before it is read.
+    assert liveness.live_after(module.body[0]) == {"print"}
+    assert liveness.live_after(module.body[1]) == {"y", "print"}
+    assert liveness.live_after(module.body[2]) == {"x", "print"}
+    assert liveness.live_after(module.body[3]) == set()
+
+
+def test_live_after_branches():
+    liveness, module = liveness_of("x = 1\nif c:\n    x = 2\nelse:\n    pass\nprint(x)")
+    assert liveness.live_after(module.body[0]) == {"c", "x", "print"}
+    assert liveness.live_after(module.body[1].body[0]) == {"x", "print"}
+
+
+def test_live_around_loops():
+    code_str = "total = 0\nfor i in items:\n    total = total + i\n    last = i\nprint(total)"
+    liveness, module = liveness_of(code_str)
+    loop_body = module.body[1].body
+    # read by the next iteration.
+    assert "total" in liveness.live_after(loop_body[0])
+    assert "last" not in liveness.live_after(loop_body[1])
+    assert "i" not in liveness.live_after(loop_body[1])
+
+
+def test_live_after_break_and_continue():
+    code_str = "while True:\n    x = f()\n    if x:\n        break\n    y = 1\n    continue\nprint(x, y)"
+    liveness, module = liveness_of(code_str)
+    loop_body = module.body[0].body
+    assert liveness.live_after(loop_body[0]) == {"f", "x", "y", "print"}
+    assert liveness.live_after(loop_body[2]) == {"f", "print", "x", "y"}
+
+
+def test_live_in_exception_handlers():
+    code_str = "try:\n    x = 1\n    y = f()\nexcept E:\n    print(x)\nelse:\n    print(y)"
+    liveness, module = liveness_of(code_str)
+    assert liveness.live_after(module.body[0].body[0]) == {"f", "x", "E", "print"}
+
+
+def test_live_at_function_exit():
+    code_str = "def f(a):\n    global g\n    g = a\n    b = a\n    return a"
+    liveness, module = liveness_of(code_str, lambda module: module.body[0])
+    body = module.body[0].body
+    assert liveness.live_after(body[1]) == {"a", "g"}
+    assert liveness.live_after(body[2]) == {"a", "g"}
+
+
+def test_live_at_class_exit():
+    code_str = "class C:\n    x = 1\n    y = x\n    def m(self):\n        return self.x"
+    liveness, module = liveness_of(code_str, lambda module: module.body[0])
+    body = module.body[0].body
+    assert liveness.live_after(body[1]) == {"x", "y"}
+    assert liveness.live_after(body[2]) == {"x", "y", "m"}
+
+
+def test_liveness_is_cached_on_the_scope():
+    module = ast.parse("x = 1")
+    assert Liveness.of_scope(module) is Liveness.of_scope(module)
+    assert module.liveness is Liveness.of_scope(module)
+
+
+def test_name_uses_of_nested_scopes():
+    uses = NameUses.of(ast.parse("def f(a, b=c):\n    d = a + e\n    return [i for i in d if i > k]"))
+    assert uses.reads == {"c", "e", "k"}
+    assert uses.writes == {"f"}
+
+    uses = NameUses.of(ast.parse("y = [x for x in xs if (z := x)]\nl = lambda v: v + w"))
+    assert uses.reads == {"xs", "w"}
+    assert uses.writes == {"y", "z", "l"}
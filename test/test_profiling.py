@@ -0,0 +1,96 @@
+import contextlib
+import io
+import json
+import pathlib
+
+import pytest
+
+from pybrary_extraction import profiling
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.enable(trace=True)
+    yield profiler
+    profiling.disable()
+
+
+def test_stages_are_not_recorded_when_disabled():
+    profiling.disable()
+    with profiling.stage("parse"):
+        pass
+    assert profiling.profiler is None
+
+
+def test_profiler_records_nested_stages(profiler):
+    for name in ["fn_0", "fn_1", "fn_0"]:
+        with profiling.stage("decode_abstraction", name):
+            with profiling.stage("liveness"):
+                sum(range(1000))
+    with profiling.stage("rewrite"):
+        pass
+
+    report = profiler.report()
+    assert list(report["stages"]) == ["decode_abstraction", "liveness", "rewrite"]
+    assert report["stages"]["liveness"]["calls"] == 3
+    assert report["stages"]["decode_abstraction"]["wall_seconds"] >= report["stages"]["liveness"]["wall_seconds"]
+    # inner stages belong to the abstraction of the stage they are in.
+    assert report["abstractions"]["fn_0"]["liveness"]["calls"] == 2
+    assert report["abstractions"]["fn_1"]["decode_abstraction"]["calls"] == 1
+    assert "rewrite" not in report["abstractions"]["fn_0"]
+    assert report["total"]["wall_seconds"] >= report["stages"]["decode_abstraction"]["wall_seconds"]
+
+    events = profiler.trace_events
+    assert [i["name"] for i in events] == ["liveness", "decode_abstraction"] * 3 + ["rewrite"]
+    assert all(i["ph"] == "X" and i["dur"] >= 0 for i in events)
+    assert events[0]["args"] == {"abstraction": "fn_0"}
+    # an inner stage lies within its outer stage.
+    assert events[1]["ts"] <= events[0]["ts"] and \
+           events[0]["ts"] + events[0]["dur"] <= events[1]["ts"] + events[1]["dur"]
+
+
+def test_profiler_records_stage_of_failed_call(profiler):
+    with pytest.raises(ValueError):
+        with profiling.stage("parse"):
+            raise ValueError()
+    assert profiler.report()["stages"]["parse"]["calls"] == 1
+    assert profiler.open_stages == []
+
+
+def test_profile_leroy_run(tmp_path):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = str(resources_path.joinpath("simple_project"))
+    leroy = Leroy(project_path, 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"))
+    leroy.temp_dir = tmp_path.joinpath("out")
+    # the stitch_core bindings may not know all of Leroy's flags, so the result comes from the cache.
+    programs = list(Py2Lisp.fromDirectoryToJson(project_path)[0].values())
+    stitch_out = stitch_core.compress(programs, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy.result_cache.put_result(programs, leroy.cache_flags(), stitch_out)
+    profiler = profiling.enable(trace=True)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            leroy.run()
+    finally:
+        profiling.disable()
+
+    report_path = tmp_path.joinpath("profile.json")
+    trace_path = tmp_path.joinpath("trace.json")
+    profiler.write_report(report_path)
+    profiler.write_trace(trace_path)
+    report = json.loads(report_path.read_text())
+    stages = report["stages"]
+    for name in ["encoding", "walk", "parse", "py2lisp", "stitch", "abstractions", "decode_uses",
+                 "decode_abstraction", "free_variables", "liveness", "decode_originals", "rewrite",
+                 "rewrite_program", "write_files", "manifest"]:
+        assert stages[name]["calls"] > 0, name
+    assert stages["rewrite_program"]["calls"] == stages["write_files"]["calls"] == len(programs)
+    assert stages["parse"]["calls"] == len(programs)
+    assert set(report["abstractions"]) == {i["name"] for i in stitch_out["abstractions"]}
+    for abstraction_stages in report["abstractions"].values():
+        assert {"decode_uses", "decode_abstraction", "free_variables", "liveness"} <= set(abstraction_stages)
+    assert len(json.loads(trace_path.read_text())["traceEvents"]) == sum(i["calls"] for i in stages.values())
+    assert "rewrite_program" in profiler.summary()
@@ -0,0 +1,157 @@
+import ast
+import contextlib
+import io
+import pathlib
+import shutil
+
+import pytest
+
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.program_pieces import assemble_program, join_program, piece_count, split_program, \
+    split_programs
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.stitch_runner import StitchRunner
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+GREETER = '''VERSION = 1
+
+
+class Greeter:
+    greeting = "Hello world"
+
+    def main():
+        print("do something")
+        print("test test")
+
+    @staticmethod
+    def other(name):
+        return name
+
+
+def helper():
+    return VERSION
+'''
+
+
+def encode(code_str):
+    return Py2Lisp().visit(ast.parse(code_str))
+
+
+def decode(lisp_str):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Leroy.rewrite_piece_to_ast(lisp_str, [], {})
+
+
+def test_split_program():
+    pieces, layout = split_program(encode(GREETER))
+    assert layout == [{"piece": 0}, {"class": 1, "body": [2, 3, 4]}, {"piece": 5}]
+    assert piece_count(layout) == len(pieces) == 6
+    assert pieces[0] == encode("VERSION = 1")
+    assert pieces[1] == encode("class Greeter:\n    pass")
+    assert pieces[4] == encode("@staticmethod\ndef other(name):\n    return name")
+    assert pieces[5] == encode("def helper():\n    return VERSION")
+
+
+def test_split_program_keeps_single_pieces():
+    for code_str in ["", "x = 1\ny = 2", "def f():\n    return 1", "class A:\n    x = 1"]:
+        lisp_str = encode(code_str)
+        assert split_program(lisp_str) == ([lisp_str], [{"piece": 0}])
+
+
+def test_join_program():
+    lisp_str = encode(GREETER)
+    assert join_program(*split_program(lisp_str)[::-1]) == lisp_str
+    with contextlib.redirect_stdout(io.StringIO()):
+        file_json_map = Py2Lisp.fromDirectoryToJson(str(resources_path.joinpath("data_structures")))[0]
+    for lisp_str in file_json_map.values():
+        pieces, layout = split_program(lisp_str)
+        assert join_program(layout, pieces) == lisp_str
+
+
+def test_assemble_program_is_like_decoding_the_whole_program():
+    with contextlib.redirect_stdout(io.StringIO()):
+        file_json_map, string_hashmap = Py2Lisp.fromDirectoryToJson(str(resources_path.joinpath("data_structures")))
+    string_hashmap = {v: k for k, v in string_hashmap.items()}
+    split_files = 0
+    for lisp_str in file_json_map.values():
+        pieces, layout = split_program(lisp_str)
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                expected = Leroy.rewrite_to_py(lisp_str, [], string_hashmap)
+            except Exception:
+                continue  # programs the decoder does not handle yet.
+            decoded = [Leroy.rewrite_piece_to_ast(i, [], string_hashmap) for i in pieces]
+        assert assemble_program(layout, decoded, None, Leroy.LIBRARY_NAME) == expected
+        split_files += len(pieces) > 1
+    assert split_files > 50
+
+
+def test_assemble_program_with_rewritten_shell():
+    pieces, layout = split_program(encode(GREETER))
+    decoded = [decode(i) for i in pieces]
+    # as if an abstraction replaced the class itself.
+    decoded[1] = ([ast.Expr(ast.Call(ast.Name("fn_0"), [], []))], ["fn_0"])
+    assembled = assemble_program(layout, decoded, lambda i: decode(pieces[i])[0], Leroy.LIBRARY_NAME)
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = Leroy.rewrite_to_py(encode(GREETER), [], {})
+    # the class keeps its original shell, with its rewritten methods and statements.
+    assert assembled == "from leroy_library import fn_0\n" + expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_leroy_run_by_definition(tmp_path, workers):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    shutil.copytree(resources_path.joinpath("simple_project", "duplicate_almost"), project_path.joinpath("a"))
+    project_path.joinpath("z").mkdir()
+    project_path.joinpath("z", "greeter.py").write_text(GREETER)
+    with contextlib.redirect_stdout(io.StringIO()):
+        simple_project = Py2Lisp.fromDirectoryToJson(str(resources_path.joinpath("simple_project")))[0]
+        pieces = split_programs(Py2Lisp.fromDirectoryToJson(str(project_path))[0])[0]
+    # the library of simple_project, which the stitch_core bindings decode well, with its uses in the pieces.
+    library = stitch_core.compress(list(simple_project.values()), iterations=1, max_arity=3, silent=True,
+                                   no_opt_arity_zero=True).json["abstractions"]
+    stitch_out = StitchRunner(tmp_path, tmp_path, "bindings").rewrite_output(list(pieces.values()), library)
+    leroy = Leroy(str(project_path), 1, 3, 10, False, False, workers=workers, cache_dir=tmp_path.joinpath("cache"),
+                  granularity="definition")
+    leroy.temp_dir = tmp_path.joinpath("out")
+    leroy.result_cache.put_result(list(pieces.values()), leroy.cache_flags(), stitch_out)
+    with contextlib.redirect_stdout(io.StringIO()):
+        leroy.run()
+
+    assert list(leroy.file_json_map) == list(pieces)
+    greeter = leroy.temp_dir.joinpath("z", "greeter.py").read_text()
+    # the method is rewritten, in its class.
+    assert greeter.startswith("from leroy_library import fn_0\nVERSION = 1\n")
+    assert "    main = fn_0('test test')\n" in greeter
+    assert ast.parse(greeter).body[2].name == "Greeter"
+    assert leroy.temp_dir.joinpath("a", "f2.py").read_text() == "from leroy_library import fn_0\nmain = fn_0('test test')"
+
+
+def test_liveness_by_definition_sees_other_pieces(tmp_path):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = tmp_path.joinpath("project")
+    project_path.mkdir()
+    for i in range(2):
+        # `result` is read by another definition than the statements that assign it.
+        project_path.joinpath(f"f{i}.py").write_text(
+            f"import math\nvalue = {i}.5\nresult = math.sqrt(value * value + 1.0)\nprint(result)\n\n\n"
+            f"def use_it():\n    return result + 1\n")
+    with contextlib.redirect_stdout(io.StringIO()):
+        pieces = list(split_programs(Py2Lisp.fromDirectoryToJson(str(project_path))[0])[0].values())
+    stitch_out = stitch_core.compress(pieces, iterations=1, max_arity=3, silent=True, no_opt_arity_zero=True).json
+    leroy = Leroy(str(project_path), 1, 3, 10, False, False, cache_dir=tmp_path.joinpath("cache"),
+                  granularity="definition")
+    leroy.temp_dir = tmp_path.joinpath("out")
+    leroy.result_cache.put_result(pieces, leroy.cache_flags(), stitch_out)
+    with contextlib.redirect_stdout(io.StringIO()):
+        leroy.run()
+
+    assert leroy.temp_dir.joinpath(f"{Leroy.LIBRARY_NAME}.py").read_text().endswith("    return result")
+    rewritten = leroy.temp_dir.joinpath("f1.py").read_text()
+    assert "result = fn_0(1.5)" in rewritten
+    namespace = {}
+    exec(compile(leroy.temp_dir.joinpath(f"{Leroy.LIBRARY_NAME}.py").read_text(), "leroy_library", "exec"), namespace)
+    exec(compile(rewritten.replace("from leroy_library import fn_0\n", ""), "f1", "exec"), namespace)
+    assert namespace["use_it"]() == namespace["result"] + 1
@@ -174,3 +174,42 @@ def test_forloop():
                        "(Subscript arr (BinOp i Add 1)) (Subscript arr high)))) (Tuple (__list__ (Subscript arr high) " \
                        "(Subscript arr (BinOp i Add 1))))) (StatementList (Return (BinOp i Add 1)) " \
                        "EMPTY_Statement)))))) (__kw__ returns int)) EMPTY_Statement))"
+
+
+def test_from_directory_parallel_matches_serial():
+    data_structures_path = resources_path.joinpath("data_structures")
+    serial_outs, serial_strings = Py2Lisp.fromDirectoryToJson(str(data_structures_path))
+    parallel_outs, parallel_strings = Py2Lisp.fromDirectoryToJson(str(data_structures_path), workers=2)
+
+    assert list(parallel_outs.items()) == list(serial_outs.items())
+    assert list(parallel_strings.items()) == list(serial_strings.items())
+
+
+def test_local_strings_are_merged_in_file_order():
+    local_id = Py2Lisp.local_string_id_template.format
+    local_lisp = f"(Expr {local_id(0)}) (Expr {local_id(1)})"
+    out_json, string_hash_map = Py2Lisp.merge_local_encodings(
+        ["f1.py", "f2.py"],
+        [(local_lisp, ["b", "a"]),
+         (local_lisp, ["a", "c"])])
+    assert out_json == {"f1.py": "(Expr STRING_0) (Expr STRING_1)",
+                        "f2.py": "(Expr STRING_1) (Expr STRING_2)"}
+    assert string_hash_map == {"b": "STRING_0", "a": "STRING_1", "c": "STRING_2"}
+
+
+def test_deeply_nested_expression():
+    code_ast = ast.parse("x = " + " + ".join(["1"] * 2000))
+    lisp_str = Py2Lisp().visit(code_ast)
+    assert lisp_str.startswith("(ProgramStatements (StatementList (Assign (__list__ x) " + "(BinOp " * 1999 + "1 Add 1)")
+
+
+def test_long_module():
+    statements = [f"x{i} = {i}" for i in range(5000)]
+    lisp_str = Py2Lisp().visit(ast.parse("\n".join(statements)))
+    encoded_statements = [f"(Assign (__list__ x{i}) {i})" for i in range(5000)]
+    assert lisp_str == f"(ProgramStatements {Py2Lisp.generated_constructed_list(encoded_statements)})"
+
+
+def test_context_is_not_encoded():
+    assert Py2Lisp().visit(ast.Load()) is None
+    assert Py2Lisp().visit(ast.parse("del x.y").body[0]) == "(Delete (__list__ (Attribute x y Del)))"
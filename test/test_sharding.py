@@ -0,0 +1,116 @@
+import contextlib
+import io
+import os
+import pathlib
+
+import pytest
+
+from pybrary_extraction.leroy import Leroy
+from pybrary_extraction.python2lisp import Py2Lisp
+from pybrary_extraction.sharding import ShardedCompression, merge_libraries, partition_by_directory, \
+    partition_by_subtrees, subtree_sketch
+from pybrary_extraction.stitch_runner import StitchRunner
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+REPEATED = "(Call (Attribute (Name foo Load) bar Load) (list (Constant 1 None) (Constant 2 None)) nil)"
+
+
+def test_partition_by_directory():
+    files = [os.path.join("repo", *i) for i in [
+        ("a", "x", "1.py"), ("a", "x", "2.py"), ("a", "y", "1.py"), ("a", "1.py"),
+        ("b", "1.py"), ("b", "2.py"), ("c", "1.py")]]
+    shards = partition_by_directory(files, "repo", 2)
+    assert sorted(sum(shards, [])) == sorted(files)
+    assert all(len(i) <= 2 for i in shards)
+    # a directory that fits in a shard is not split.
+    assert [os.path.join("repo", "a", "x", "1.py"), os.path.join("repo", "a", "x", "2.py")] in shards
+    assert [os.path.join("repo", "b", "1.py"), os.path.join("repo", "b", "2.py")] in shards
+    assert partition_by_directory(files, "repo", 10) == [sorted(files)]
+    # a flat directory is chunked.
+    flat = [os.path.join("repo", f"{i}.py") for i in range(5)]
+    assert [len(i) for i in partition_by_directory(flat, "repo", 2)] == [2, 2, 1]
+
+
+def test_subtree_sketch():
+    assert set(subtree_sketch(REPEATED)) < set(subtree_sketch(f"(Module (list {REPEATED} {REPEATED}) nil)"))
+    # subtrees with too few atoms are left out.
+    assert subtree_sketch("(Name foo Load)") == []
+    assert len(subtree_sketch(REPEATED, min_atoms=1, size=2)) == 2
+
+
+def test_partition_by_subtrees_groups_similar_files():
+    other = "(Assign (list (Name x Store)) (BinOp (Name y Load) Add (Constant 3 None)) None)"
+    file_json_map = {"a.py": f"(Module (list {REPEATED}) nil)", "b.py": f"(Module (list {other}) nil)",
+                     "c.py": f"(Module (list {REPEATED} {REPEATED}) nil)", "d.py": f"(Module (list {other} pass) nil)"}
+    shards = partition_by_subtrees(file_json_map, 2)
+    assert sorted(map(sorted, shards)) == [["a.py", "c.py"], ["b.py", "d.py"]]
+    assert partition_by_subtrees(file_json_map, 2) == shards
+    assert partition_by_subtrees(file_json_map, 4) == [sorted(file_json_map)]
+
+
+def test_merge_libraries():
+    libraries = [
+        [{"name": "fn_0", "body": "(foo #0)", "arity": 1, "dreamcoder": "", "utility": 5},
+         {"name": "fn_1", "body": "(bar (fn_0 #0))", "arity": 1, "dreamcoder": "", "utility": 20}],
+        [{"name": "fn_0", "body": "(baz #0 #1)", "arity": 2, "dreamcoder": "", "utility": 8},
+         {"name": "fn_1", "body": "(foo #0)", "arity": 1, "dreamcoder": "", "utility": 1},
+         {"name": "fn_2", "body": "(bar (fn_1 #0))", "arity": 1, "dreamcoder": "", "utility": 2}],
+    ]
+    library = merge_libraries(libraries)
+    # the same bodies are merged, and the abstractions used come first.
+    assert [(i["name"], i["body"]) for i in library] == [
+        ("fn_0", "(foo #0)"), ("fn_1", "(bar (fn_0 #0))"), ("fn_2", "(baz #0 #1)")]
+    assert library[2]["arity"] == 2
+    assert "utility" not in library[0]
+    assert merge_libraries([]) == []
+
+
+def test_unknown_partition(tmp_path):
+    with pytest.raises(ValueError):
+        ShardedCompression(StitchRunner(tmp_path, tmp_path), partition="random")
+
+
+def test_settings_have_limits(tmp_path):
+    runner = StitchRunner(tmp_path, tmp_path)
+    # a shard that runs out of memory under the lower limit adds nothing to the library.
+    assert ShardedCompression(runner, memory_mb=100).settings() != ShardedCompression(runner, memory_mb=1000).settings()
+    assert ShardedCompression(runner, cpu_seconds=10).settings() != ShardedCompression(runner).settings()
+
+
+def test_sharded_compression(tmp_path):
+    pytest.importorskip("stitch_core")
+    project_path = str(resources_path.joinpath("simple_project"))
+    file_json_map = Py2Lisp.fromDirectoryToJson(project_path)[0]
+    sharded_compression = ShardedCompression(StitchRunner(tmp_path, tmp_path, "bindings"), "directory", 2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stitch_out = sharded_compression.compress(
+            file_json_map, project_path, dict(iterations=1, max_arity=3, no_opt_arity_zero=True))
+    assert stitch_out["original"] == list(file_json_map.values())
+    assert len(stitch_out["rewritten"]) == len(file_json_map)
+    # an abstraction of each of the 3 shards, used in the corpus.
+    assert [i["name"] for i in stitch_out["abstractions"]] == ["fn_0", "fn_1", "fn_2"]
+    assert all(i["uses"] for i in stitch_out["abstractions"])
+    assert tmp_path.joinpath("shards", "shard_2").is_dir()
+
+
+def test_sharded_leroy_run(tmp_path):
+    stitch_core = pytest.importorskip("stitch_core")
+    project_path = str(resources_path.joinpath("simple_project"))
+    leroy = Leroy(project_path, 1, 3, 10, False, False, use_cache=False, stitch_backend="bindings",
+                  shard_by="subtrees", shard_files=10)
+    leroy.temp_dir = tmp_path
+    # the stitch_core bindings may not know all of Leroy's flags.
+    flags = dict(iterations=1, max_arity=3, no_opt_arity_zero=True)
+    leroy.stitch_flags = lambda: flags
+    with contextlib.redirect_stdout(io.StringIO()):
+        leroy.run()
+
+    # in a single shard, rewriting with the library of the shard gives what compress did.
+    programs = list(Py2Lisp.fromDirectoryToJson(project_path)[0].values())
+    expected = stitch_core.compress(programs, silent=True, **flags).json
+    stitch_out = leroy.stitch_out.load()
+    assert stitch_out["rewritten"] == expected["rewritten"]
+    assert [(i["body"], i["uses"]) for i in stitch_out["abstractions"]] == \
+           [(i["body"], i["uses"]) for i in expected["abstractions"]]
+    assert tmp_path.joinpath(f"{Leroy.LIBRARY_NAME}.py").exists()
@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+
+from pybrary_extraction.stitch_output import JsonReader, StitchOutputFile, write_json_array, write_stitch_output
+
+STITCH_OUT = {
+    "cmd": None,
+    "original_cost": 123456789,
+    "original": ["(ProgramStatements (Expr (Call (Name print) 'a \\\" b')))", "(ProgramStatements )"],
+    "rewritten": ["(ProgramStatements (fn_0 STRING_1))", "(ProgramStatements )"],
+    "abstractions": [
+        {"name": "fn_0", "body": "(Expr #0)", "arity": 1, "uses": [{"fn_0 STRING_1": "STRING_1"}],
+         "utility": -1.5e3, "nested": {"empty": [], "values": [True, False, None, {}]}},
+    ],
+    "final_cost": 0.25,
+}
+
+
+def reader_of(value, chunk_size):
+    f = io.StringIO(json.dumps(value, indent=4))
+    f.name = "test.json"
+    return JsonReader(f, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 16])
+def test_json_reader_reads_items(chunk_size):
+    reader = reader_of(STITCH_OUT, chunk_size)
+    read = {}
+    for key in reader.iter_object():
+        read[key] = list(reader.iter_array()) if reader.next_char() == "[" else reader.read_value()
+    assert read == STITCH_OUT
+    assert reader.next_char() == ""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+def test_json_reader_skips_values(chunk_size):
+    reader = reader_of(STITCH_OUT, chunk_size)
+    assert StitchOutputFile.find_key(reader, "final_cost")
+    # a number at the end of the document is not cut off at a chunk boundary.
+    assert reader.read_value() == 0.25
+    assert not StitchOutputFile.find_key(reader_of(STITCH_OUT, chunk_size), "missing")
+
+
+def test_json_reader_rejects_truncated_array():
+    f = io.StringIO('["a", "b"')
+    f.name = "test.json"
+    with pytest.raises(ValueError):
+        list(JsonReader(f, 2).iter_array())
+
+
+def test_stitch_output_file(tmp_path):
+    path = tmp_path.joinpath("out.json")
+    path.write_text(json.dumps(STITCH_OUT, indent=4))
+    stitch_out = StitchOutputFile(path)
+    assert stitch_out["original_cost"] == STITCH_OUT["original_cost"]
+    assert stitch_out["cmd"] is None
+    # arrays can be iterated more than once.
+    for _ in range(2):
+        assert list(stitch_out["rewritten"]) == STITCH_OUT["rewritten"]
+    assert list(stitch_out["abstractions"]) == STITCH_OUT["abstractions"]
+    assert stitch_out.get("missing", 1) == 1
+    with pytest.raises(KeyError):
+        stitch_out["missing"]
+    assert stitch_out.keys() == list(STITCH_OUT)
+    assert stitch_out.load() == STITCH_OUT
+
+
+def test_write_stitch_output(tmp_path):
+    path = tmp_path.joinpath("out.json")
+    write_stitch_output(path, STITCH_OUT)
+    assert json.loads(path.read_text()) == STITCH_OUT
+    assert "\n" not in path.read_text()
+
+    copy_path = tmp_path.joinpath("copy.json")
+    write_stitch_output(copy_path, StitchOutputFile(path))
+    assert copy_path.read_text() == path.read_text()
+    # writing a file onto itself leaves it as it is.
+    write_stitch_output(path, StitchOutputFile(path))
+    assert json.loads(path.read_text()) == STITCH_OUT
+
+    # a dict with arrays read from a file.
+    mixed_path = tmp_path.joinpath("mixed.json")
+    write_stitch_output(mixed_path, {"rewritten": StitchOutputFile(path)["rewritten"], "final_cost": 1})
+    assert json.loads(mixed_path.read_text()) == {"rewritten": STITCH_OUT["rewritten"], "final_cost": 1}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["copy.json", "mixed.json", "out.json"]
+
+
+def test_write_json_array(tmp_path):
+    path = tmp_path.joinpath("in.json")
+    write_json_array(path, iter(STITCH_OUT["original"]))
+    assert json.loads(path.read_text()) == STITCH_OUT["original"]
+    write_json_array(path, [])
+    assert json.loads(path.read_text()) == []
@@ -0,0 +1,87 @@
+import json
+import sys
+
+import pytest
+
+from pybrary_extraction.stitch_runner import StitchRunner, StitchUnavailable
+
+PROGRAMS = ["(foo (bar baz qux) 1)", "(foo (bar baz qux) 2)", "(foo (bar baz qux) 3)"]
+
+# writes what it was called with, in the shape of compress's output.
+FAKE_COMPRESS = f"""#!{sys.executable}
+import json, sys
+in_file = sys.argv[1]
+out_file = next(arg for arg in sys.argv if arg.startswith("--out=")).split("=", 1)[1]
+with open(in_file) as f:
+    programs = json.load(f)
+with open(out_file, "w") as f:
+    json.dump({{"args": sys.argv[2:], "original": programs, "rewritten": programs, "abstractions": []}}, f)
+"""
+
+
+@pytest.fixture
+def fake_binary(tmp_path, monkeypatch):
+    binary = tmp_path.joinpath("compress")
+    binary.write_text(FAKE_COMPRESS)
+    binary.chmod(0o755)
+    monkeypatch.setenv(StitchRunner.BINARY_ENV_VAR, str(binary))
+    return binary
+
+
+def test_command_line_flags():
+    flags = StitchRunner.command_line_flags(
+        {"iterations": 3, "max_arity": 2, "prune_macro_abstractions": True, "no_opt_arity_zero": False})
+    assert flags == ["--iterations=3", "--max-arity=2", "--prune-macro-abstractions"]
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        StitchRunner(tmp_path, tmp_path, backend="rust")
+
+
+def test_bindings_backend(tmp_path):
+    pytest.importorskip("stitch_core")
+    runner = StitchRunner(tmp_path, tmp_path, backend="bindings")
+    stitch_out = runner.compress(PROGRAMS, iterations=1, max_arity=2, no_opt_arity_zero=True)
+    assert runner.used_backend == "bindings"
+    assert stitch_out["original"] == PROGRAMS
+    assert len(stitch_out["abstractions"]) == 1
+    assert not tmp_path.joinpath("in.json").exists()
+
+
+def test_binary_backend(tmp_path, fake_binary):
+    runner = StitchRunner(tmp_path, tmp_path, backend="binary")
+    stitch_out = runner.compress(PROGRAMS, iterations=2, max_arity=3, prune_macro_abstractions=True)
+    assert runner.used_backend == "binary"
+    assert list(stitch_out["original"]) == PROGRAMS
+    assert list(stitch_out["args"])[1:] == ["--iterations=2", "--max-arity=3", "--prune-macro-abstractions", "--threads=1"]
+
+
+def test_auto_falls_back_to_binary(tmp_path, fake_binary, monkeypatch):
+    # as if the stitch_core bindings were not installed.
+    monkeypatch.setitem(sys.modules, "stitch_core", None)
+    runner = StitchRunner(tmp_path, tmp_path)
+    stitch_out = runner.compress(PROGRAMS, iterations=1, max_arity=2)
+    assert runner.used_backend == "binary"
+    assert list(stitch_out["original"]) == PROGRAMS
+
+
+def test_binary_backend_without_binary(tmp_path, monkeypatch):
+    monkeypatch.delenv(StitchRunner.BINARY_ENV_VAR, raising=False)
+    with pytest.raises(StitchUnavailable):
+        StitchRunner(tmp_path, tmp_path, backend="binary").compress(PROGRAMS, iterations=1, max_arity=2)
+
+
+def test_settings(tmp_path, fake_binary):
+    tmp_path.joinpath("Cargo.toml").write_text('[package]\nname = "stitch_core"\nversion = "0.1.0"\n')
+    runner = StitchRunner(tmp_path, tmp_path, backend="binary")
+    settings = runner.settings()
+    assert settings["backend"] == "binary" and list(settings["versions"]) == ["binary"]
+    # another build of the binary.
+    fake_binary.write_text(FAKE_COMPRESS + "\n")
+    assert runner.settings() != settings
+
+    settings = StitchRunner(tmp_path, tmp_path).settings()
+    assert list(settings["versions"]) == ["bindings", "binary", "cargo"]
+    assert settings["versions"]["cargo"] == "0.1.0"
+    assert StitchRunner(tmp_path, tmp_path, backend="bindings").settings() != settings
@@ -0,0 +1,60 @@
+import pathlib
+
+import pytest
+
+from pybrary_extraction.lisp2py.utils import get_undef_vars, pylint_undef_vars
+
+resources_path = pathlib.Path(__file__).parent.joinpath("resources")
+
+
+def test_undef_vars():
+    assert get_undef_vars("x = y + 1\nprint(x, z)") == {"y", "z"}
+
+
+def test_undef_vars_scopes():
+    code_str = "def f(a, *b, k=c, **kw):\n" \
+               "    d = [e for e in a if e in g]\n" \
+               "    def h():\n" \
+               "        return d + k + i\n" \
+               "    return h\n" \
+               "class C(Base):\n" \
+               "    attr = 1\n" \
+               "    def m(self):\n" \
+               "        return attr, __class__\n"
+    assert get_undef_vars(code_str) == {"c", "g", "i", "Base", "attr"}
+
+
+def test_undef_vars_module_definitions():
+    code_str = "import os\nfrom a import b as c\nfor i in x: pass\n" \
+               "with open(__file__) as fh: pass\ntry: pass\nexcept E as e: pass\n" \
+               "(w := 3)\nt: int\ndef f():\n    global g\n    g = 1\n" \
+               "print(os, c, i, fh, e, w, t, g, __name__)"
+    assert get_undef_vars(code_str) == {"x", "E"}
+
+
+def test_undef_vars_scope_named_top():
+    assert get_undef_vars("def top(self):\n    return self.x + y") == {"y"}
+
+
+def test_undef_vars_deleted():
+    assert get_undef_vars("del x\ndef f():\n    del y\n    z = 1\n    del z") == {"x", "y"}
+
+
+def test_undef_vars_name_error_guard():
+    code_str = "try:\n    x\nexcept NameError:\n    y\nz"
+    assert get_undef_vars(code_str) == {"y", "z"}
+
+
+def test_undef_vars_syntax_error():
+    assert get_undef_vars("x = (") == set()
+
+
+def test_same_as_pylint():
+    pytest.importorskip("pylint")
+    py_files = sorted(resources_path.glob("**/*.py"))
+    expected = pylint_undef_vars([str(resources_path)])
+    expected = {str(pathlib.Path(path).resolve()): undef_vars for path, undef_vars in expected.items()}
+    for py_file in py_files:
+        with open(py_file) as f:
+            code_str = f.read()
+        assert get_undef_vars(code_str) == expected.get(str(py_file.resolve()), set()), py_file